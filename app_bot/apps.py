@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AppBotConfig(AppConfig):
     name = 'app_bot'
+
+    def ready(self):
+        import app_bot.signals  # Импортируем сигналы
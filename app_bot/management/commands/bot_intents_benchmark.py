@@ -0,0 +1,116 @@
+import random
+import re
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from nltk import word_tokenize
+from nltk.corpus import stopwords
+from nltk.stem import SnowballStemmer
+
+from app_bot.versions.v1_0.repositories import IntentIndex, ChatterBotRepository
+
+# python manage.py bot_intents_benchmark --intents=200 --variants=10 --messages=500
+
+_SYLLABLES = ['ра', 'бо', 'та', 'сме', 'на', 'ва', 'кан', 'си', 'я', 'зар', 'пла', 'та', 'ме', 'нед', 'жер',
+              'про', 'пуск', 'ко', 'д', 'ча', 'с', 'до', 'ку', 'мент', 'ы', 'ли', 'ст', 'ок', 'ом']
+
+
+def legacy_normalize_text(text):
+    # Прежняя реализация: стоп-слова и стеммер создаются заново на каждый вызов
+    clean = re.sub(r'[^ a-z A-Z А-Я а-я Ёё 0-9]', " ", text)
+    words = word_tokenize(clean)
+
+    stop_words = stopwords.words('russian')
+    stop_words.remove('да')
+    stop_words.remove('нет')
+    stop_words.remove('есть')
+
+    snowball = SnowballStemmer(language='russian')
+
+    return list(map(lambda y, s=snowball: s.stem(y), list(filter(lambda x, stop=stop_words: x not in stop, words))))
+
+
+def legacy_relevancy(intent, text):
+    suitable_request_variant_words_count = 0
+    suitable_request_common_words_count = 0
+    text_words_normal = legacy_normalize_text(text)
+
+    for request_variant in intent['request']:
+        request_words_normal = legacy_normalize_text(request_variant)
+        common_words_count = len(set(request_words_normal).intersection(text_words_normal))
+        if common_words_count > suitable_request_common_words_count:
+            suitable_request_common_words_count = common_words_count
+            suitable_request_variant_words_count = len(request_words_normal)
+        if common_words_count == len(text_words_normal) and len(text_words_normal) == len(request_words_normal):
+            suitable_request_common_words_count = common_words_count
+            suitable_request_variant_words_count = len(request_words_normal)
+            break
+
+    if suitable_request_variant_words_count:
+        return suitable_request_common_words_count / suitable_request_variant_words_count
+    return 0
+
+
+class Command(BaseCommand):
+    help = "Сравнение прежнего и индексного подбора тем бота на синтетическом наборе тем."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intents', type=int, default=200, help="Количество тем")
+        parser.add_argument('--variants', type=int, default=10, help="Вариантов запроса на тему")
+        parser.add_argument('--messages', type=int, default=500, help="Количество входящих сообщений")
+        parser.add_argument('--legacy-messages', type=int, default=20,
+                            help="Сколько сообщений прогнать через прежний путь (он очень медленный)")
+        parser.add_argument('--seed', type=int, default=42)
+
+    @staticmethod
+    def make_word(rnd):
+        return ''.join(rnd.choice(_SYLLABLES) for _ in range(rnd.randint(2, 4)))
+
+    def make_phrase(self, rnd, vocabulary):
+        return ' '.join(rnd.choice(vocabulary) for _ in range(rnd.randint(2, 6)))
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        vocabulary = list({self.make_word(rnd) for _ in range(3000)})
+
+        intents = [{
+            'code': i,
+            'topic': f'Тема {i}',
+            'request': [self.make_phrase(rnd, vocabulary) for _ in range(options['variants'])],
+            'response': ['Ответ'],
+        } for i in range(options['intents'])]
+        messages = [self.make_phrase(rnd, vocabulary) for _ in range(options['messages'])]
+
+        started = perf_counter()
+        index = IntentIndex(intents)
+        build_time = perf_counter() - started
+
+        started = perf_counter()
+        for text in messages:
+            index.search(text, min_relevancy=0.3)
+        indexed_time = (perf_counter() - started) / len(messages)
+
+        legacy_messages = messages[:options['legacy_messages']]
+        started = perf_counter()
+        for text in legacy_messages:
+            [legacy_relevancy(intent, text) for intent in intents]
+        legacy_time = (perf_counter() - started) / max(len(legacy_messages), 1)
+
+        # Проверяем, что результаты совпадают
+        mismatches = 0
+        for text in legacy_messages:
+            expected = {i['code']: legacy_relevancy(i, text) for i in intents}
+            expected = {code: r for code, r in expected.items() if r >= 0.3}
+            found = {i['code']: i['relevancy'] for i in index.search(text, min_relevancy=0.3)}
+            mismatches += expected != found
+
+        self.stdout.write(
+            f"Темы: {len(intents)} x {options['variants']} вариантов, сообщений: {len(messages)}\n"
+            f"Построение индекса: {build_time * 1000:.1f} мс\n"
+            f"Прежний путь: {legacy_time * 1000:.3f} мс/сообщение\n"
+            f"Индекс: {indexed_time * 1000:.3f} мс/сообщение\n"
+            f"Ускорение: x{legacy_time / indexed_time if indexed_time else 0:.0f}\n"
+            f"Расхождений: {mismatches}\n"
+        )
+        self.stdout.write(f"Кэш стемминга: {ChatterBotRepository.stem.cache_info()}\n")
+        self.stdout.write("[DONE]\n")
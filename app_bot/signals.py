@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from app_bot.models import Intent, IntentRequest, IntentResponse
+from app_bot.versions.v1_0.repositories import ChatterBotRepository
+
+
+@receiver(post_save, sender=Intent)
+@receiver(post_delete, sender=Intent)
+@receiver(post_save, sender=IntentRequest)
+@receiver(post_delete, sender=IntentRequest)
+@receiver(post_save, sender=IntentResponse)
+@receiver(post_delete, sender=IntentResponse)
+def invalidate_intents_index(sender, instance, **kwargs):
+    # Темы или варианты запросов/ответов изменились - индекс бота нужно перестроить во всех процессах
+    ChatterBotRepository.invalidate_intents_index()
@@ -10,6 +10,7 @@ from app_sockets.enums import AvailableRoom, AvailableVersion
 from app_sockets.mappers import RoutingMapper
 from app_users.enums import AccountType, NotificationAction, NotificationType, NotificationIcon
 from backend.controllers import PushController
+from backend.counters import UnreadCounters
 from backend.utils import datetime_to_timestamp
 from giberno.celery import app
 
@@ -182,6 +183,7 @@ def add_managers_to_chat(version, chat):
     managers, managers_sockets, blocked_at = chat_repository().get_managers_and_sockets(chat.id)
     if managers:
         chat.users.add(*managers)  # добавляем в m2m несколько менеджеров с десериализацией через *
+        UnreadCounters().reset_chats([m.id for m in managers])  # Счетчики пересчитаются с учетом нового чата
 
         # Отправляем всем релевантным менеджерам по сокетам смену состояния чата
         for socket_id in managers_sockets:
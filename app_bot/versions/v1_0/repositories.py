@@ -1,13 +1,20 @@
 import random
 import re
+from functools import lru_cache
+from time import monotonic
 
 from channels.db import database_sync_to_async
+from loguru import logger
 from nltk import word_tokenize
 from nltk.corpus import stopwords
 from nltk.stem import SnowballStemmer
+from redis import RedisError
 
 from app_bot.enums import TelegramBotNotificationType, ChatterBotIntentCode
 from app_bot.models import BotChat, BotMessage, Intent
+from backend.utils import get_redis_connection
+
+_snowball = SnowballStemmer(language='russian')
 
 
 class TelegramBotRepository:
@@ -40,11 +47,88 @@ class TelegramBotRepository:
         )
 
 
+class IntentIndex:
+    """
+        Предварительно нормализованные темы бота
+        - у каждой темы список вариантов запроса в виде (множество нормализованных слов, количество слов)
+        - инвертированный индекс слово -> номера тем, в вариантах которых оно встречается
+
+        Темы без общих слов с текстом имеют нулевую релевантность, поэтому считаются только кандидаты из индекса
+    """
+
+    def __init__(self, intents):
+        self.intents = intents
+        self.variants = []
+        self.words_index = {}
+
+        for position, intent in enumerate(intents):
+            variants = []
+            for request_variant in intent['request']:
+                words = ChatterBotRepository.normalize_text(request_variant)
+                variants.append((frozenset(words), len(words)))
+                for word in words:
+                    self.words_index.setdefault(word, set()).add(position)
+            self.variants.append(variants)
+
+    def calculate_relevancy(self, position, text_words_normal):
+        # Та же логика, что и в ChatterBotRepository.calculate_intent_relevancy, но без повторной нормализации
+        relevancy = 0
+        suitable_request_variant_words_count = 0
+        suitable_request_common_words_count = 0
+
+        text_words_set = set(text_words_normal)
+        text_words_count = len(text_words_normal)
+
+        for request_words_set, request_words_count in self.variants[position]:
+            common_words_count = len(request_words_set & text_words_set)
+
+            if common_words_count > suitable_request_common_words_count:
+                suitable_request_common_words_count = common_words_count
+                suitable_request_variant_words_count = request_words_count
+
+            if common_words_count == text_words_count and text_words_count == request_words_count:
+                suitable_request_common_words_count = common_words_count
+                suitable_request_variant_words_count = request_words_count
+                break
+
+        if suitable_request_variant_words_count:
+            relevancy = suitable_request_common_words_count / suitable_request_variant_words_count
+
+        return relevancy
+
+    def search(self, text, min_relevancy=0):
+        text_words_normal = ChatterBotRepository.normalize_text(text)
+
+        candidates = set()
+        for word in text_words_normal:
+            candidates |= self.words_index.get(word, set())
+
+        found_intents = []
+        for position in sorted(candidates):  # Порядок тем как в бд
+            relevancy = self.calculate_relevancy(position, text_words_normal)
+            if relevancy >= min_relevancy:
+                found_intents.append({
+                    'relevancy': relevancy,
+                    **self.intents[position]
+                })
+
+        return found_intents
+
+
 class ChatterBotRepository:
     _DEFAULT_BOT_ANSWER = 'Попробуйте переформулировать свой запрос'
     _MANY_INTENTS_FOUND = 'Найдено несколько подходящих тем'
     _INTENT_EMPTY_RESPONSE = 'Тема без вариантов ответов'
 
+    # Версия тем в redis увеличивается при изменении тем/вариантов (см. app_bot.signals),
+    # индекс процесса перестраивается, если версия изменилась. Версию проверяем не чаще раза в N секунд
+    INTENTS_VERSION_KEY = 'bot:intents:version'
+    INTENTS_VERSION_CHECK_INTERVAL = 10
+
+    _index = None
+    _index_version = None
+    _index_checked_at = 0
+
     @staticmethod
     def get_intents():
         # Темы, на которые бот может отвечать
@@ -61,27 +145,56 @@ class ChatterBotRepository:
         return prepared_intents
 
     @staticmethod
-    def normalize_text(text):
+    def get_intents_version():
+        try:
+            return get_redis_connection().get(ChatterBotRepository.INTENTS_VERSION_KEY)
+        except RedisError as e:
+            logger.error(e)
+            return None
+
+    @staticmethod
+    def invalidate_intents_index():
+        try:
+            get_redis_connection().incr(ChatterBotRepository.INTENTS_VERSION_KEY)
+        except RedisError as e:
+            logger.error(e)
+        ChatterBotRepository._index = None
+
+    @classmethod
+    def get_intents_index(cls):
+        if cls._index is not None and monotonic() - cls._index_checked_at < cls.INTENTS_VERSION_CHECK_INTERVAL:
+            return cls._index
+
+        version = cls.get_intents_version()
+        if cls._index is None or version != cls._index_version:
+            ChatterBotRepository._index = IntentIndex(cls.get_intents())
+            ChatterBotRepository._index_version = version
+
+        ChatterBotRepository._index_checked_at = monotonic()
+        return cls._index
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def get_stop_words():
+        stop_words = set(stopwords.words('russian'))
+        # Оставляем слова да нет есть
+        stop_words -= {'да', 'нет', 'есть'}
+        return frozenset(stop_words)
+
+    @staticmethod
+    @lru_cache(maxsize=20000)
+    def stem(word):
+        return _snowball.stem(word)
+
+    @classmethod
+    def normalize_text(cls, text):
         # Удаление слов паразитов, лишних символов, окончаний
         clean = re.sub(r'[^ a-z A-Z А-Я а-я Ёё 0-9]', " ", text)
         words = word_tokenize(clean)
 
-        stop_words = stopwords.words('russian')
-        # Оставляем слова да нет есть
-        stop_words.remove('да')
-        stop_words.remove('нет')
-        stop_words.remove('есть')
-
-        snowball = SnowballStemmer(language='russian')
-
-        words = list(
-            map(
-                lambda y, s=snowball: s.stem(y),
-                # words
-                list(filter(lambda x, stop=stop_words: x not in stop, words))  # TODO пока отключим стопслова
-            )
-        )
-        return words
+        stop_words = cls.get_stop_words()
+
+        return [cls.stem(word) for word in words if word not in stop_words]
 
     @classmethod
     def calculate_intent_relevancy(cls, intent, text):
@@ -127,16 +240,11 @@ class ChatterBotRepository:
         # TODO подумать необходимо ли определнная реакция на мат и брань, если да,
         #  то добавить надстройку над INTENTS что пользователь матерится
 
-        found_intent = None  # Бот пока не нашел подходящей темы
         _MIN_INTENT_RELEVANCY = 0.3  # Минимальная релевантность темы для данного текста
 
-        processed_intents = []
-
-        for intent in cls.get_intents():
-            processed_intents.append(cls.calculate_intent_relevancy(intent, text))
-
+        # Релевантность считается только для тем, имеющих общие слова с текстом (по индексу)
         found_intents = sorted(
-            list(filter(lambda x, min_rlv=_MIN_INTENT_RELEVANCY: x['relevancy'] >= min_rlv, processed_intents)),
+            cls.get_intents_index().search(text, min_relevancy=_MIN_INTENT_RELEVANCY),
             key=lambda x: x['relevancy'],
             reverse=True  # По убыванию
         )
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AppChatsConfig(AppConfig):
     name = 'app_chats'
+
+    def ready(self):
+        import app_chats.signals  # Импортируем сигналы
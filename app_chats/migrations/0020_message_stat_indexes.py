@@ -0,0 +1,20 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки записи в таблицу (CREATE INDEX CONCURRENTLY вне транзакции)
+    atomic = False
+
+    dependencies = [
+        ('app_chats', '0019_auto_20210518_1342'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='messagestat',
+            index=models.Index(fields=['message', 'user', 'is_read'], name='app_chats__message_stat__msg'),
+        ),
+    ]
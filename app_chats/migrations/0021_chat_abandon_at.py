@@ -0,0 +1,40 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+NEED_MANAGER = 1  # ChatManagerState.NEED_MANAGER
+MANAGER_CONNECTED = 2  # ChatManagerState.MANAGER_CONNECTED
+AUTO_SWITCH_TO_BOT_MIN = 15  # settings.AUTO_SWITCH_TO_BOT_MIN на момент миграции
+
+
+def fill_abandon_at(apps, schema_editor):
+    # Первичное заполнение дедлайна перевода на бота (аналог ChatsRepository.get_abandon_at)
+    Chat = apps.get_model('app_chats', 'Chat')
+    Message = apps.get_model('app_chats', 'Message')
+
+    last_message_created_at = Message.objects.filter(
+        chat_id=OuterRef('id')
+    ).order_by('-created_at').values('created_at')[:1]
+
+    Chat.objects.filter(
+        state__in=[NEED_MANAGER, MANAGER_CONNECTED]
+    ).update(abandon_at=Subquery(last_message_created_at) + timedelta(minutes=AUTO_SWITCH_TO_BOT_MIN))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('app_chats', '0020_message_stat_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='abandon_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True,
+                                       verbose_name='Время перевода на бота без активности'),
+        ),
+        migrations.RunPython(fill_abandon_at, migrations.RunPython.noop),
+    ]
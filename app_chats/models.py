@@ -44,6 +44,12 @@ class Chat(BaseModel):
         verbose_name='Активные менеджеры', related_name='ruled_chats'
     )
 
+    # Момент перевода чата на бота при отсутствии сообщений (только для NEED_MANAGER и MANAGER_CONNECTED)
+    # Пересчитывается при сохранении чата и сдвигается новыми сообщениями, check_abandoned_chats выбирает наступившие
+    abandon_at = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name='Время перевода на бота без активности'
+    )
+
     def __str__(self):
         return f'{self.id} - {self.subject_user.username if self.subject_user else None}=>{self.target_ct_name}'
 
@@ -110,3 +116,8 @@ class MessageStat(BaseModel):
         db_table = 'app_chats__message_stat'
         verbose_name = 'Состояние сообщения для пользователя'
         verbose_name_plural = 'Состояния сообщений для пользователей'
+        indexes = [
+            # Статистика пользователя по сообщению (прочтение, подсчет непрочитанных). Поле chat при создании
+            # статистики не заполняется, поэтому выборки идут по сообщению, а не по чату
+            models.Index(fields=['message', 'user', 'is_read'], name='app_chats__message_stat__msg'),
+        ]
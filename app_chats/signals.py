@@ -0,0 +1,30 @@
+from django.db.models.signals import pre_save, post_save, post_init
+from django.dispatch import receiver
+
+from app_chats.models import Chat, Message
+from app_chats.versions.v1_0.repositories import ChatsRepository
+
+
+@receiver(post_init, sender=Chat)
+def remember_chat_state(sender, instance: Chat, **kwargs):
+    # Через __dict__, чтобы не подгружать отложенное поле на каждый экземпляр
+    instance._abandon_at_state = instance.__dict__.get('state')
+
+
+@receiver(pre_save, sender=Chat)
+def set_abandon_at(sender, instance: Chat, **kwargs):
+    # Пересчитываем момент перевода чата на бота только при создании чата или смене состояния,
+    # дальше дедлайн сдвигают новые сообщения (extend_chat_abandon_at)
+    if instance._state.adding or getattr(instance, '_abandon_at_state', None) != instance.state:
+        instance.abandon_at = ChatsRepository.get_abandon_at(instance)
+
+
+@receiver(post_save, sender=Chat)
+def update_chat_state(sender, instance: Chat, **kwargs):
+    instance._abandon_at_state = instance.state
+
+
+@receiver(post_save, sender=Message)
+def extend_chat_abandon_at(sender, instance: Message, created, **kwargs):
+    if created and instance.chat_id:
+        ChatsRepository.extend_abandon_at(instance.chat_id, instance.created_at)
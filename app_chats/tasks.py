@@ -1,15 +1,10 @@
-from datetime import timedelta
-
 from celery import group
-from django.db.models import Max
 from django.utils.timezone import now
 
 from app_sockets.controllers import SocketController
 from app_sockets.enums import AvailableRoom, AvailableVersion
 from app_sockets.mappers import RoutingMapper
-from backend.utils import TruncMilliecond
 from giberno.celery import app
-from giberno.settings import AUTO_SWITCH_TO_BOT_MIN
 from .enums import ChatManagerState, ChatMessageType, ChatMessageIconType
 from .models import Chat
 
@@ -18,22 +13,13 @@ _ITEMS_PER_ITERATION = 5
 
 @app.task
 def check_abandoned_chats():
-    # Ищем все чаты, у которых state
-    # NEED_MANAGER = 1
-    # MANAGER_CONNECTED = 2
-    # и нет активности более 15 минут и переводим их в BOT_IS_USED = 0
-    abandoned_chats = Chat.objects.annotate(
-        last_message_created_at=Max(
-            # Округляем до миллисекунд, так как в бд DateTimeField хранит с точностью до МИКРОсекунд
-            TruncMilliecond('messages__created_at')
-        )
-    ).filter(
-        state__in=[ChatManagerState.NEED_MANAGER.value, ChatManagerState.MANAGER_CONNECTED.value],
-        last_message_created_at__lt=now() - timedelta(minutes=AUTO_SWITCH_TO_BOT_MIN)
-    )
+    # Чаты в состоянии NEED_MANAGER или MANAGER_CONNECTED без сообщений более AUTO_SWITCH_TO_BOT_MIN минут
+    # переводим в BOT_IS_USED. Выбираются по индексу abandon_at только чаты с наступившим дедлайном
+    chat_repository = RoutingMapper.room_repository(
+        version=AvailableVersion.V1_0.value, room_name=AvailableRoom.CHATS.value)
 
     jobs = group(
-        [auto_update_abandoned_chat_state.s(chat.id) for chat in abandoned_chats])
+        [auto_update_abandoned_chat_state.s(chat_id) for chat_id in chat_repository.get_abandoned_chats_ids()])
     jobs.apply_async()
 
 
@@ -49,6 +35,12 @@ def auto_update_abandoned_chat_state(chat_id):
 
     chat = chat_repository().get_by_id(chat_id)
 
+    # Пока задача ждала в очереди, в чат могли написать или сменить состояние - сверяем дедлайн по сообщениям
+    abandon_at = chat_repository.get_abandon_at(chat)
+    if abandon_at is None or abandon_at > now():
+        Chat.objects.filter(id=chat_id).update(abandon_at=abandon_at)
+        return
+
     chat.updated_at = now()
     chat.state = ChatManagerState.BOT_IS_USED.value
     chat.save()
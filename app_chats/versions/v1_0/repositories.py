@@ -1,11 +1,11 @@
 import uuid
+from datetime import timedelta
 
 from channels.db import database_sync_to_async
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.db.models import Prefetch, Count, Max, Q, Subquery, OuterRef, Case, When, F, IntegerField, \
-    Exists, Sum, Window, Value
-from django.db.models.functions import Coalesce
+    Exists, Value
 from django.db.models.query import prefetch_related_objects
 from django.utils.timezone import now
 from djangorestframework_camel_case.util import camelize, underscoreize
@@ -19,6 +19,7 @@ from app_market.versions.v1_0.repositories import ShiftAppealsRepository, Vacanc
 from app_media.enums import MediaType, MediaFormat
 from app_media.models import MediaModel
 from app_media.versions.v1_0.repositories import MediaRepository
+from app_sockets.versions.v1_0.repositories import SocketsRepository
 from app_users.enums import AccountType
 from app_users.models import UserProfile
 from app_users.versions.v1_0.repositories import ProfileRepository
@@ -26,12 +27,17 @@ from backend.errors.enums import RESTErrors
 from backend.errors.exceptions import EntityDoesNotExistException, ForbiddenException
 from backend.errors.http_exceptions import HttpException
 from backend.mixins import MasterRepository
-from backend.utils import chained_get, ArrayRemove, datetime_to_timestamp, TruncMilliecond
+from backend.counters import UnreadCounters
+from backend.utils import chained_get, ArrayRemove, datetime_to_timestamp, TruncMilliecond, paginate
+from giberno.settings import AUTO_SWITCH_TO_BOT_MIN
 
 
 class ChatsRepository(MasterRepository):
     model = Chat
 
+    # Состояния с менеджером, из которых чат без активности переводится на бота
+    ABANDONABLE_STATES = [ChatManagerState.NEED_MANAGER.value, ChatManagerState.MANAGER_CONNECTED.value]
+
     def __init__(self, me=None) -> None:
         super().__init__()
 
@@ -52,21 +58,7 @@ class ChatsRepository(MasterRepository):
         # TODO без указания target, создаем чат p2p
 
         # Выражения для вычисляемых полей в annotate
-        self.unread_count_expression = Coalesce(  # Если ниче не найдено то вместо null ставим 0
-            Subquery(
-                Message.objects.filter(
-                    chat=OuterRef('id')
-                ).exclude(
-                    user=self.me
-                ).exclude(
-                    stats__user=self.me, stats__is_read=True
-                ).values('chat').annotate(
-                    count=Count('pk')
-                ).values('count')
-            ),
-            0
-        )
-
+        # Количество непрочитанных (unread_count) берется из счетчиков в redis, см. set_unread_counts
         self.last_message_created_at_expression = Max(
             # Округляем до миллисекунд, так как в бд DateTimeField хранит с точностью до МИКРОсекунд
             TruncMilliecond('messages__created_at')
@@ -84,7 +76,6 @@ class ChatsRepository(MasterRepository):
         self.base_query = self.model.objects.filter(users=self.me).annotate(
             active_managers_ids=self.active_managers_ids_expression,
             blocked_at=self.blocked_at_expression,
-            unread_count=self.unread_count_expression,
             last_message_created_at=self.last_message_created_at_expression  # Нужен для сортировки и фильтрации чатов
         )
 
@@ -294,7 +285,9 @@ class ChatsRepository(MasterRepository):
         if found_chats and is_relevant_manager:
             # Если релевантный менеджер для найденных чатов, то добавляем себя в чаты
             for chat in found_chats:
-                ChatUser.objects.get_or_create(chat=chat, user=self.me)
+                _, created = ChatUser.objects.get_or_create(chat=chat, user=self.me)
+                if created:
+                    UnreadCounters().reset_chats([self.me.id])
 
         if not found_chats and should_create:
             # Если не найдены нужные чаты
@@ -337,9 +330,9 @@ class ChatsRepository(MasterRepository):
             records = records.order_by(*order_by)
 
         records = self.prefetch_first_unread_message(records)
-        return self.fast_related_loading(  # Предзагрузка связанных сущностей
-            queryset=records[paginator.offset:paginator.limit] if paginator else records,
-        )
+        return self.set_unread_counts(self.fast_related_loading(  # Предзагрузка связанных сущностей
+            queryset=paginate(records, paginator),
+        ))
 
     def get_by_id(self, record_id):
         record = self.model.objects.filter(id=record_id).first()
@@ -355,7 +348,9 @@ class ChatsRepository(MasterRepository):
             chat = self.model.objects.filter(id=record_id).first()
             if chat and self.check_if_staff_or_participant(chat):  # Если являюсь релевантным менеджером
                 # Добавляем себя в список участников чата
-                ChatUser.objects.get_or_create(chat=chat, user=self.me)
+                _, created = ChatUser.objects.get_or_create(chat=chat, user=self.me)
+                if created:
+                    UnreadCounters().reset_chats([self.me.id])
 
         records = self.base_query.filter(id=record_id)
         records = self.prefetch_first_unread_message(records)
@@ -364,6 +359,7 @@ class ChatsRepository(MasterRepository):
             raise HttpException(
                 status_code=RESTErrors.NOT_FOUND.value,
                 detail=f'Объект {self.model._meta.verbose_name} с ID={record_id} не найден')
+        record.unread_count = self.get_unread_counts().get(record.id, 0)
         return record
 
     def get_chat_unread_count_and_first_unread(self, record_id):
@@ -371,26 +367,17 @@ class ChatsRepository(MasterRepository):
         records = self.prefetch_first_unread_message(records)
         record = records.first()
         if record:
-            chats_unread_messages_count = self.get_all_chats_unread_count()
+            unread_counts = self.get_unread_counts()
+            chats_unread_messages_count = self.get_all_chats_unread_count(unread_counts)
             first_unread_message = record.first_unread_messages[0] if record.first_unread_messages else None
-            return record.unread_count, first_unread_message, chats_unread_messages_count, record.blocked_at, record.state
+            unread_count = unread_counts.get(record.id, 0)
+            return unread_count, first_unread_message, chats_unread_messages_count, record.blocked_at, record.state
         else:
             return None, None, None, None, None
 
-    @staticmethod
-    def get_chat_unread_data_for_all_participants(chat, users):
+    @classmethod
+    def get_chat_unread_data_for_all_participants(cls, chat, users):
         unread_counts_for_users = users.annotate(
-            unread_count=Coalesce(  # Количество непрочитанных в определенном чате
-                Subquery(
-                    Message.objects
-                        .filter(chat=chat)
-                        .exclude(user=OuterRef('id'))
-                        .exclude(stats__user=OuterRef('id'), stats__is_read=True)
-                        .values('chat')
-                        .annotate(count=Count('pk'))
-                        .values('count')
-                ),
-                0),
             first_unread_message_uuid=Subquery(
                 Message.objects.filter(chat=chat).exclude(
                     Q(
@@ -411,29 +398,29 @@ class ChatsRepository(MasterRepository):
                     )
                 ).order_by('id').values('created_at')[:1]
             ),
-            chats_unread_messages_count=Coalesce(
-                Subquery(  # Проблемно через ORM посчитать для всех чатов т.к. Count() и .count() несовместим с Subquery
-                    Message.objects
-                        .filter(
-                        Q(chat__users=OuterRef('id'), chat__users__account_type=AccountType.SELF_EMPLOYED.value) |
-                        Q(
-                            chat__users=OuterRef('id'),
-                            chat__users__account_type=AccountType.MANAGER.value,
-                            chat__state=ChatManagerState.NEED_MANAGER.value
-                        ) | Q(chat__active_managers=OuterRef('id')))
-                        .exclude(user=OuterRef('id'))
-                        .exclude(stats__user=OuterRef('id'), stats__is_read=True)
-                        .annotate(count=Window(expression=Count('id'), partition_by=[F('chat__users__id')]))
-                        .values('count')[:1]  # В каждой строчке результата будет число всех строк, берем только его
-                ),  # Используем оконные функции OVER с Count()
-                0),
+        )
+
+        unread_counts_for_users = list(unread_counts_for_users)
+        # Счетчики всех участников одним pipeline, чаты менеджеров для общего счетчика одним запросом
+        users_unread_counts = UnreadCounters().get_chats_many(
+            [u.id for u in unread_counts_for_users], cls.load_unread_counts_for_users
+        )
+        managers_chats_ids = cls.get_managers_chats_ids(
+            [u.id for u in unread_counts_for_users if u.account_type == AccountType.MANAGER.value]
         )
 
         result = {}
         for u in unread_counts_for_users:
+            unread_counts = users_unread_counts.get(u.id, {})
+            if u.id in managers_chats_ids:
+                chats_unread_messages_count = sum(
+                    unread_counts.get(chat_id, 0) for chat_id in managers_chats_ids[u.id]
+                )
+            else:
+                chats_unread_messages_count = sum(unread_counts.values())
             result[f'user{u.id}'] = {
-                'unread_count': u.unread_count,
-                'chats_unread_messages_count': u.chats_unread_messages_count,
+                'unread_count': unread_counts.get(chat.id, 0),
+                'chats_unread_messages_count': chats_unread_messages_count,
                 'first_unread_message': {
                     'uuid': str(u.first_unread_message_uuid),
                     'createdAt': datetime_to_timestamp(u.first_unread_message_created_at),
@@ -443,7 +430,7 @@ class ChatsRepository(MasterRepository):
         return result
 
     def get_chat_for_all_participants(self, record_id):
-        """ Возвращает массив сериализованных чатов и сокеты для каждого участника, и самих участников """
+        """ Возвращает массив сериализованных чатов для каждого участника (с его id), и самих участников """
         records = self.model.objects.filter(id=record_id)
         records = self.fast_related_loading(records)
         record = records.annotate(
@@ -470,6 +457,7 @@ class ChatsRepository(MasterRepository):
 
         active_managers_ids = [am.id for am in record.active_managers.all()]
         inactive_managers_ids = []
+        online_users_ids = SocketsRepository.get_online_users_ids([u.id for u in users])
 
         for user in users:
             # Собираем ид неактивных менеджеров
@@ -477,10 +465,11 @@ class ChatsRepository(MasterRepository):
                 inactive_managers_ids.append(user.id)
 
             prepared_data.append({
-                'sockets': [s.socket_id for s in user.sockets.all()],
+                'user_id': user.id,
                 'chat': camelize(
                     SocketChatSerializer(record, many=False, context={
                         'me': user,
+                        'online_users_ids': online_users_ids,
                         'unread_count': chained_get(
                             unread_data_dict, f'user{user.id}', 'unread_count',
                             default=None
@@ -504,7 +493,7 @@ class ChatsRepository(MasterRepository):
         """ Подгрузка зависимостей с 3 уровнями вложенности по ForeignKey + GenericRelation
             -> Last_message
             -> Users
-                -> Media + Sockets
+                -> Media
         """
         queryset = queryset.prefetch_related(
             # Подгрузка последних сообщений #
@@ -533,9 +522,6 @@ class ChatsRepository(MasterRepository):
                         ).order_by('-created_at'),  # Сортировка по дате обязательно
                         to_attr='medias'
                     ),
-                ).prefetch_related(
-                    # Подгрузка сокетов для определения online|offline
-                    'sockets',
                 )
             )
         ).select_related(
@@ -630,20 +616,77 @@ class ChatsRepository(MasterRepository):
         if not record:
             raise EntityDoesNotExistException
 
-    def get_all_chats_unread_count(self):
-        chats = self.model.objects.filter(users=self.me)
+    def unread_messages(self):
+        # Чужие непрочитанные сообщения во всех чатах пользователя
+        return Message.objects.filter(
+            chat__users=self.me
+        ).exclude(
+            user=self.me
+        ).exclude(
+            stats__user=self.me, stats__is_read=True
+        )
 
-        if self.me.account_type == AccountType.MANAGER.value:  # Если менеджер
-            chats = chats.filter(
-                # Либо где активный менеджер - я
-                Q(state=ChatManagerState.MANAGER_CONNECTED.value, active_managers=self.me) |
-                # Либо где нужен менеджер
-                Q(state=ChatManagerState.NEED_MANAGER.value)
+    def load_unread_counts(self):
+        # Количество непрочитанных по всем чатам пользователя из бд (инициализация счетчиков в redis)
+        return dict(
+            self.unread_messages().order_by().values('chat_id').annotate(
+                count=Count('pk')
+            ).values_list('chat_id', 'count')
+        )
+
+    @staticmethod
+    def load_unread_counts_for_users(users_ids):
+        # Количество непрочитанных по всем чатам нескольких пользователей одним запросом {user_id: {chat_id: count}}
+        result = {user_id: {} for user_id in users_ids}
+        records = ChatUser.objects.filter(user_id__in=users_ids).annotate(
+            unread_count=Subquery(
+                Message.objects.filter(chat=OuterRef('chat')).exclude(
+                    Q(user=OuterRef('user')) | Q(stats__user=OuterRef('user'), stats__is_read=True)
+                ).order_by().values('chat').annotate(count=Count('pk')).values('count')[:1],
+                output_field=IntegerField()
             )
+        ).filter(unread_count__gt=0).values_list('user_id', 'chat_id', 'unread_count')
+        for user_id, chat_id, unread_count in records:
+            result[user_id][chat_id] = unread_count
+        return result
+
+    @staticmethod
+    def get_managers_chats_ids(managers_ids):
+        # Чаты менеджеров, учитываемые в их общем счетчике непрочитанных {manager_id: {chat_id}}, одним запросом
+        result = {manager_id: set() for manager_id in managers_ids}
+        if not managers_ids:
+            return result
+        records = ChatUser.objects.filter(
+            # Либо где активный менеджер - сам участник
+            Q(chat__state=ChatManagerState.MANAGER_CONNECTED.value, chat__active_managers=F('user')) |
+            # Либо где нужен менеджер
+            Q(chat__state=ChatManagerState.NEED_MANAGER.value),
+            user_id__in=managers_ids
+        ).values_list('user_id', 'chat_id').distinct()
+        for manager_id, chat_id in records:
+            result[manager_id].add(chat_id)
+        return result
+
+    def get_unread_counts(self):
+        # Словарь {chat_id: количество непрочитанных} для текущего пользователя
+        return UnreadCounters().get_chats(self.me.id, self.load_unread_counts)
+
+    def set_unread_counts(self, records):
+        unread_counts = self.get_unread_counts()
+        records = list(records)
+        for record in records:
+            record.unread_count = unread_counts.get(record.id, 0)
+        return records
+
+    def get_all_chats_unread_count(self, unread_counts=None):
+        if unread_counts is None:
+            unread_counts = self.get_unread_counts()
 
-        return chats.annotate(unread_count=self.unread_count_expression).aggregate(
-            total_unread_count=Coalesce(Sum('unread_count'), 0)
-        )['total_unread_count']
+        if self.me.account_type == AccountType.MANAGER.value:  # Если менеджер
+            chats_ids = self.get_managers_chats_ids([self.me.id])[self.me.id]
+            return sum(unread_counts.get(chat_id, 0) for chat_id in chats_ids)
+
+        return sum(unread_counts.values())
 
     def set_me_as_active_manager(self, chat_id):
         should_send_info = False
@@ -710,12 +753,36 @@ class ChatsRepository(MasterRepository):
         managers, blocked_at = self.get_managers(chat_id)
         sockets = []
         if managers:
-            sockets = managers.aggregate(
-                sockets=ArrayRemove(ArrayAgg('sockets__socket_id'), None)
-            )['sockets']
+            sockets = SocketsRepository.get_connections_for_users_ids([m.id for m in managers])
 
         return managers, sockets, blocked_at
 
+    @classmethod
+    def get_abandon_at(cls, chat):
+        """ Момент перевода чата на бота: последнее сообщение + AUTO_SWITCH_TO_BOT_MIN, None - перевод не нужен """
+        if chat.state not in cls.ABANDONABLE_STATES or not chat.id:
+            return None
+        last_message_created_at = Message.objects.filter(chat_id=chat.id).aggregate(
+            last_message_created_at=Max('created_at')
+        )['last_message_created_at']
+        if last_message_created_at is None:
+            return None  # Чат без сообщений на бота не переводим
+        return last_message_created_at + timedelta(minutes=AUTO_SWITCH_TO_BOT_MIN)
+
+    @classmethod
+    def extend_abandon_at(cls, chat_id, message_created_at):
+        # Новое сообщение откладывает перевод на бота, у чатов с ботом дедлайна нет
+        Chat.objects.filter(id=chat_id, state__in=cls.ABANDONABLE_STATES).update(
+            abandon_at=message_created_at + timedelta(minutes=AUTO_SWITCH_TO_BOT_MIN)
+        )
+
+    @classmethod
+    def get_abandoned_chats_ids(cls):
+        # Выборка по индексу abandon_at - только чаты с наступившим дедлайном
+        return list(Chat.objects.filter(
+            abandon_at__lte=now(), state__in=cls.ABANDONABLE_STATES
+        ).values_list('id', flat=True))
+
     def block_chat(self, record_id):
         # Блокировка чата для смз
         chat = self.model.objects.filter(id=record_id).first()
@@ -894,9 +961,6 @@ class MessagesRepository(MasterRepository):
         """
         queryset = queryset.select_related(
             'user',
-        ).prefetch_related(
-            # Подгрузка сокетов
-            'user__sockets',
         ).prefetch_related(
             # Подгрузка медиа для сообщений
             Prefetch(
@@ -919,7 +983,7 @@ class MessagesRepository(MasterRepository):
             records = records.order_by(*order_by)
 
         return self.fast_related_loading(  # Предзагрузка связанных сущностей
-            queryset=records[paginator.offset:paginator.limit] if paginator else records,
+            queryset=paginate(records, paginator),
         )
 
     def save_client_message(self, content):
@@ -932,6 +996,9 @@ class MessagesRepository(MasterRepository):
             text=content.get('text'),
         )
 
+        # Новое сообщение непрочитано для остальных участников чата
+        UnreadCounters().incr_chat(self.get_participants_ids(exclude_me=True), self.chat_id)
+
         # Читаем все сообщения перед созданным
         self.read_all_before(message)  # 3
 
@@ -950,6 +1017,12 @@ class MessagesRepository(MasterRepository):
     def get_last_message(self):
         return self.model.objects.filter(chat_id=self.chat_id).last()
 
+    def get_participants_ids(self, exclude_me=False):
+        participants = ChatUser.objects.filter(chat_id=self.chat_id)
+        if exclude_me and self.me:
+            participants = participants.exclude(user=self.me)
+        return list(participants.values_list('user_id', flat=True))
+
     def read_all_before(self, message):
         # Прочитать все непрочитанные чужие сообщения до того сообщения, которое читается
         all_others_unread_messages = Message.objects.filter(
@@ -1022,6 +1095,11 @@ class MessagesRepository(MasterRepository):
                 is_read=True
             )
 
+        # Уменьшаем счетчик на количество прочитанных сейчас сообщений (ArrayAgg по пустой выборке - NULL)
+        read_count = len(all_others_unread_messages['stats_isnull'] or []) + \
+            len(all_others_unread_messages['is_read_false'] or [])
+        UnreadCounters().decr_chat(self.me.id, self.chat_id, read_count)
+
     def read_message(self, content, prefetch=False):
         """
         :param content:
@@ -1047,7 +1125,7 @@ class MessagesRepository(MasterRepository):
 
         if message:
             msg_owner = message.user
-            msg_owner_sockets = [s.socket_id for s in msg_owner.sockets.all()] if prefetch and msg_owner else []
+            msg_owner_sockets = SocketsRepository(msg_owner).get_user_connections() if prefetch and msg_owner else []
 
             # Читаем все предыдущие сообщения
             self.read_all_before(message)
@@ -1066,12 +1144,14 @@ class MessagesRepository(MasterRepository):
                 if not stat.is_read:  # Не читаем заново от имени своего пользователя = не делаем лишний запрос на save
                     stat.is_read = True
                     stat.save()
+                    UnreadCounters().decr_chat(self.me.id, self.chat_id)
             else:
                 MessageStat.objects.create(
                     message=message,
                     user=self.me,
                     is_read=True
                 )
+                UnreadCounters().decr_chat(self.me.id, self.chat_id)
 
         return message, msg_owner, msg_owner_sockets, should_response_owner
 
@@ -1088,6 +1168,9 @@ class MessagesRepository(MasterRepository):
             buttons=content.get('buttons')
         )
 
+        # Сообщение бота непрочитано для всех участников чата
+        UnreadCounters().incr_chat(self.get_participants_ids(), self.chat_id)
+
         # TODO общие файлы для сообщений сделать
         # attachments = content.get('attachments')
         # if attachments:
@@ -3,6 +3,7 @@ from rest_framework import serializers
 from app_chats.models import Chat, Message
 from app_media.enums import MediaType
 from app_media.versions.v1_0.controllers import MediaController
+from app_sockets.versions.v1_0.repositories import SocketsRepository
 from app_users.models import UserProfile
 from backend.fields import DateTimeField
 from backend.mixins import CRUDSerializer
@@ -14,6 +15,8 @@ class ChatsSerializer(serializers.ModelSerializer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.me = chained_get(kwargs, 'context', 'me')
+        # Множество id участников онлайн для всей страницы чатов (SocketsRepository.get_online_users_ids)
+        self.online_users_ids = chained_get(kwargs, 'context', 'online_users_ids')
 
     created_at = DateTimeField()
     blocked_at = DateTimeField()
@@ -50,7 +53,14 @@ class ChatsSerializer(serializers.ModelSerializer):
         return ChatSubjectUserSerializer(data.subject_user, many=False, context={'me': self.me}).data
 
     def get_users(self, data):
-        return ChatProfileSerializer(data.users, many=True, context={'me': self.me}).data
+        users = data.users.all()
+        online_users_ids = self.online_users_ids
+        if online_users_ids is None:
+            online_users_ids = SocketsRepository.get_online_users_ids([u.id for u in users])
+        return ChatProfileSerializer(users, many=True, context={
+            'me': self.me,
+            'online_users_ids': online_users_ids,
+        }).data
 
     def get_last_message(self, data):
         if data.last_messages:
@@ -188,6 +198,10 @@ class FirstUnreadMessageSerializer(serializers.ModelSerializer):
 
 
 class ChatProfileSerializer(CRUDSerializer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.online_users_ids = chained_get(kwargs, 'context', 'online_users_ids', default=set())
+
     avatar = serializers.SerializerMethodField()
     online = serializers.SerializerMethodField()
     is_me = serializers.SerializerMethodField()
@@ -198,7 +212,7 @@ class ChatProfileSerializer(CRUDSerializer):
         )
 
     def get_online(self, data):
-        return data.sockets.count() > 0
+        return data.id in self.online_users_ids
 
     def get_is_me(self, data):
         return self.me == data
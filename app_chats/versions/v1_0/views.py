@@ -9,12 +9,13 @@ from app_chats.versions.v1_0.serializers import ChatsSerializer, MessagesSeriali
     FirstUnreadMessageSerializer
 from app_sockets.controllers import SocketController
 from app_sockets.enums import AvailableVersion, AvailableRoom
+from app_sockets.versions.v1_0.repositories import SocketsRepository
 from backend.errors.enums import RESTErrors
 from backend.errors.exceptions import EntityDoesNotExistException, ForbiddenException
 from backend.errors.http_exceptions import HttpException
 from backend.mappers import RequestMapper
 from backend.mixins import CRUDAPIView
-from backend.utils import get_request_headers, get_request_body, chained_get, datetime_to_timestamp
+from backend.utils import get_request_headers, get_request_body, chained_get, datetime_to_timestamp, pagination_headers
 
 
 class Chats(CRUDAPIView):
@@ -69,9 +70,14 @@ class Chats(CRUDAPIView):
         serialized = self.serializer_class(dataset, many=self.many, context={
             'me': request.user,
             'headers': get_request_headers(request),
+            # Онлайн участников всей страницы одним запросом в redis
+            'online_users_ids': SocketsRepository.get_online_users_ids(
+                [user.id for chat in dataset for user in chat.users.all()]
+            ) if self.many else None,
         })
 
-        return Response(camelize(serialized.data), status=status.HTTP_200_OK)
+        headers = pagination_headers(pagination, dataset) if self.many else None
+        return Response(camelize(serialized.data), status=status.HTTP_200_OK, headers=headers)
 
 
 @api_view(['POST'])
@@ -157,7 +163,8 @@ class Messages(CRUDAPIView):
             'headers': get_request_headers(request),
         })
 
-        return Response(camelize(serialized.data), status=status.HTTP_200_OK)
+        headers = pagination_headers(pagination, dataset) if self.many else None
+        return Response(camelize(serialized.data), status=status.HTTP_200_OK, headers=headers)
 
     def post(self, request, **kwargs):
         chat_id = kwargs.get(self.urlpattern_record_id_name)
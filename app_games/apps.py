@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AppGamesConfig(AppConfig):
     name = 'app_games'
+
+    def ready(self):
+        import app_games.signals  # Импортируем сигналы
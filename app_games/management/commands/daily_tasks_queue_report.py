@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from app_users.models import UserProfile
+from app_users.versions.v1_0.repositories import UsersRepository
+
+# python manage.py daily_tasks_queue_report [--reset]
+# Статистика пишется задачей check_marked_users_daily_tasks на каждом цикле, число смз для сравнения
+# считается при построении отчета
+
+
+class Command(BaseCommand):
+    help = "Сколько проверок ежедневных заданий ставится за цикл по очереди отмеченных смз " \
+           "в сравнении с прежней полной проверкой всех смз."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Очистить накопленную статистику")
+
+    def handle(self, *args, **options):
+        queue = UserProfile.daily_tasks_queue
+        if options['reset']:
+            queue.clear_stats()
+            self.stdout.write("[DONE] Статистика очищена\n")
+            return
+
+        stats = queue.get_stats()
+        cycles = max(stats.get('cycles', 0), 1)
+        processed = stats.get('processed', 0)
+        # Полная проверка ставила задачу на каждого смз - считаем по текущему числу смз при построении отчета
+        baseline = UsersRepository.get_all_self_employed_ids().count()
+        self.stdout.write(
+            f"Циклов: {stats.get('cycles', 0)}\n"
+            f"  проверок за цикл: {processed / cycles:.1f} (всего {processed})\n"
+            f"  полная проверка за цикл: {baseline}\n"
+            f"  доля от полной проверки: {processed / cycles / baseline * 100 if baseline else 0:.1f}%\n"
+        )
+        self.stdout.write("[DONE]\n")
@@ -0,0 +1,50 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_save, post_init
+from django.dispatch import receiver
+
+from app_feedback.models import Review
+from app_market.enums import ShiftAppealStatus
+from app_market.models import ShiftAppeal, Transaction
+from app_users.models import UserProfile
+
+# События, после которых у смз могло выполниться ежедневное задание - отмечаем его для проверки
+# задачей check_marked_users_daily_tasks. Массовые переходы откликов (update) отмечаются в репозитории.
+# Отметка ставится после коммита: иначе задача может проверить пользователя до появления изменений в бд
+
+
+@receiver(post_init, sender=ShiftAppeal)
+def remember_appeal_status(sender, instance: ShiftAppeal, **kwargs):
+    # Через __dict__, чтобы не подгружать отложенное поле на каждый экземпляр
+    instance._daily_tasks_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=ShiftAppeal)
+def mark_applier_on_appeal_completed(sender, instance: ShiftAppeal, created, **kwargs):
+    # Только переход в COMPLETED, а не любое сохранение уже завершенного отклика
+    completed = instance.status == ShiftAppealStatus.COMPLETED.value and (
+        created or getattr(instance, '_daily_tasks_status', None) != ShiftAppealStatus.COMPLETED.value
+    )
+    instance._daily_tasks_status = instance.status
+    if completed:
+        applier_id = instance.applier_id
+        transaction.on_commit(lambda: UserProfile.daily_tasks_queue.mark(applier_id))
+
+
+@receiver(post_save, sender=Review)
+def mark_user_on_review(sender, instance: Review, created, **kwargs):
+    if created and instance.target_ct_id == ContentType.objects.get_for_model(UserProfile).id:
+        target_id = instance.target_id
+        transaction.on_commit(lambda: UserProfile.daily_tasks_queue.mark(target_id))
+
+
+@receiver(post_save, sender=Transaction)
+def mark_users_on_transaction(sender, instance: Transaction, created, **kwargs):
+    if not created:
+        return
+    user_ct_id = ContentType.objects.get_for_model(UserProfile).id
+    users_ids = [
+        instance.to_id if instance.to_ct_id == user_ct_id else None,
+        instance.from_id if instance.from_ct_id == user_ct_id else None,
+    ]
+    transaction.on_commit(lambda: UserProfile.daily_tasks_queue.mark(*users_ids))
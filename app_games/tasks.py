@@ -3,24 +3,35 @@ import uuid
 from django.contrib.contenttypes.models import ContentType
 from django.utils.timezone import now
 from celery import group
+from loguru import logger
 from app_games.enums import TaskType, TaskPeriod, TaskKind
 from app_games.versions.v1_0.repositories import TasksRepository, PrizesRepository
-from app_market.enums import TransactionType, TransactionStatus, Currency
-from app_market.versions.v1_0.repositories import OrdersRepository, TransactionsRepository
+from app_market.enums import TransactionType, TransactionStatus
+from app_market.versions.v1_0.repositories import OrdersRepository
 from app_sockets.controllers import SocketController
 from app_users.enums import NotificationAction, NotificationType, NotificationIcon
-from app_users.versions.v1_0.repositories import UsersRepository
+from app_users.models import UserProfile
 from backend.controllers import PushController
 from giberno.celery import app
 from giberno.settings import BONUS_PROGRESS_STEP_VALUE
 
 
 @app.task
-def check_users_daily_tasks_on_completed_shifts():
-    jobs = group(
-        [check_everyday_tasks_for_user.s(user_id, TaskKind.COMPLETE_SHIFT_WITH_MIN_RATING.value) for user_id in
-         UsersRepository.get_all_self_employed_ids()])
-    jobs.apply_async()
+def check_marked_users_daily_tasks():
+    """
+        Проверка ежедневных заданий только у смз, отмеченных в UserProfile.daily_tasks_queue событиями,
+        которые могут выполнить задание (завершение смены, оценка, транзакция), а не у всех смз
+    """
+
+    def enqueue(users_ids):
+        group(
+            [check_everyday_tasks_for_user.s(user_id, TaskKind.COMPLETE_SHIFT_WITH_MIN_RATING.value)
+             for user_id in users_ids]
+        ).apply_async()
+
+    enqueued = UserProfile.daily_tasks_queue.drain(enqueue)
+    UserProfile.daily_tasks_queue.add_stats(processed=enqueued)
+    logger.info(f'Ежедневные задания: поставлено {enqueued} проверок')
 
 
 @app.task
@@ -87,8 +98,6 @@ def check_everyday_tasks_for_user(user_id, kind):
     completed_task.user.bonuses_acquired += task.bonus_value
     completed_task.user.save()
 
-    TransactionsRepository(completed_task.user).recalculate_money(currency=Currency.BONUS.value)
-
     title = 'Начислены бонусы'
     message = f'Начисление {task.bonus_value} очков славы за выполненное задание'
     action = NotificationAction.USER.value
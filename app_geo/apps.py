@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AppGeoConfig(AppConfig):
     name = 'app_geo'
+
+    def ready(self):
+        import app_geo.signals  # Импортируем сигналы
@@ -0,0 +1,57 @@
+import random
+from time import perf_counter
+
+from django.contrib.gis.geoip2 import GeoIP2
+from django.core.management.base import BaseCommand
+
+from backend.utils import get_geo_by_ip, resolve_geo_by_ip, get_geoip
+
+# python manage.py geoip_benchmark --requests=20000 --unique=2000
+
+
+def legacy_geo_by_ip(ip):
+    # Прежняя реализация middleware: новый GeoIP2 и три отдельных поиска на каждый запрос
+    try:
+        g = GeoIP2()
+        country = g.country(ip)
+        city = g.city(ip)
+        point = g.geos(ip)
+        return {"country": country['country_name'], "city": city['city'], "point": point, "ip": ip}
+    except Exception:
+        return None
+
+
+class Command(BaseCommand):
+    help = "Микро-бенчмарк определения геоданных по IP в UpdateRequestGeoByIP: прежний путь и общий reader с LRU-кэшем."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000, help="Количество запросов")
+        parser.add_argument('--unique', type=int, default=2000, help="Количество разных IP среди запросов")
+        parser.add_argument('--legacy-requests', type=int, default=500,
+                            help="Сколько запросов прогнать через прежний путь (он медленный)")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def measure(self, title, func, ips):
+        started = perf_counter()
+        for ip in ips:
+            func(ip)
+        elapsed = perf_counter() - started
+        self.stdout.write(f"{title}: {elapsed / len(ips) * 1000000:.1f} мкс/запрос\n")
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        pool = [
+            f'{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}'
+            for _ in range(options['unique'])
+        ]
+        ips = [rnd.choice(pool) for _ in range(options['requests'])]
+
+        self.stdout.write(f"Запросов: {len(ips)}, разных IP: {len(pool)}\n")
+        self.measure("Прежний путь (GeoIP2() + country/city/geos)", legacy_geo_by_ip, ips[:options['legacy_requests']])
+
+        get_geoip()  # Открытие баз - один раз на процесс, в замер не входит
+        resolve_geo_by_ip.cache_clear()
+        self.measure("Общий reader, холодный кэш", lambda ip: resolve_geo_by_ip.__wrapped__(ip), pool)
+        self.measure("Общий reader + LRU", get_geo_by_ip, ips)
+        self.stdout.write(f"Кэш: {resolve_geo_by_ip.cache_info()}\n")
+        self.stdout.write("[DONE]\n")
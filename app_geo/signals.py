@@ -0,0 +1,19 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from app_geo.models import City
+from backend.clustering import ClustersCache
+from backend.timezones import forget_shops_timezones
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def invalidate_cities_clusters(sender, instance: City, **kwargs):
+    ClustersCache.invalidate(City._meta.model_name)
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def forget_cities_timezones(sender, instance: City, **kwargs):
+    # Часовые пояса магазинов берутся из городов
+    forget_shops_timezones()
@@ -8,11 +8,14 @@ from django.db.models import Prefetch, F, ExpressionWrapper
 from app_geo.models import Language, Country, City, Region
 from app_media.enums import MediaType, MediaFormat
 from app_media.models import MediaModel
+from backend.clustering import MapTiles, ClustersCache, nearest_clustered_items, clusters_to_dicts
 from backend.errors.enums import RESTErrors
 from backend.errors.http_exceptions import HttpException
+from backend.mappers import DataMapper
 from backend.mixins import MasterRepository
 from giberno import settings
-from giberno.settings import NEAREST_POINT_DISTANCE_MAX, CLUSTER_MIN_POINTS_COUNT, CLUSTER_NESTED_ITEMS_COUNT
+from giberno.settings import NEAREST_POINT_DISTANCE_MAX, CLUSTER_MIN_POINTS_COUNT, CLUSTER_NESTED_ITEMS_COUNT, \
+    CLUSTER_ID_FIELD_NAME
 
 
 class LanguagesRepository(MasterRepository):
@@ -141,69 +144,81 @@ class CitiesRepository(MasterRepository):
         return within_boundary
 
     def map(self, kwargs, paginator=None, order_by: list = None):
-        queryset = self.filter_by_kwargs(kwargs, paginator, order_by, prefetch=False)
+        # Область экрана выравнивается по тайлам, кластеры по ней берутся из кэша
+        tiles = MapTiles(self.screen_diagonal_points)
+        point = tiles.snap_point(self.point)
+        filters = {
+            'kwargs': kwargs,
+            'pagination': [paginator.offset, paginator.limit] if paginator else None,
+            'point': [point.x, point.y] if point else None,
+        }
+
+        def compute():
+            queryset = CitiesRepository(
+                point=self.point, screen_diagonal_points=tiles.screen_diagonal_points, me=self.me
+            ).filter_by_kwargs(kwargs, paginator, order_by, prefetch=False)
+            return clusters_to_dicts(
+                DataMapper.clustering_raw_qs(
+                    self.clustering(queryset, eps=tiles.eps, point=point), CLUSTER_ID_FIELD_NAME
+                ),
+                fields=['id', 'native', 'lon', 'lat']
+            )
 
-        return self.clustering(queryset)
+        clusters = ClustersCache.get_or_compute(self.model._meta.model_name, tiles, filters, compute)
+        # Ближайшие объекты выбраны в SQL по выровненной точке, порядок уточняется по положению пользователя
+        return nearest_clustered_items(clusters, self.point, count=CLUSTER_NESTED_ITEMS_COUNT)
 
-    def clustering(self, queryset):
+    def clustering(self, queryset, eps, point=None):
         """
         :param queryset: Отфильтрованные по области на экране данные
-        :return:
+        :param eps: Расстояние кластеризации в градусах
+        :param point: Точка, до которой считается расстояние для выбора вложенных объектов кластера
+        :return: Не больше CLUSTER_NESTED_ITEMS_COUNT ближайших объектов каждого кластера, упорядоченные по кластерам
         """
+        distance = f"ST_DistanceSphere(s.position, ST_GeomFromGeoJSON('{point.geojson}'))" if point else 's.id'
         raw_sql = f'''
-            WITH clusters AS (
+            WITH clustered AS (
+                SELECT 
+                    id, 
+                    ST_ClusterDBSCAN(
+                        position, 
+                        eps := {eps},
+                        minpoints := {CLUSTER_MIN_POINTS_COUNT}
+                    ) OVER() AS cid, 
+                    position
+                FROM 
+                    (
+                        {queryset.query}
+                    ) external_subquery
+            ),
+
+            clusters AS (
                 SELECT 
                     cid, 
-                    ST_Collect(position) AS cluster_geometries, 
-                    ST_Centroid (ST_Collect(position)) AS centroid,
                     ST_X(ST_Centroid (ST_Collect(position))) AS c_lon,
                     ST_Y(ST_Centroid (ST_Collect(position))) AS c_lat,
-                    ARRAY_AGG(id) AS ids_in_cluster,
-                    ST_NumGeometries(ST_Collect(position)) as clustered_count
-                FROM (
-                        SELECT 
-                            id, 
-                            ST_ClusterDBSCAN(
-                                position, 
-                                eps := ST_Distance(
-                                    ST_GeomFromGeoJSON('{self.screen_diagonal_points[0].geojson}'),
-                                    ST_GeomFromGeoJSON('{self.screen_diagonal_points[1].geojson}')
-                                )/10.0, -- 1/10 диагонали
-                                minpoints := {CLUSTER_MIN_POINTS_COUNT}
-                            ) OVER() AS cid, 
-                            position
-                        FROM 
-                            (
-                                {queryset.query}
-                            ) external_subquery
-                        
-                ) sq
+                    COUNT(*) AS clustered_count
+                FROM clustered
                 GROUP BY cid
-            ),
-            
-            computed AS (
-            
-            SELECT 
-                s.id,
-                s.native,
-                s.position::bytea,
-                ST_DistanceSphere(s.position, ST_GeomFromGeoJSON('{self.point.geojson}')) AS distance,
-                c.cid, 
-                c.c_lat, 
-                c.c_lon, 
-                c.clustered_count 
-            FROM app_geo__cities s
-            JOIN clusters c ON (s.id=ANY(c.ids_in_cluster))
-            
             )
-            
+
             SELECT * FROM (
                 SELECT 
-                    *,
-                    ROW_NUMBER() OVER (PARTITION BY cid ORDER BY distance ASC) AS n
-                FROM computed
+                    s.id,
+                    s.native,
+                    ST_X(s.position) AS lon,
+                    ST_Y(s.position) AS lat,
+                    c.cid, 
+                    c.c_lat, 
+                    c.c_lon, 
+                    c.clustered_count,
+                    ROW_NUMBER() OVER (PARTITION BY c.cid ORDER BY {distance}, s.id) AS n
+                FROM clustered cl
+                JOIN clusters c ON (c.cid IS NOT DISTINCT FROM cl.cid)
+                JOIN app_geo__cities s ON (s.id = cl.id)
             ) a
-            WHERE n<={CLUSTER_NESTED_ITEMS_COUNT}
+            WHERE n <= {CLUSTER_NESTED_ITEMS_COUNT}
+            ORDER BY cid
         '''
         return self.model.objects.raw(raw_sql)
 
@@ -161,11 +161,11 @@ class CityInCluster(serializers.Serializer):
     def get_native(self, data):
         return chained_get(data, 'native')
 
-    def get_lon(self, city: City):
-        return city.position.x if city.position else None
+    def get_lon(self, data):
+        return chained_get(data, 'lon')
 
-    def get_lat(self, city: City):
-        return city.position.y if city.position else None
+    def get_lat(self, data):
+        return chained_get(data, 'lat')
 
 
 class CitiesClusterSerializer(serializers.Serializer):
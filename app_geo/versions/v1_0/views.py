@@ -7,7 +7,7 @@ from rest_framework.response import Response
 from app_geo.versions.v1_0.repositories import LanguagesRepository, CountriesRepository, CitiesRepository
 from app_geo.versions.v1_0.serializers import LanguageSerializer, CountrySerializer, CitySerializer, \
     CitiesClusterSerializer
-from backend.mappers import RequestMapper, DataMapper
+from backend.mappers import RequestMapper
 from backend.mixins import CRUDAPIView
 from backend.utils import get_request_headers
 
@@ -205,9 +205,7 @@ class CitiesClusteredMap(Cities):
 
         self.many = True
 
-        clustered = self.repository_class(point, screen_diagonal_points).map(kwargs=filters, order_by=order_params)
-
-        clusters = DataMapper.clustering_raw_qs(clustered, 'cid')
+        clusters = self.repository_class(point, screen_diagonal_points).map(kwargs=filters, order_by=order_params)
 
         serialized = self.serializer_class(clusters, many=self.many, context={
             'me': request.user,
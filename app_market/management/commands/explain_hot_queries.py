@@ -0,0 +1,138 @@
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from app_chats.models import Chat
+from app_chats.versions.v1_0.repositories import ChatsRepository
+from app_market.enums import ShiftAppealStatus, JobStatus, Currency, TransactionStatus
+from app_market.models import ShiftAppeal, Transaction
+from app_market.versions.v1_0.repositories import ShiftAppealsRepository, TransactionsRepository
+from app_media.enums import MediaType
+from app_media.models import MediaModel
+from app_users.models import UserProfile
+
+# python manage.py explain_hot_queries [--verbose] [--real-costs]
+
+# Таблицы, последовательное чтение которых в горячих запросах считается ошибкой
+HOT_TABLES = {
+    ShiftAppeal._meta.db_table,
+    Transaction._meta.db_table,
+    'app_chats__message_stat',
+    Chat._meta.db_table,
+    MediaModel._meta.db_table,
+}
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN горячих запросов ShiftAppealsRepository, TransactionsRepository и ChatsRepository. " \
+           "Завершается ошибкой, если в плане есть Seq Scan по таблицам откликов, транзакций, чатов, " \
+           "статистики сообщений и медиа."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose', action='store_true', help="Печатать планы целиком")
+        parser.add_argument(
+            '--real-costs', action='store_true',
+            help="Не отключать enable_seqscan. По умолчанию Seq Scan запрещен, чтобы на маленькой базе проверить, "
+                 "что для условия вообще есть подходящий индекс"
+        )
+
+    @staticmethod
+    def get_queries():
+        user = UserProfile.objects.order_by('id').first() or UserProfile(id=1)
+        user_ct = ContentType.objects.get_for_model(UserProfile)
+
+        return [
+            (
+                'ShiftAppealsRepository.fire_pending_appeals',
+                ShiftAppealsRepository().due_appeals(status=ShiftAppealStatus.CONFIRMED.value, fire_at__lte=now())
+            ),
+            (
+                'ShiftAppeal: назначенные увольнения',
+                ShiftAppeal.objects.filter(fire_at__lte=now(), status=ShiftAppealStatus.CONFIRMED.value)
+            ),
+            (
+                'ShiftAppealsRepository.handle_qr_related_data',
+                ShiftAppeal.objects.filter(
+                    applier=user, status=ShiftAppealStatus.CONFIRMED.value, deleted=False, job_status__isnull=False
+                )
+            ),
+            (
+                'ShiftAppealsRepository.get_by_qr_text (QR-пропуск старого формата)',
+                ShiftAppealsRepository().pass_queryset().filter(qr_text=f'userId={user.id}&appealId=0')
+            ),
+            (
+                'ShiftAppeal: активные смены по статусам',
+                ShiftAppeal.objects.filter(
+                    status=ShiftAppealStatus.CONFIRMED.value,
+                    job_status=JobStatus.JOB_IN_PROCESS.value,
+                    shift_active_date__gte=now()
+                )
+            ),
+            (
+                'TransactionsRepository.base_query',
+                TransactionsRepository(me=user).base_query
+            ),
+            (
+                'TransactionsRepository.get_grouped_stats',
+                TransactionsRepository(me=user).base_query.filter(
+                    Q(from_currency=Currency.RUB.value) | Q(to_currency=Currency.RUB.value)
+                )
+            ),
+            (
+                'Transaction: бонусный баланс пользователя',
+                Transaction.objects.filter(
+                    to_ct=user_ct, to_id=user.id, to_currency=Currency.BONUS.value,
+                    status=TransactionStatus.COMPLETED.value
+                )
+            ),
+            (
+                'ChatsRepository.load_unread_counts',
+                ChatsRepository(me=user).unread_messages()
+            ),
+            (
+                'ChatsRepository.get_abandoned_chats_ids',
+                Chat.objects.filter(abandon_at__lte=now(), state__in=ChatsRepository.ABANDONABLE_STATES)
+            ),
+            (
+                'MediaRepository: аватар владельца',
+                MediaModel.objects.filter(
+                    owner_ct=user_ct, owner_id=user.id, type=MediaType.AVATAR.value, deleted=False
+                )
+            ),
+        ]
+
+    @staticmethod
+    def seq_scans(plan):
+        found = []
+        if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in HOT_TABLES:
+            found.append(plan['Relation Name'])
+        for subplan in plan.get('Plans', []):
+            found.extend(Command.seq_scans(subplan))
+        return found
+
+    def handle(self, *args, **options):
+        failed = []
+
+        with transaction.atomic():
+            if not options['real_costs']:
+                with connection.cursor() as c:
+                    c.execute('SET LOCAL enable_seqscan = off')
+
+            for title, queryset in self.get_queries():
+                plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+                tables = self.seq_scans(plan)
+                if tables:
+                    failed.append(title)
+                    self.stdout.write(f"[SEQ SCAN] {title}: {', '.join(sorted(set(tables)))}\n")
+                else:
+                    self.stdout.write(f"[OK] {title}\n")
+                if options['verbose'] or tables:
+                    self.stdout.write(f"{queryset.explain()}\n\n")
+
+        if failed:
+            raise CommandError(f"Последовательное чтение в запросах: {', '.join(failed)}")
+        self.stdout.write("[DONE]\n")
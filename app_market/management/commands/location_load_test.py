@@ -0,0 +1,89 @@
+import math
+import random
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+
+from app_market.models import Shift
+from app_market.versions.v1_0.repositories import ShiftsRepository
+from app_users.enums import AccountType
+from app_users.models import UserProfile
+from app_users.versions.v1_0.repositories import ProfileRepository
+from giberno import settings
+
+# python manage.py location_load_test --users=200 --pings=10000 --threads=16 [--shift=ID]
+# Геопозиции пользователей после теста восстанавливаются
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный тест геопозиций работников: параллельные пинги ShiftsRepository.work_location_update " \
+           "вокруг магазина смены, затем сброс буфера геопозиций в бд."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help="Сколько смз присылают геопозицию")
+        parser.add_argument('--pings', type=int, default=10000, help="Количество пингов")
+        parser.add_argument('--threads', type=int, default=16, help="Количество параллельных потоков")
+        parser.add_argument('--shift', type=int, help="ID смены, по умолчанию - первая смена магазина с координатами")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        shifts = Shift.objects.filter(vacancy__shop__location__isnull=False).select_related('vacancy__shop')
+        if options['shift']:
+            shifts = shifts.filter(id=options['shift'])
+        shift = shifts.order_by('id').first()
+        if not shift:
+            raise CommandError('Нет смены с координатами магазина')
+
+        users = list(UserProfile.objects.filter(
+            account_type=AccountType.SELF_EMPLOYED, deleted=False
+        ).order_by('id')[:options['users']])
+        if not users:
+            raise CommandError('Нет самозанятых пользователей')
+        locations = {user.id: user.location for user in users}
+
+        # Точки в пределах двух радиусов вакансии вокруг магазина: часть пингов вне геозоны
+        center = shift.vacancy.shop.location
+        spread = (shift.vacancy.radius or 500) * 2 / 111000  # Метры в градусы широты
+        rnd = random.Random(options['seed'])
+        pings = [
+            (
+                rnd.choice(users),
+                Point(
+                    center.x + rnd.uniform(-spread, spread) / max(math.cos(math.radians(center.y)), 0.01),
+                    center.y + rnd.uniform(-spread, spread),
+                    srid=settings.SRID
+                )
+            ) for _ in range(options['pings'])
+        ]
+
+        def ping(item):
+            user, point = item
+            started = perf_counter()
+            should_notify_managers, *_ = ShiftsRepository(me=user).work_location_update(point, shift.id)
+            return perf_counter() - started, should_notify_managers
+
+        started = perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(ping, pings))
+        elapsed = perf_counter() - started
+        latencies = sorted(latency for latency, _ in results)
+
+        self.stdout.write(
+            f"Пингов: {len(pings)}, потоков: {options['threads']}, смз: {len(users)}, смена: {shift.id}\n"
+            f"  время: {elapsed:.2f} с, {len(pings) / elapsed:.0f} пингов/с\n"
+            f"  задержка p50: {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+            f"p95: {latencies[int(len(latencies) * 0.95)] * 1000:.1f} мс\n"
+            f"  оповещений менеджеров: {sum(1 for _, notify in results if notify)}\n"
+        )
+
+        try:
+            started = perf_counter()
+            flushed = UserProfile.locations_buffer.flush(ProfileRepository.apply_locations)
+            self.stdout.write(f"Сброс буфера: {flushed} геопозиций за {perf_counter() - started:.3f} с\n")
+        finally:
+            for user_id, location in locations.items():
+                UserProfile.objects.filter(pk=user_id).update(location=location)
+
+        self.stdout.write("[DONE]\n")
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from backend.profiling import QueryProfileStats
+
+# python manage.py query_profile_report [--top=30] [--reset]
+# Сводка собирается при QUERY_PROFILER=True (QueryProfilerMiddleware, события сокетов, задачи celery)
+
+
+class Command(BaseCommand):
+    help = "Сводка профилирования SQL-запросов по эндпоинтам, событиям сокетов и задачам: " \
+           "среднее количество запросов, время и подозрения на N+1."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=30, help="Сколько эндпоинтов выводить")
+        parser.add_argument('--reset', action='store_true', help="Очистить накопленную сводку")
+
+    def handle(self, *args, **options):
+        stats = QueryProfileStats()
+        if options['reset']:
+            stats.clear()
+            self.stdout.write("[DONE] Сводка очищена\n")
+            return
+
+        rows = sorted(
+            stats.get_all(),
+            key=lambda row: row[1].get('queries', 0) / max(row[1].get('calls', 1), 1),
+            reverse=True
+        )
+        for label, values, suspects in rows[:options['top']]:
+            calls = max(values.get('calls', 1), 1)
+            self.stdout.write(
+                f"{label}: вызовов {int(calls)}, запросов в среднем {values.get('queries', 0) / calls:.1f}, "
+                f"{values.get('duration_ms', 0) / calls:.1f} мс (бд {values.get('db_duration_ms', 0) / calls:.1f} мс), "
+                f"с N+1: {int(values.get('n_plus_one', 0))}\n"
+            )
+            for sql, count in suspects:
+                self.stdout.write(f"  N+1 x{count}: {sql[:300]}\n")
+        self.stdout.write("[DONE]\n")
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app_market.enums import Currency
+from app_market.versions.v1_0.repositories import TransactionsRepository
+from app_users.models import UserMoney
+
+# python manage.py reconcile_balances [--users=1,2,3] [--fix]
+
+
+class Command(BaseCommand):
+    help = "Сверка материализованных балансов UserMoney с полным пересчетом по истории транзакций."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=str, default=None, help="ID пользователей через запятую (по умолчанию все)")
+        parser.add_argument('--fix', action='store_true', default=False, help="Перезаписать расхождения пересчетом")
+
+    def handle(self, *args, **options):
+        users_ids = [int(i) for i in options['users'].split(',')] if options['users'] else None
+
+        with transaction.atomic():
+            expected = TransactionsRepository.aggregate_balances(users_ids=users_ids)
+            money = UserMoney.objects.select_for_update() if options['fix'] else UserMoney.objects.all()
+            if users_ids is not None:
+                money = money.filter(user_id__in=users_ids)
+            actual = {(m['user_id'], m['currency']): m['amount'] or 0 for m in money.values('user_id', 'currency', 'amount')}
+
+            mismatches = []
+            for key in sorted(set(expected) | set(actual)):
+                if expected.get(key, 0) != actual.get(key, 0):
+                    mismatches.append((key, actual.get(key, 0), expected.get(key, 0)))
+
+            for (user_id, currency), actual_amount, expected_amount in mismatches:
+                self.stdout.write(
+                    f"Пользователь {user_id}, {Currency(currency).name}: "
+                    f"в UserMoney {actual_amount}, по транзакциям {expected_amount}\n"
+                )
+                if options['fix']:
+                    UserMoney.objects.update_or_create(
+                        user_id=user_id, currency=currency, defaults={'amount': expected_amount}
+                    )
+
+        self.stdout.write(f"Проверено балансов: {len(set(expected) | set(actual))}, расхождений: {len(mismatches)}\n")
+        if mismatches and not options['fix']:
+            raise CommandError("Материализованные балансы расходятся с историей транзакций")
+        self.stdout.write("[DONE]\n")
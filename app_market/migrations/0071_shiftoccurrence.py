@@ -0,0 +1,73 @@
+# Generated by Django 3.1.4 on 2026-10-18 10:00
+
+from datetime import datetime, timedelta
+
+import django.db.models.deletion
+import pytz
+from dateutil.rrule import rrule
+from django.db import migrations, models
+from django.utils.timezone import now, localtime
+
+SHIFT_OCCURRENCES_HORIZON_DAYS = 92
+
+
+def fill_shift_occurrences(apps, schema_editor):
+    # Первичное заполнение материализованного расписания (аналог ShiftsRepository.rebuild_occurrences)
+    Shift = apps.get_model('app_market', 'Shift')
+    ShiftOccurrence = apps.get_model('app_market', 'ShiftOccurrence')
+
+    occurrences = []
+    for shift in Shift.objects.filter(deleted=False, frequency__isnull=False).select_related('vacancy'):
+        vacancy_timezone = pytz.timezone(shift.vacancy.timezone or 'Europe/Moscow')
+        today = localtime(now(), timezone=vacancy_timezone).date()
+
+        kwargs = {}
+        if shift.by_weekday:
+            kwargs['byweekday'] = shift.by_weekday
+        if shift.by_monthday:
+            kwargs['bymonthday'] = shift.by_monthday
+        if shift.by_month:
+            kwargs['bymonth'] = shift.by_month
+
+        anchor = shift.created_at.date() if shift.created_at else today
+        dtstart = datetime.combine(min(anchor, today), datetime.min.time())
+        until = datetime.combine(today + timedelta(days=SHIFT_OCCURRENCES_HORIZON_DAYS), datetime.min.time())
+
+        occurrences += [
+            ShiftOccurrence(shift_id=shift.id, date=o.date())
+            for o in rrule(freq=shift.frequency, dtstart=dtstart, until=until, **kwargs) if o.date() >= today
+        ]
+
+    ShiftOccurrence.objects.bulk_create(occurrences, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_market', '0070_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShiftOccurrence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Активная дата смены (в часовом поясе вакансии)')),
+                ('shift', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='app_market.shift')),
+            ],
+            options={
+                'verbose_name': 'Активная дата смены',
+                'verbose_name_plural': 'Активные даты смен',
+                'db_table': 'app_market__shift_occurrences',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='shiftoccurrence',
+            index=models.Index(fields=['date'], name='app_market__shift_occ__date'),
+        ),
+        migrations.AddConstraint(
+            model_name='shiftoccurrence',
+            constraint=models.UniqueConstraint(fields=('shift', 'date'), name='app_market__shift_occurrences__shift_date'),
+        ),
+        migrations.RunPython(fill_shift_occurrences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Least
+from django.utils.timezone import now
+
+
+def fill_next_transition_at(apps, schema_editor):
+    # Первичное заполнение времени следующего перехода (аналог ShiftAppealsRepository.get_next_transition_at)
+    # Статусы - значениями, а не enum приложения: миграция не должна зависеть от текущего кода
+    ShiftAppeal = apps.get_model('app_market', 'ShiftAppeal')
+    active = ShiftAppeal.objects.filter(deleted=False)
+
+    active.filter(status=0).update(next_transition_at=F('time_start'))  # ShiftAppealStatus.INITIAL
+
+    confirmed = active.filter(status=1)  # ShiftAppealStatus.CONFIRMED
+    confirmed.filter(job_status__isnull=True, time_start__gt=now()).update(
+        next_transition_at=F('time_start') - timedelta(minutes=30)
+    )
+    confirmed.filter(job_status__in=[2, 3]).update(  # JobStatus.JOB_SOON, JOB_IN_PROCESS
+        next_transition_at=F('time_end')
+    )
+    confirmed.filter(job_status=4).update(  # JobStatus.WAITING_FOR_COMPLETION
+        next_transition_at=F('time_end') + timedelta(hours=1)
+    )
+    confirmed.filter(job_status=5).update(  # JobStatus.COMPLETED
+        next_transition_at=F('completed_real_time') + timedelta(minutes=15)
+    )
+    # LEAST в postgres игнорирует NULL
+    confirmed.filter(fire_at__isnull=False).update(next_transition_at=Least('next_transition_at', 'fire_at'))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('app_market', '0071_shiftoccurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shiftappeal',
+            name='next_transition_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True,
+                                       verbose_name='Время следующего автоматического перехода статуса'),
+        ),
+        migrations.RunPython(fill_next_transition_at, migrations.RunPython.noop),
+    ]
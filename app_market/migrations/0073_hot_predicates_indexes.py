@@ -0,0 +1,43 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки записи в таблицы (CREATE INDEX CONCURRENTLY вне транзакции)
+    atomic = False
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('app_market', '0072_shiftappeal_next_transition_at'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='shiftappeal',
+            index=models.Index(
+                fields=['status', 'job_status', 'shift_active_date'], name='app_market__appeals__statuses'
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='shiftappeal',
+            index=models.Index(fields=['applier', 'status'], name='app_market__appeals__applier'),
+        ),
+        AddIndexConcurrently(
+            model_name='shiftappeal',
+            index=models.Index(
+                condition=models.Q(fire_at__isnull=False), fields=['fire_at'], name='app_market__appeals__fire_at'
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(
+                fields=['from_ct', 'from_id', 'from_currency', 'status'], name='app_market__transactions__from'
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['to_ct', 'to_id', 'to_currency', 'status'], name='app_market__transactions__to'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индекс строится без блокировки записи в таблицу (CREATE INDEX CONCURRENTLY вне транзакции)
+    atomic = False
+
+    dependencies = [
+        ('app_market', '0073_hot_predicates_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='shiftappeal',
+            index=models.Index(
+                condition=models.Q(qr_text__isnull=False), fields=['qr_text'], name='app_market__appeals__qr_text'
+            ),
+        ),
+    ]
@@ -17,6 +17,7 @@ from app_market.enums import Currency, TransactionType, TransactionStatus, Vacan
 from app_media.models import MediaModel
 from app_users.enums import REQUIRED_DOCS_FOR_CHOICES
 from app_users.models import UserProfile
+from backend.counters import BufferedCounter
 from backend.models import BaseModel
 from backend.utils import choices
 from giberno import settings
@@ -161,6 +162,7 @@ class Vacancy(BaseModel):
     rating = models.FloatField(default=0, verbose_name='Рейтинг')
     rates_count = models.PositiveIntegerField(default=0, verbose_name='Количество оценок')
     views_count = models.PositiveIntegerField(default=0, verbose_name='Количество просмотров')
+    views_counter = BufferedCounter('vacancies:views')
 
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
 
@@ -177,8 +179,14 @@ class Vacancy(BaseModel):
         return f'{self.title}'
 
     def increment_views_count(self):
-        self.views_count += 1
-        self.save()
+        # Просмотр копится в буфере redis, в бд попадает пачкой задачей flush_vacancies_views
+        pending = self.views_counter.incr(self.id)
+        if pending is None:
+            # redis недоступен - атомарный инкремент в бд без перезаписи всей строки
+            Vacancy.objects.filter(pk=self.pk).update(views_count=models.F('views_count') + 1)
+            pending = 1
+        # Для ответа учитываем еще не сброшенные в бд просмотры
+        self.views_count += pending
 
     class Meta:
         db_table = 'app_market__vacancies'
@@ -244,6 +252,28 @@ class Shift(BaseModel):
         verbose_name_plural = 'Рабочие смены'
 
 
+class ShiftOccurrence(models.Model):
+    # Материализованное расписание смены - одна запись на каждую активную дату смены
+    # Заполняется из RRULE полей смены на скользящий горизонт (ShiftsRepository.rebuild_occurrences)
+    shift = models.ForeignKey(to=Shift, on_delete=models.CASCADE, related_name='occurrences')
+    date = models.DateField(verbose_name='Активная дата смены (в часовом поясе вакансии)')
+
+    def __str__(self):
+        return f'{self.shift_id} - {self.date}'
+
+    class Meta:
+        db_table = 'app_market__shift_occurrences'
+        verbose_name = 'Активная дата смены'
+        verbose_name_plural = 'Активные даты смен'
+
+        constraints = [
+            models.UniqueConstraint(fields=['shift', 'date'], name='app_market__shift_occurrences__shift_date'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='app_market__shift_occ__date'),
+        ]
+
+
 class ShiftAppeal(BaseModel):
     applier = models.ForeignKey(to=UserProfile, on_delete=models.CASCADE, related_name='appeals')
     shift = models.ForeignKey(to=Shift, on_delete=models.CASCADE, related_name='appeals')
@@ -302,10 +332,30 @@ class ShiftAppeal(BaseModel):
     qr_text = models.CharField(max_length=150, null=True, blank=True)
     notify_leaving = models.BooleanField(default=True)
 
+    # Момент следующего автоматического перехода статуса (отмена, "работа скоро", завершение, увольнение)
+    # Пересчитывается при каждом сохранении отклика, воркер update_appeals выбирает только наступившие
+    next_transition_at = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name='Время следующего автоматического перехода статуса'
+    )
+
     class Meta:
         db_table = 'app_market__shifts_appeals'
         verbose_name = 'Отклик на рабочую смену'
         verbose_name_plural = 'Отклики на рабочие смены'
+        indexes = [
+            models.Index(
+                fields=['status', 'job_status', 'shift_active_date'], name='app_market__appeals__statuses'
+            ),
+            models.Index(fields=['applier', 'status'], name='app_market__appeals__applier'),
+            # Увольнение назначено у единиц откликов - частичный индекс
+            models.Index(
+                fields=['fire_at'], name='app_market__appeals__fire_at', condition=models.Q(fire_at__isnull=False)
+            ),
+            # Поиск отклика при сканировании QR-пропуска
+            models.Index(
+                fields=['qr_text'], name='app_market__appeals__qr_text', condition=models.Q(qr_text__isnull=False)
+            ),
+        ]
 
 
 class ShiftAppealInsurance(BaseModel):
@@ -485,6 +535,13 @@ class Transaction(BaseModel):
         db_table = 'app_market__transactions'
         verbose_name = 'Транзакция'
         verbose_name_plural = 'Транзакции'
+        indexes = [
+            # Транзакции со счета и на счет владельца (пользователь, магазин и т.д.) в валюте
+            models.Index(
+                fields=['from_ct', 'from_id', 'from_currency', 'status'], name='app_market__transactions__from'
+            ),
+            models.Index(fields=['to_ct', 'to_id', 'to_currency', 'status'], name='app_market__transactions__to'),
+        ]
 
 
 class Profession(BaseModel):
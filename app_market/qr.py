@@ -0,0 +1,38 @@
+from django.utils.crypto import salted_hmac, constant_time_compare
+
+
+class QRHandler:
+    """
+        Текст QR-пропуска: userId=<id>&appealId=<id>&sign=<подпись>.
+        Подпись (HMAC на SECRET_KEY) проверяется без обращения к бд - поддельный или поврежденный код
+        отклоняется сразу, для подписанного отклик ищется по первичному ключу.
+        Коды, выданные до появления подписи, ищутся по qr_text
+    """
+
+    SALT = 'app_market.qr_pass'
+    SIGN_SEPARATOR = '&sign='
+
+    def __init__(self, appeal):
+        self.appeal = appeal
+
+    def create_qr_data(self):
+        data = f'''userId={self.appeal.applier_id}&appealId={self.appeal.id}'''
+        return f'{data}{self.SIGN_SEPARATOR}{self.sign(data)}'
+
+    @classmethod
+    def sign(cls, data):
+        return salted_hmac(cls.SALT, data).hexdigest()[:32]
+
+    @classmethod
+    def verify(cls, qr_text):
+        """
+        :return: (user_id, appeal_id) подписанного кода, None - код без подписи
+        :raises ValueError: подпись или данные кода неверны
+        """
+        data, separator, sign = qr_text.rpartition(cls.SIGN_SEPARATOR)
+        if not separator:
+            return None
+        if not constant_time_compare(cls.sign(data), sign):
+            raise ValueError('Неверная подпись QR-кода')
+        params = dict(param.split('=', 1) for param in data.split('&'))
+        return int(params['userId']), int(params['appealId'])
@@ -1,19 +1,129 @@
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, post_init, post_delete
 from django.dispatch import receiver
 
-from app_market.models import Vacancy, Shop
+from app_market.models import Vacancy, Shop, Shift, ShiftAppeal, Transaction
+from app_market.versions.v1_0.repositories import ShiftsRepository, ShiftAppealsRepository, TransactionsRepository, \
+    VacanciesRepository
+from backend.aggregates import AggregatesCache
+from backend.clustering import ClustersCache
+from backend.geofences import ShiftGeofences
 from backend.tasks import shops_update_static_map
+from backend.timezones import get_shop_timezone_name, forget_shops_timezones
 
 
 @receiver(pre_save, sender=Vacancy)
 def set_timezone_to_vacancy(sender, instance, **kwargs):
     # Устанавливаем для вакансии часовой пояс из города, в котором она находится
-    instance.timezone = instance.shop.city.timezone \
-        if instance.shop.city and instance.shop.city.timezone else 'Europe/Moscow'
+    instance.timezone = get_shop_timezone_name(instance.shop_id, default='Europe/Moscow')
     # Поменял чтоб код не ломался при seed когда нет городов в базе данных и instance.shop.city == None
 
 
+@receiver(post_init, sender=Vacancy)
+def remember_vacancy_shop(sender, instance: Vacancy, **kwargs):
+    # Через __dict__, чтобы не подгружать отложенное поле на каждый экземпляр
+    instance._clusters_shop_id = instance.__dict__.get('shop_id')
+
+
+@receiver(post_save, sender=Vacancy)
+@receiver(post_delete, sender=Vacancy)
+def invalidate_vacancies_clusters(sender, instance: Vacancy, **kwargs):
+    # Сбрасываются только области с магазином вакансии (прежним и текущим), остальные кластеры не меняются
+    shops_ids = {instance.shop_id, getattr(instance, '_clusters_shop_id', None)} - {None}
+    locations = Shop.objects.filter(id__in=shops_ids).values_list('location', flat=True)
+    ClustersCache.invalidate_points(Vacancy._meta.model_name, locations)
+    instance._clusters_shop_id = instance.shop_id
+
+
+@receiver(post_init, sender=Shop)
+def remember_shop_location(sender, instance: Shop, **kwargs):
+    instance._clusters_location = instance.location if 'location' in instance.__dict__ else None
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def invalidate_shops_clusters(sender, instance: Shop, **kwargs):
+    # Координаты и адрес магазина входят и в кластеры вакансий, сбрасываются области прежней и новой точки
+    locations = [instance.location, getattr(instance, '_clusters_location', None)]
+    ClustersCache.invalidate_points(Shop._meta.model_name, locations)
+    ClustersCache.invalidate_points(Vacancy._meta.model_name, locations)
+    instance._clusters_location = instance.location
+
+
+@receiver(post_save, sender=Vacancy)
+@receiver(post_delete, sender=Vacancy)
+@receiver(post_save, sender=Shift)
+@receiver(post_delete, sender=Shift)
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def invalidate_vacancies_aggregates(sender, instance, **kwargs):
+    # Статистика цен и фасеты торговых сетей в фильтрах вакансий
+    AggregatesCache.invalidate(VacanciesRepository.AGGREGATES_GROUP)
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def forget_shop_timezone(sender, instance: Shop, **kwargs):
+    forget_shops_timezones([instance.id])
+
+
+@receiver(post_save, sender=Vacancy)
+@receiver(post_delete, sender=Vacancy)
+@receiver(post_save, sender=Shift)
+@receiver(post_delete, sender=Shift)
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def forget_shifts_geofences(sender, instance, **kwargs):
+    # Координаты магазина, радиус и часовой пояс вакансии в геозонах смен (в других процессах истекут по TTL)
+    ShiftGeofences.forget_shifts()
+
+
+@receiver(post_save, sender=ShiftAppeal)
+@receiver(post_delete, sender=ShiftAppeal)
+def forget_appeal_geofence(sender, instance: ShiftAppeal, **kwargs):
+    ShiftGeofences.forget_appeals(instance.applier_id, instance.shift_id)
+
+
 @receiver(post_save, sender=Shop)
 def update_static_map(sender, instance: Shop, created, **kwargs):
     # Генерируем картинку статической карты
     shops_update_static_map.s(shops_ids=[instance.id]).apply_async()
+
+
+@receiver(post_save, sender=Shift)
+def update_shift_occurrences(sender, instance: Shift, created, **kwargs):
+    # Пересчитываем материализованное расписание смены (изменились frequency/by_*/время)
+    ShiftsRepository.rebuild_occurrences([instance.id])
+
+
+@receiver(pre_save, sender=ShiftAppeal)
+def set_next_transition_at(sender, instance: ShiftAppeal, **kwargs):
+    # Пересчитываем момент следующего автоматического перехода статуса отклика
+    instance.next_transition_at = ShiftAppealsRepository.get_next_transition_at(instance)
+
+
+def get_transaction_balance_values(instance: Transaction):
+    return {field: getattr(instance, field) for field in TransactionsRepository.BALANCE_FIELDS}
+
+
+@receiver(post_init, sender=Transaction)
+def remember_transaction_balance_values(sender, instance: Transaction, **kwargs):
+    # Запоминаем значения, с которыми транзакция уже учтена в балансе UserMoney
+    instance._balance_values = get_transaction_balance_values(instance)
+
+
+@receiver(post_save, sender=Transaction)
+def update_balances_on_transaction_save(sender, instance: Transaction, created, **kwargs):
+    # Применяем к материализованным балансам разницу между новым и прежним вкладом транзакции
+    values = get_transaction_balance_values(instance)
+    deltas = TransactionsRepository.get_balance_deltas(values)
+    if not created:
+        for key, delta in TransactionsRepository.get_balance_deltas(instance._balance_values).items():
+            deltas[key] = deltas.get(key, 0) - delta
+    TransactionsRepository.apply_balance_deltas(deltas)
+    instance._balance_values = values
+
+
+@receiver(post_delete, sender=Transaction)
+def update_balances_on_transaction_delete(sender, instance: Transaction, **kwargs):
+    deltas = TransactionsRepository.get_balance_deltas(instance._balance_values)
+    TransactionsRepository.apply_balance_deltas({key: -delta for key, delta in deltas.items()})
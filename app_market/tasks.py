@@ -1,31 +1,59 @@
 import uuid
+from datetime import timedelta
 
 from celery import group
 from celery import shared_task
 from django.utils.timezone import now
 from loguru import logger
+from redis.exceptions import LockError
 
 from app_market.enums import AchievementType, NotificationTitle
+from app_market.models import Shift, Vacancy
 from app_market.utils import send_socket_event_on_appeal_statuses
-from app_market.versions.v1_0.repositories import ShiftAppealsRepository, AchievementsRepository, ShiftsRepository
+from app_market.versions.v1_0.repositories import ShiftAppealsRepository, AchievementsRepository, ShiftsRepository, \
+    VacanciesRepository
 from app_sockets.controllers import SocketController
 from app_users.enums import NotificationAction, NotificationType, NotificationIcon
 from backend.controllers import PushController
+from backend.utils import get_redis_connection
 from giberno.celery import app
 
 
+UPDATE_APPEALS_LOCK_KEY = 'tasks:update_appeals:lock'
+UPDATE_APPEALS_LOCK_TIMEOUT = 60 * 5  # Сек, с запасом на долгий проход; при падении воркера блокировка истечет
+
+
 @shared_task
 def update_appeals():
-    """ Проверка откликов """
+    # Задача запускается каждые 10 сек: пока не закончен предыдущий проход, новый пропускается,
+    # иначе два воркера выбирают одни и те же отклики и отправляют оповещения дважды
+    # Блокировка redis-py хранит уникальный токен и снимается только им (compare-and-delete), поэтому проход,
+    # переживший таймаут, не снимет блокировку, уже взятую следующим проходом
+    lock = get_redis_connection().lock(UPDATE_APPEALS_LOCK_KEY, timeout=UPDATE_APPEALS_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return
+    try:
+        apply_appeals_transitions()
+    finally:
+        try:
+            lock.release()
+        except LockError as e:
+            logger.error(e)  # Блокировка истекла во время прохода
+
+
+def apply_appeals_transitions():
+    """ Проверка откликов
+        Выбираются только отклики с наступившим next_transition_at (индекс), а не все отклики за всю историю
+    """
 
     """ Отмена неподтвержденных откликов """
     canceled_appeals = ShiftAppealsRepository().bulk_cancel()
     for a in canceled_appeals:
-        applier_sockets, managers_sockets, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers_with_sockets(
+        managers_ids, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers(
             appeal=a
         )
         send_socket_event_on_appeal_statuses(
-            appeal=a, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+            appeal=a, managers_ids=managers_ids
         )
 
         icon_type = NotificationIcon.VACANCY_DECLINED.value
@@ -34,7 +62,6 @@ def update_appeals():
         send_notification_on_appeal(
             appeal=a,
             users_to_send=[a.applier],
-            sockets=applier_sockets,
             title=title,
             message=message,
             icon_type=icon_type
@@ -43,11 +70,11 @@ def update_appeals():
     """ Отмена откликов со статусом "работа скоро" """
     canceled_job_soon_appeals = ShiftAppealsRepository().bulk_cancel_with_job_soon_status()
     for a in canceled_job_soon_appeals:
-        applier_sockets, managers_sockets, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers_with_sockets(
+        managers_ids, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers(
             appeal=a
         )
         send_socket_event_on_appeal_statuses(
-            appeal=a, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+            appeal=a, managers_ids=managers_ids
         )
 
         icon_type = NotificationIcon.WORKER_CANCELED_VACANCY.value
@@ -56,7 +83,6 @@ def update_appeals():
         send_notification_on_appeal(
             appeal=a,
             users_to_send=[a.applier],
-            sockets=applier_sockets,
             title=title,
             message=message,
             icon_type=icon_type
@@ -65,11 +91,11 @@ def update_appeals():
     """ Новый job-статус "работа скоро" для откликов """
     job_soon_appeals = ShiftAppealsRepository().bulk_set_job_soon_status()
     for a in job_soon_appeals:
-        applier_sockets, managers_sockets, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers_with_sockets(
+        managers_ids, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers(
             appeal=a
         )
         send_socket_event_on_appeal_statuses(
-            appeal=a, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+            appeal=a, managers_ids=managers_ids
         )
 
         icon_type = NotificationIcon.SHIFT_START_SOON.value
@@ -78,7 +104,6 @@ def update_appeals():
         send_notification_on_appeal(
             appeal=a,
             users_to_send=[a.applier],
-            sockets=applier_sockets,
             title=title,
             message=message,
             icon_type=icon_type
@@ -87,22 +112,20 @@ def update_appeals():
     """ Новый job-статус "ожидает завершения" для откликов """
     waiting_completion = ShiftAppealsRepository().bulk_set_waiting_for_completion_status()
     for a in waiting_completion:
-        applier_sockets, managers_sockets, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers_with_sockets(
+        managers_ids, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers(
             appeal=a
         )
         send_socket_event_on_appeal_statuses(
-            appeal=a, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+            appeal=a, managers_ids=managers_ids
         )
 
         icon_type = NotificationIcon.DEFAULT.value
         title = NotificationTitle.WAITING_COMPLETION_TITLE.value
         message = f'Смена по вакансии {a.shift.vacancy.title} ожидает завершения.'
 
-        sockets = applier_sockets + managers_sockets
         send_notification_on_appeal(
             appeal=a,
             users_to_send=users_to_send,
-            sockets=sockets,
             title=title,
             message=message,
             icon_type=icon_type
@@ -112,22 +135,20 @@ def update_appeals():
     grouped_tasks = []  # Группа задач
     completed_job_appeals = ShiftAppealsRepository().bulk_set_job_completed_status()
     for a in completed_job_appeals:
-        applier_sockets, managers_sockets, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers_with_sockets(
+        managers_ids, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers(
             appeal=a
         )
         send_socket_event_on_appeal_statuses(
-            appeal=a, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+            appeal=a, managers_ids=managers_ids
         )
 
         icon_type = NotificationIcon.DEFAULT.value
         title = NotificationTitle.COMPLETED_APPEAL_TITLE.value
         message = f'Смена по вакансии {a.shift.vacancy.title} успешно завершена.'
 
-        sockets = applier_sockets + managers_sockets
         send_notification_on_appeal(
             appeal=a,
             users_to_send=users_to_send,
-            sockets=sockets,
             title=title,
             message=message,
             icon_type=icon_type
@@ -145,22 +166,22 @@ def update_appeals():
     # По истечении 15 минут после завершения работы, окончательно закрываем смену
     completed_appeals = ShiftAppealsRepository().bulk_set_completed_status()
     for a in completed_appeals:
-        applier_sockets, managers_sockets, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers_with_sockets(
+        managers_ids, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers(
             appeal=a
         )
         send_socket_event_on_appeal_statuses(
-            appeal=a, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+            appeal=a, managers_ids=managers_ids
         )
 
     """ Новый статус "отменен" и job-статус "уволен" для откликов """
     _FIRED_APPEAL_TITLE = 'Вы уволены'
     fired_appeals = ShiftAppealsRepository().fire_pending_appeals()
     for a in fired_appeals:
-        applier_sockets, managers_sockets, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers_with_sockets(
+        managers_ids, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers(
             appeal=a
         )
         send_socket_event_on_appeal_statuses(
-            appeal=a, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+            appeal=a, managers_ids=managers_ids
         )
 
         icon_type = NotificationIcon.WORKER_CANCELED_VACANCY.value
@@ -169,14 +190,16 @@ def update_appeals():
         send_notification_on_appeal(
             appeal=a,
             users_to_send=[a.applier],
-            sockets=applier_sockets,
             title=title,
             message=message,
             icon_type=icon_type
         )
 
+    """ Пересчет дедлайнов, которые наступили, но не привели к переходу """
+    ShiftAppealsRepository().release_stale_transitions()
 
-def send_notification_on_appeal(appeal, users_to_send, sockets, title, message, icon_type):
+
+def send_notification_on_appeal(appeal, users_to_send, title, message, icon_type):
     action = NotificationAction.SHIFT.value
     subject_id = appeal.shift_id
     notification_type = NotificationType.SYSTEM.value
@@ -197,8 +220,8 @@ def send_notification_on_appeal(appeal, users_to_send, sockets, title, message,
         icon_type=icon_type
     )
 
-    # Отправка уведомления по сокетам
-    SocketController(version='1.0').send_notification_to_many_connections(sockets, {
+    # Отправка уведомления по сокетам тем же пользователям
+    SocketController(version='1.0').send_notification_to_users([u.id for u in users_to_send], {
         'title': title,
         'message': message,
         'uuid': str(common_uuid),
@@ -274,11 +297,11 @@ def auto_control_timed_shifts():
         )
 
         for a in confirmed_appeals:
-            applier_sockets, managers_sockets, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers_with_sockets(
+            managers_ids, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers(
                 appeal=a
             )
             send_socket_event_on_appeal_statuses(
-                appeal=a, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=a, managers_ids=managers_ids
             )
 
             icon_type = NotificationIcon.VACANCY_APPROVED.value
@@ -287,7 +310,6 @@ def auto_control_timed_shifts():
             send_notification_on_appeal(
                 appeal=a,
                 users_to_send=[a.applier],
-                sockets=applier_sockets,
                 title=title,
                 message=message,
                 icon_type=icon_type
@@ -323,11 +345,11 @@ def auto_control_shifts():
         )
 
         for a in confirmed_appeals:
-            applier_sockets, managers_sockets, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers_with_sockets(
+            managers_ids, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers(
                 appeal=a
             )
             send_socket_event_on_appeal_statuses(
-                appeal=a, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=a, managers_ids=managers_ids
             )
 
             icon_type = NotificationIcon.VACANCY_APPROVED.value
@@ -336,18 +358,17 @@ def auto_control_shifts():
             send_notification_on_appeal(
                 appeal=a,
                 users_to_send=[a.applier],
-                sockets=applier_sockets,
                 title=title,
                 message=message,
                 icon_type=icon_type
             )
 
         for ra in rejected_appeals:
-            applier_sockets, managers_sockets, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers_with_sockets(
+            managers_ids, users_to_send = ShiftAppealsRepository.get_self_employed_and_managers(
                 appeal=ra
             )
             send_socket_event_on_appeal_statuses(
-                appeal=ra, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=ra, managers_ids=managers_ids
             )
 
             icon_type = NotificationIcon.VACANCY_DECLINED.value
@@ -356,8 +377,25 @@ def auto_control_shifts():
             send_notification_on_appeal(
                 appeal=ra,
                 users_to_send=[ra.applier],
-                sockets=applier_sockets,
                 title=title,
                 message=message,
                 icon_type=icon_type
             )
+
+
+@app.task
+def extend_shift_occurrences():
+    """
+        Продление материализованного расписания смен (ShiftOccurrence) до горизонта
+        SHIFT_OCCURRENCES_HORIZON_DAYS. Пересчитываются только последние дни горизонта,
+        запас в 2 дня покрывает разницу часовых поясов вакансий
+    """
+    date_from = now().date() + timedelta(days=ShiftsRepository.SHIFT_OCCURRENCES_HORIZON_DAYS - 2)
+    shifts_ids = Shift.objects.filter(deleted=False).values_list('id', flat=True)
+    ShiftsRepository.rebuild_occurrences(shifts_ids, date_from=date_from)
+
+
+@app.task
+def flush_vacancies_views():
+    # Сброс накопленных в redis просмотров вакансий в бд
+    Vacancy.views_counter.flush(VacanciesRepository.apply_views_increments)
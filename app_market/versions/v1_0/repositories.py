@@ -2,6 +2,7 @@ from datetime import timedelta, datetime
 
 import pytz
 from channels.db import database_sync_to_async
+from dateutil.rrule import rrule
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.db.models import GeometryField, CharField, Window
 from django.contrib.gis.db.models.functions import Distance, Envelope
@@ -10,11 +11,11 @@ from django.contrib.postgres.aggregates import BoolOr, ArrayAgg
 from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.search import TrigramSimilarity
 from django.db import transaction
-from django.db.models import Value, IntegerField, Case, When, BooleanField, Q, Count, Prefetch, F, Func, \
-    DateTimeField, DateField, Sum, ExpressionWrapper, Subquery, OuterRef, TimeField, Exists, Avg
-from django.db.models.functions import Cast, Concat, Extract, Round, Coalesce, TruncDay, TruncWeek, TruncMonth, \
+from django.db.models import Value, IntegerField, Case, When, BooleanField, Q, Count, Prefetch, F, \
+    DateTimeField, Sum, ExpressionWrapper, Subquery, OuterRef, TimeField, Exists, Avg
+from django.db.models.functions import Concat, Extract, Round, Coalesce, TruncDay, TruncWeek, TruncMonth, \
     TruncYear
-from django.utils.timezone import now, localtime
+from django.utils.timezone import now, localtime, make_aware, is_naive
 from loguru import logger
 from pytz import timezone
 from rest_framework.exceptions import PermissionDenied
@@ -28,19 +29,26 @@ from app_market.enums import ShiftWorkTime, ShiftAppealStatus, WorkExperience, V
 from app_market.models import Vacancy, Profession, Skill, Distributor, Shop, Shift, ShiftAppeal, \
     GlobalDocument, VacancyDocument, DistributorDocument, Partner, Category, Achievement, AchievementProgress, \
     Advertisement, Order, Coupon, Transaction, PartnerDocument, UserCode, Code, ShiftAppealInsurance, \
-    DistributorCategory, Structure, Position
+    DistributorCategory, Structure, Position, ShiftOccurrence
+from app_market.qr import QRHandler
 from app_market.versions.v1_0.mappers import ShiftMapper
 from app_media.enums import MediaType, MediaFormat
 from app_media.models import MediaModel
+from app_sockets.versions.v1_0.repositories import SocketsRepository
 from app_users.enums import AccountType, DocumentType
 from app_users.models import UserProfile, Document, UserMoney
 from app_users.utils import EmailSender
+from backend.aggregates import AggregatesCache
+from backend.clustering import MapTiles, ClustersCache, nearest_clustered_items, clusters_to_dicts
 from backend.entity import Error
 from backend.errors.enums import RESTErrors, ErrorsCodes
 from backend.errors.exceptions import ForbiddenException
 from backend.errors.http_exceptions import HttpException, CustomException
+from backend.geofences import ShiftGeofences
+from backend.mappers import DataMapper
 from backend.mixins import MasterRepository, MakeReviewMethodProviderRepository
-from backend.utils import ArrayRemove, datetime_to_timestamp, timestamp_to_datetime
+from backend.timezones import get_utc_offset
+from backend.utils import ArrayRemove, datetime_to_timestamp, timestamp_to_datetime, DateAtTimeTZ, paginate
 from giberno import settings
 
 
@@ -296,17 +304,42 @@ class ShopsRepository(MakeReviewMethodProviderRepository):
         return queryset
 
     def map(self, kwargs, paginator=None, order_by: list = None):
-        queryset = self.filter_by_kwargs(kwargs, paginator, order_by)
+        # Область экрана выравнивается по тайлам, кластеры по ней берутся из кэша
+        tiles = MapTiles(self.screen_diagonal_points) if self.screen_diagonal_points else None
+        filters = {'kwargs': kwargs, 'pagination': [paginator.offset, paginator.limit] if paginator else None}
+
+        def compute():
+            queryset = ShopsRepository(
+                point=self.point, screen_diagonal_points=tiles.screen_diagonal_points if tiles else None, me=self.me
+            ).filter_by_kwargs(kwargs, paginator, order_by)
+            return clusters_to_dicts(
+                DataMapper.clustering_raw_qs(self.clustering(queryset), settings.CLUSTER_ID_FIELD_NAME),
+                fields=['id', 'title', 'lon', 'lat']
+            )
 
-        return self.clustering(queryset)
+        clusters = ClustersCache.get_or_compute(self.model._meta.model_name, tiles, filters, compute)
+
+        result = []
+        for cluster in clusters:
+            clustered_ids = [item['id'] for item in cluster['clustered_items']]
+            # Кластер на карте представлен ближайшим к пользователю магазином
+            nearest = nearest_clustered_items([cluster], self.point, count=1)[0]['clustered_items'][0]
+            result.append({
+                'id': nearest['id'],
+                'title': nearest['title'],
+                'clustered_count': cluster['clustered_count'],
+                'clustered_ids': clustered_ids,
+                'lon': cluster['lon'],
+                'lat': cluster['lat'],
+            })
+        return sorted(result, key=lambda c: c['clustered_count'], reverse=True)
 
     def clustering(self, queryset):
         raw_sql = f'''
             WITH clusters AS (
                 SELECT 
-                    cluster_geometries,
-                    ST_Centroid (cluster_geometries) AS centroid,
-                    ST_NumGeometries(cluster_geometries) as clustered_count
+                    ROW_NUMBER() OVER () AS cid,
+                    cluster_geometries
                 FROM 
                     UNNEST(
                         (
@@ -324,20 +357,17 @@ class ShopsRepository(MakeReviewMethodProviderRepository):
             SELECT
                 s.id,
                 s.title,
-                clusters.clustered_count,
-                (
-                    SELECT 
-                        ARRAY_AGG(id) 
-                    FROM app_market__shops
-                    WHERE ST_Intersects(cluster_geometries, location)
-                ) AS clustered_ids,
-                ST_X(ST_Centroid (cluster_geometries)) AS lon,
-                ST_Y(ST_Centroid (cluster_geometries)) AS lat
---                 clusters.centroid
---                 ST_DistanceSphere(s.location, ST_GeomFromGeoJSON('{self.point.geojson}')) AS distance
-            FROM clusters
-            JOIN app_market__shops s ON (s.location=ST_ClosestPoint(clusters.cluster_geometries, ST_GeomFromGeoJSON('{self.point.geojson}'))) -- JOIN с ближайшей точкой 
-            ORDER BY 3 DESC
+                ST_X(s.location) AS lon,
+                ST_Y(s.location) AS lat,
+                c.cid,
+                ST_X(ST_Centroid (c.cluster_geometries)) AS c_lon,
+                ST_Y(ST_Centroid (c.cluster_geometries)) AS c_lat,
+                ST_NumGeometries(c.cluster_geometries) AS clustered_count
+            FROM clusters c
+            JOIN (
+                {queryset.only('id', 'title', 'location').query}
+            ) s ON ST_Intersects(c.cluster_geometries, s.location)
+            ORDER BY c.cid
         '''
         return self.model.objects.raw(raw_sql)
 
@@ -379,12 +409,14 @@ class ShiftsRepository(MasterRepository):
     model = Shift
 
     SHIFTS_CALENDAR_DEFAULT_DAYS_COUNT = 10
+    SHIFT_OCCURRENCES_HORIZON_DAYS = 92  # На сколько дней вперед материализуются активные даты смен
 
     def __init__(self, me=None, calendar_from=None, calendar_to=None, vacancy_timezone_name='UTC') -> None:
         super().__init__()
         # TODO брать из вакансии vacancy_timezone_name
         self.vacancy_timezone_name = vacancy_timezone_name
         self.me = me
+        self.check_calendar_to(calendar_to, vacancy_timezone_name)
         # Получаем дату начала диапазона для расписани
         self.calendar_from = localtime(
             now(), timezone=timezone(vacancy_timezone_name)
@@ -398,34 +430,26 @@ class ShiftsRepository(MasterRepository):
             if calendar_to is None else localtime(calendar_to, timezone=timezone(vacancy_timezone_name)).isoformat()
 
         # Annotation Expressions
-        self.active_dates_expression = Func(
-            F('frequency'),
-            F('by_month'),
-            F('by_monthday'),
-            F('by_weekday'),
-            Value(self.calendar_from),
-            Value(self.calendar_to),
-            function='rrule_list_occurences',  # Кастомная postgres функция (возвращает массив дат вида TIMESTAMPTZ)
-            output_field=ArrayField(DateTimeField())
-        )
-
-        self.active_today_expression = Case(
-            When(
-                # Используем поле active_dates из предыдущего annotate и кастомный lookup для приведения типов в PgSQL
-                # TIMESTAMPTZ[] -> DATE[] так как нужно проверить наличие текущей даты без времени в массиве расписания,
-                # который содержит массив дат со временем и зонами
-
-                # Можно рассмотреть вариант массива без времени, получаемого из rrule_list_occurences,
-                # чтобы не использовать кастомный lookup
-                # Для этого нужно поменять тип возвращаемых данных из кастомной функции
-                active_dates__dacontains=Cast(
-                    [localtime(now(), timezone=timezone(vacancy_timezone_name))],
-                    output_field=ArrayField(DateField())
-                ),
-                then=True
+        # Активные даты берутся из материализованного расписания (ShiftOccurrence) - индексный поиск по диапазону дат
+        self.active_dates_expression = Coalesce(
+            Subquery(
+                self.occurrences_in_range(
+                    self.calendar_from, self.calendar_to, vacancy_timezone_name
+                ).filter(
+                    shift_id=OuterRef('pk')
+                ).values('shift_id').annotate(
+                    dates=ArrayAgg('occurs_at', ordering='date')
+                ).values('dates')[:1],
+                output_field=ArrayField(DateTimeField())
             ),
-            default=False,
-            output_field=BooleanField()
+            Value([], output_field=ArrayField(DateTimeField()))
+        )
+
+        self.active_today_expression = Exists(
+            ShiftOccurrence.objects.filter(
+                shift_id=OuterRef('pk'),
+                date=localtime(now(), timezone=timezone(vacancy_timezone_name)).date()
+            )
         )
 
         # Основная часть запроса, содержащая вычисляемые поля
@@ -434,6 +458,89 @@ class ShiftsRepository(MasterRepository):
             active_today=self.active_today_expression,
         )
 
+    @classmethod
+    def check_calendar_to(cls, calendar_to, vacancy_timezone_name):
+        # Активные даты материализованы только до горизонта, дальше диапазон вернул бы пустое расписание
+        if calendar_to is None:
+            return
+        vacancy_timezone = timezone(vacancy_timezone_name)
+        today = localtime(now(), timezone=vacancy_timezone).date()
+        horizon = today + timedelta(days=cls.SHIFT_OCCURRENCES_HORIZON_DAYS)
+        if localtime(calendar_to, timezone=vacancy_timezone).date() > horizon:
+            raise CustomException(errors=[
+                dict(Error(ErrorsCodes.SHIFTS_CALENDAR_OUT_OF_HORIZON))
+            ])
+
+    @staticmethod
+    def occurrences_in_range(calendar_from, calendar_to, vacancy_timezone_name):
+        """
+            Активные даты смены в диапазоне [calendar_from, calendar_to]
+            occurs_at - активная дата со временем calendar_from (как в прежнем rrule с dtstart=calendar_from)
+        """
+        calendar_from = datetime.fromisoformat(calendar_from)
+        calendar_to = datetime.fromisoformat(calendar_to)
+
+        return ShiftOccurrence.objects.filter(
+            date__gte=calendar_from.date(),
+            date__lte=calendar_to.date()
+        ).annotate(
+            occurs_at=DateAtTimeTZ('date', calendar_from.time().isoformat(), vacancy_timezone_name)
+        ).filter(
+            occurs_at__lte=calendar_to
+        )
+
+    @staticmethod
+    def get_occurrence_dates(shift: Shift, date_from, date_to):
+        """ Даты смены по RRULE полям в диапазоне [date_from, date_to] (даты в часовом поясе вакансии) """
+        if shift.deleted or shift.frequency is None:
+            return []
+
+        kwargs = {}
+        if shift.by_weekday:
+            kwargs['byweekday'] = shift.by_weekday
+        if shift.by_monthday:
+            kwargs['bymonthday'] = shift.by_monthday
+        if shift.by_month:
+            kwargs['bymonth'] = shift.by_month
+
+        # Расписание отсчитывается от даты создания смены,
+        # чтобы еженедельные/ежемесячные смены без by_* не сдвигались вместе с запрашиваемым диапазоном
+        anchor = shift.created_at.date() if shift.created_at else date_from
+        dtstart = datetime.combine(min(anchor, date_from), datetime.min.time())
+        until = datetime.combine(date_to, datetime.min.time())
+
+        return [
+            occurrence.date() for occurrence in rrule(freq=shift.frequency, dtstart=dtstart, until=until, **kwargs)
+            if occurrence.date() >= date_from
+        ]
+
+    @classmethod
+    def rebuild_occurrences(cls, shifts_ids, date_from=None):
+        """
+            Пересчет материализованных активных дат смен от date_from (по умолчанию - сегодня)
+            до горизонта SHIFT_OCCURRENCES_HORIZON_DAYS. Прошедшие даты не трогаем
+        """
+        shifts = Shift.objects.filter(id__in=shifts_ids).select_related('vacancy')
+        for shift in shifts:
+            vacancy_timezone = timezone(shift.vacancy.timezone or 'Europe/Moscow')
+            today = localtime(now(), timezone=vacancy_timezone).date()
+            start = date_from or today
+            dates = cls.get_occurrence_dates(
+                shift, start, today + timedelta(days=cls.SHIFT_OCCURRENCES_HORIZON_DAYS)
+            )
+
+            with transaction.atomic():
+                ShiftOccurrence.objects.filter(shift_id=shift.id, date__gte=start).delete()
+                ShiftOccurrence.objects.bulk_create(
+                    [ShiftOccurrence(shift_id=shift.id, date=d) for d in dates], ignore_conflicts=True
+                )
+
+    def update(self, record_id, **kwargs):
+        # BaseRepository.update обновляет через queryset.update, сигнал post_save не срабатывает
+        record = super().update(record_id, **kwargs)
+        self.rebuild_occurrences([record_id])
+        return record
+
     def filter_by_kwargs(self, kwargs, paginator=None, order_by: list = None):
         try:
             if order_by:
@@ -483,7 +590,7 @@ class ShiftsRepository(MasterRepository):
         if queryset.count():
             for shift in queryset:
                 vacancy_timezone = pytz.timezone(shift.vacancy.timezone)
-                utc_offset = vacancy_timezone.utcoffset(datetime.utcnow()).total_seconds()
+                utc_offset = get_utc_offset(shift.vacancy.timezone)
                 for active_date in shift.active_dates:
                     # Нужно сравнивать даты без времени и только во временной зоне вакансии
                     if localtime(active_date, timezone=vacancy_timezone).date() >= localtime(
@@ -498,19 +605,8 @@ class ShiftsRepository(MasterRepository):
 
     def get_shift_for_managers(self, record_id, active_date=now()):
         shifts = self.base_query.filter(id=record_id, deleted=False).annotate(
-            # Флаг - активна ли смена в указанную дату, для фильтрации (вычислются 10 дат от текущего дня по умолчанию)
-            # для расширения диапазона надо передавать calendar_from calendar_to
-            active_this_date=Case(
-                When(
-                    active_dates__dacontains=Cast(
-                        [localtime(active_date, timezone=timezone(self.vacancy_timezone_name))],
-                        output_field=ArrayField(DateField())
-                    ),
-                    then=True
-                ),
-                default=False,
-                output_field=BooleanField()
-            )
+            # Флаг - активна ли смена в указанную дату, для фильтрации
+            active_this_date=self.active_this_date_expression(active_date)
         ).filter(active_this_date=True).select_related('vacancy').annotate(
             confirmed_appeals_count=Coalesce(Count('appeals', filter=Q(
                 appeals__status=ShiftAppealStatus.CONFIRMED.value,
@@ -526,22 +622,19 @@ class ShiftsRepository(MasterRepository):
 
     def get_shifts_on_current_date_for_vacancy(self, vacancy, current_date=now()):
         shifts = self.base_query.filter(vacancy_id=vacancy.id, deleted=False).annotate(
-            # Флаг - активна ли смена в указанную дату, для фильтрации (вычислются 10 дат от текущего дня по умолчанию)
-            # для расширения диапазона надо передавать calendar_from calendar_to
-            active_this_date=Case(
-                When(
-                    active_dates__dacontains=Cast(
-                        [localtime(current_date, timezone=timezone(self.vacancy_timezone_name))],
-                        output_field=ArrayField(DateField())
-                    ),
-                    then=True
-                ),
-                default=False,
-                output_field=BooleanField()
-            )
+            # Флаг - активна ли смена в указанную дату, для фильтрации
+            active_this_date=self.active_this_date_expression(current_date)
         ).filter(active_this_date=True)
         return shifts
 
+    def active_this_date_expression(self, active_date):
+        return Exists(
+            ShiftOccurrence.objects.filter(
+                shift_id=OuterRef('pk'),
+                date=localtime(active_date, timezone=timezone(self.vacancy_timezone_name)).date()
+            )
+        )
+
     @staticmethod
     def get_appeals_with_appliers(instance: Shift, current_date, filters):
         # TODO Нужно префетчить
@@ -560,61 +653,37 @@ class ShiftsRepository(MasterRepository):
         return appeals
 
     def work_location_update(self, point, shift_id=None):
-        self.me.location = point
-        self.me.save()
+        self.me.update_location(point)  # Пишется в буфер, в бд сбрасывается пачками задачей flush_users_locations
 
         should_notify_managers = False
         managers = None
-        managers_sockets = None
         chat_id = None
 
-        shift = Shift.objects.filter(
-            id=shift_id
-        ).select_related('vacancy').first()
-        if not shift:
+        geofence = ShiftGeofences.get_shift(shift_id)
+        if not geofence:
             raise HttpException(status_code=RESTErrors.NOT_FOUND.value, detail=f'Смена с ID={shift_id} не найдена')
 
-        vacancy_timezone_name = shift.vacancy.timezone if shift.vacancy.timezone else 'Europe/Moscow'
-
-        is_appeal_confirmed_for_today = ShiftAppeal.objects.annotate(
-            timezone=F('shift__vacancy__timezone')
-        ).filter(
-            notify_leaving=True,  # Оповещения должны быть включены для этой заявки
-            applier=self.me,
-            status=ShiftAppealStatus.CONFIRMED.value,
-            shift_id=shift_id,
-            shift_active_date__datetz=localtime(now(), timezone=timezone(vacancy_timezone_name)),
-            time_start__ltedttz=localtime(now(), timezone=timezone(vacancy_timezone_name)),
-            time_end__gtdttz=localtime(now(), timezone=timezone(vacancy_timezone_name))
-        ).exists()
-
-        is_within_radius = Vacancy.objects.annotate(  # Есть вакансия, где дистанция меньше, чем указанный в ней радиус
-            distance=Distance('shop__location', point)
-        ).filter(
-            Q(id=shift.vacancy_id, radius__isnull=False, distance__lte=F('radius')) |
-            Q(id=shift.vacancy_id, radius__isnull=True)  # Защита от вакансий без радиуса, чтобы не сигналило постоянно
-        ).exists()
-
-        if is_appeal_confirmed_for_today and not is_within_radius:
+        # Отклик и радиус проверяются по геозоне в памяти процесса, без запросов к бд на каждый пинг
+        if ShiftGeofences.has_active_appeal(self.me.id, geofence) and \
+                not ShiftGeofences.is_within_radius(geofence, point):
             should_notify_managers = True
 
-            managers, managers_sockets = VacanciesRepository.get_managers_and_sockets_for_vacancy(
-                shift.vacancy
-            )
+            vacancy = Vacancy.objects.select_related('shop').get(pk=geofence['vacancy_id'])
+            managers = VacanciesRepository.get_managers_for_vacancy(vacancy)
 
             chat = Chat.objects.filter(
                 subject_user=self.me,
                 target_ct=ContentType.objects.get_for_model(Vacancy),
-                target_id=shift.vacancy_id
+                target_id=vacancy.id
             ).first()
-            chat_id = chat.id
+            chat_id = chat.id if chat else None
 
-        return should_notify_managers, managers, managers_sockets, chat_id
+        return should_notify_managers, managers, chat_id
 
     @staticmethod
     def get_shifts_for_auto_control():
         shifts = Shift.objects.annotate(
-            timezone=F('vacancy__timezone'),  # Добавляем timezone для кастомного лукапа dacontainsdatetz
+            timezone=F('vacancy__timezone'),  # Добавляем timezone для кастомного лукапа datetz2
             employees_count=Count(  # Количество рабочих в этот день для смены
                 'appeals',
                 filter=Q(
@@ -622,24 +691,15 @@ class ShiftsRepository(MasterRepository):
                     appeals__shift_active_date__datetz2=now()
                 )
             ),
-            active_dates=Func(
-                F('frequency'),
-                F('by_month'),
-                F('by_monthday'),
-                F('by_weekday'),
-                function='rrule_list_occurences',  # Кастомная postgres функция (возвращает массив дат вида TIMESTAMPTZ)
-                output_field=ArrayField(DateTimeField())
+            active_today=Exists(
+                ShiftOccurrence.objects.annotate(
+                    timezone=F('shift__vacancy__timezone')  # Добавляем timezone для кастомного лукапа date_todaytz
+                ).filter(
+                    shift_id=OuterRef('pk'),
+                    date__date_todaytz=now()
+                )
             )
-
         ).annotate(
-            active_today=Case(
-                When(
-                    active_dates__dacontainsdatetz=now(),
-                    then=True
-                ),
-                default=False,
-                output_field=BooleanField()
-            ),
             free_places=ExpressionWrapper(
                 F('max_employees_count') - F('employees_count'),
                 output_field=IntegerField()
@@ -680,6 +740,8 @@ class VacanciesRepository(MakeReviewMethodProviderRepository):
     IS_HOT_HOURS_THRESHOLD = 4  # Количество часов до начала смены для статуса вакансии "Горящая"
     TRIGRAM_SIMILARITY_MIN_RATE = 0.3  # Мин коэффициент сходства по pg_trigram
     SIMILAR_VACANCIES_MAX_DISTANCE_M = 50000  # Максимальное расстояние для похожих вакансий
+    AGGREGATES_GROUP = 'vacancies'  # Группа AggregatesCache, сбрасывается при изменении вакансий, смен и магазинов
+    AGGREGATES_USER_FILTERS = ('is_favourite', 'appeals__')  # Фильтры, результат которых зависит от пользователя
 
     def __init__(self, point=None, screen_diagonal_points=None, me=None, timezone_name='Europe/Moscow') -> None:
         super().__init__()
@@ -820,7 +882,7 @@ class VacanciesRepository(MakeReviewMethodProviderRepository):
             records = self.base_query.exclude(deleted=True).filter(**kwargs)
 
         return self.fast_related_loading(  # Предзагрузка связанных сущностей
-            queryset=records[paginator.offset:paginator.limit] if paginator else records,
+            queryset=paginate(records, paginator),
             point=self.point
         )
 
@@ -834,18 +896,10 @@ class VacanciesRepository(MakeReviewMethodProviderRepository):
         return []
 
     def get_vacancy_managers_sockets(self, record_id):
-        record = self.model.objects.filter(pk=record_id).annotate(
-            sockets=ArrayRemove(
-                ArrayAgg(
-                    'shop__staff__sockets__socket_id',
-                    filter=Q(staff__account_type=AccountType.MANAGER.value)
-                ),
-                None
-            )
-        )
-        if record:
-            return record.sockets
-        return []
+        managers_ids = UserProfile.objects.filter(
+            shops__vacancy__id=record_id, account_type=AccountType.MANAGER.value
+        ).values_list('id', flat=True)
+        return SocketsRepository.get_connections_for_users_ids(managers_ids)
 
     def filter(self, args: list = None, kwargs={}, paginator=None, order_by: list = None):
         self.modify_kwargs(kwargs)  # Изменяем kwargs для работы с objects.filter(**kwargs)
@@ -860,7 +914,7 @@ class VacanciesRepository(MakeReviewMethodProviderRepository):
             else:
                 records = self.base_query.filter(args, **kwargs)
         return self.fast_related_loading(  # Предзагрузка связанных сущностей
-            queryset=records[paginator.offset:paginator.limit] if paginator else records,
+            queryset=paginate(records, paginator),
             point=self.point
         )
 
@@ -875,14 +929,16 @@ class VacanciesRepository(MakeReviewMethodProviderRepository):
 
     def queryset_filtered_by_current_date_range_for_manager(self, order_params, pagination, current_date, next_day):
         vacancies = self.queryset_by_manager()
-        shifts = ShiftsRepository(calendar_from=current_date, calendar_to=next_day).filter_by_kwargs(
-            kwargs={'vacancy_id__in': vacancies})
-        active_vacancies = []
-        for shift in shifts:
-            for active_date in shift.active_dates:
-                if current_date <= active_date < next_day:
-                    active_vacancies.append(shift.vacancy)
-        filters = {'id__in': [item.id for item in active_vacancies]}
+        shifts_repository = ShiftsRepository(calendar_from=current_date, calendar_to=next_day)
+        # Вакансии, у смен которых есть активная дата в диапазоне [current_date, next_day)
+        active_vacancies_ids = shifts_repository.occurrences_in_range(
+            shifts_repository.calendar_from, shifts_repository.calendar_to, shifts_repository.vacancy_timezone_name
+        ).filter(
+            occurs_at__lt=next_day,
+            shift__deleted=False,
+            shift__vacancy_id__in=vacancies
+        ).values_list('shift__vacancy_id', flat=True).distinct()
+        filters = {'id__in': active_vacancies_ids}
 
         return self.filter_by_kwargs(kwargs=filters, order_by=order_params, paginator=pagination)
 
@@ -911,6 +967,20 @@ class VacanciesRepository(MakeReviewMethodProviderRepository):
             return shifts[pagination.offset:pagination.limit]
         return shifts
 
+    @classmethod
+    def apply_views_increments(cls, increments, chunk_size=1000):
+        """ Применение накопленных просмотров {vacancy_id: прирост} одним UPDATE на пачку, без updated_at """
+        items = list(increments.items())
+        for i in range(0, len(items), chunk_size):
+            chunk = items[i:i + chunk_size]
+            cls.model.objects.filter(id__in=[vacancy_id for vacancy_id, _ in chunk]).update(
+                views_count=F('views_count') + Case(
+                    *[When(id=vacancy_id, then=Value(amount)) for vacancy_id, amount in chunk],
+                    default=Value(0),
+                    output_field=IntegerField()
+                )
+            )
+
     def get_suggestions(self, search, paginator=None):
         records = self.model.objects.exclude(deleted=True).annotate(
             similarity=TrigramSimilarity('title', search),
@@ -980,136 +1050,180 @@ class VacanciesRepository(MakeReviewMethodProviderRepository):
         return queryset
 
     def map(self, kwargs, paginator=None, order_by: list = None):
-        queryset = self.model.objects.exclude(deleted=True).filter(**kwargs).annotate(
-            location=F('shop__location'),
-            logo=Concat(
-                Value(f"'{settings.MEDIA_URL}'", output_field=CharField()),
-                Subquery(
-                    MediaModel.objects.filter(
-                        deleted=False,
-                        owner_id=OuterRef('shop_id'),
-                        type=MediaType.LOGO.value,
-                        owner_ct_id=ContentType.objects.get_for_model(Shop).id,
-                        format=MediaFormat.IMAGE.value
-                    ).values('file')[:1],
-                    output_field=CharField()
+        # Область экрана выравнивается по тайлам, кластеры по ней берутся из кэша
+        tiles = MapTiles(self.screen_diagonal_points)
+        point = tiles.snap_point(self.point)
+        filters = {
+            'kwargs': kwargs,
+            'pagination': [paginator.offset, paginator.limit] if paginator else None,
+            'point': [point.x, point.y] if point else None,
+        }
+
+        def compute():
+            queryset = self.model.objects.exclude(deleted=True).filter(**kwargs).annotate(
+                location=F('shop__location'),
+                logo=Concat(
+                    Value(f"'{settings.MEDIA_URL}'", output_field=CharField()),
+                    Subquery(
+                        MediaModel.objects.filter(
+                            deleted=False,
+                            owner_id=OuterRef('shop_id'),
+                            type=MediaType.LOGO.value,
+                            owner_ct_id=ContentType.objects.get_for_model(Shop).id,
+                            format=MediaFormat.IMAGE.value
+                        ).values('file')[:1],
+                        output_field=CharField()
+                    )
                 )
             )
-        )
-        # Фильтрация по вхождению в область на карте
-        if self.screen_diagonal_points:
+            # Фильтрация по вхождению в область на карте
             queryset = queryset.filter(
                 shop__location__contained=ExpressionWrapper(
                     Envelope(  # BoundingCircle использовался для описывающего круга
-                        MultiPoint(
-                            self.screen_diagonal_points[0], self.screen_diagonal_points[1], srid=settings.SRID
-                        )
+                        MultiPoint(*tiles.screen_diagonal_points, srid=settings.SRID)
                     ),
                     output_field=GeometryField()
                 )
             )
+            if paginator:
+                queryset = queryset[paginator.offset:paginator.limit]
 
-        return self.clustering(queryset)
+            return clusters_to_dicts(
+                DataMapper.clustering_raw_qs(
+                    self.clustering(queryset, eps=tiles.eps, point=point), settings.CLUSTER_ID_FIELD_NAME
+                ),
+                fields=['id', 'title', 'price', 'address', 'lon', 'lat', 'logo']
+            )
 
-    def clustering(self, queryset):
+        clusters = ClustersCache.get_or_compute(self.model._meta.model_name, tiles, filters, compute)
+        # Ближайшие объекты выбраны в SQL по выровненной точке, порядок уточняется по положению пользователя
+        return nearest_clustered_items(clusters, self.point)
+
+    def clustering(self, queryset, eps, point=None):
         """
         :param queryset: Отфильтрованные по области на экране данные
-        :return:
+        :param eps: Расстояние кластеризации в градусах
+        :param point: Точка, до которой считается расстояние для выбора вложенных объектов кластера
+        :return: Не больше CLUSTER_NESTED_ITEMS_COUNT ближайших объектов каждого кластера, упорядоченные по кластерам
         """
+        distance = f"ST_DistanceSphere(s.location, ST_GeomFromGeoJSON('{point.geojson}'))" if point else 'v.id'
 
         raw_sql = f'''
-            WITH clusters AS (
+            WITH clustered AS (
                 SELECT 
-                    cid, 
-                    ST_Collect(location) AS cluster_geometries, 
-                    ST_Centroid (ST_Collect(location)) AS centroid,
-                    ST_X(ST_Centroid (ST_Collect(location))) AS c_lon,
-                    ST_Y(ST_Centroid (ST_Collect(location))) AS c_lat,
-                    ARRAY_AGG(id) AS ids_in_cluster,
-                    ST_NumGeometries(ST_Collect(location)) as clustered_count,
+                    id, 
+                    ST_ClusterDBSCAN(
+                        location, 
+                        eps := {eps},
+                        minpoints := {settings.CLUSTER_MIN_POINTS_COUNT}
+                    ) OVER() AS cid, 
+                    location,
                     logo
-                FROM (
-                        SELECT 
-                            id, 
-                            ST_ClusterDBSCAN(
-                                location, 
-                                eps := ST_Distance(
-                                    ST_GeomFromGeoJSON('{self.screen_diagonal_points[0].geojson}'),
-                                    ST_GeomFromGeoJSON('{self.screen_diagonal_points[1].geojson}')
-                                )/10.0, -- 1/10 диагонали
-                                minpoints := {settings.CLUSTER_MIN_POINTS_COUNT}
-                            ) OVER() AS cid, 
-                            location,
-                            logo
-                        FROM 
-                            (
-                                {queryset.query}
-                            ) external_subquery
-
-                ) sq
-                GROUP BY cid, logo
+                FROM 
+                    (
+                        {queryset.query}
+                    ) external_subquery
             ),
 
-            computed AS (
+            clusters AS (
+                SELECT 
+                    cid, 
+                    ST_X(ST_Centroid (ST_Collect(location))) AS c_lon,
+                    ST_Y(ST_Centroid (ST_Collect(location))) AS c_lat,
+                    COUNT(*) AS clustered_count
+                FROM clustered
+                GROUP BY cid
+            )
 
+            SELECT * FROM (
                 SELECT 
                     v.id,
                     v.title,
                     v.price,
---                     v.banner,
-                    
+
                     s.address,
                     ST_X(s.location) AS lon,
                     ST_Y(s.location) AS lat,
-                    ST_DistanceSphere(s.location, ST_GeomFromGeoJSON('{self.point.geojson}')) AS distance,
-                    
-                    c.logo,
+
+                    cl.logo,
                     c.cid, 
                     c.c_lat, 
                     c.c_lon, 
-                    c.clustered_count 
-                FROM app_market__vacancies v
+                    c.clustered_count,
+                    ROW_NUMBER() OVER (PARTITION BY c.cid ORDER BY {distance}, v.id) AS n
+                FROM clustered cl
+                JOIN clusters c ON (c.cid IS NOT DISTINCT FROM cl.cid)
+                INNER JOIN app_market__vacancies v ON (v.id = cl.id)
                 INNER JOIN "app_market__shops" s ON ( v."shop_id" = s."id" ) 
-                JOIN clusters c ON (s.id=ANY(c.ids_in_cluster))
-                LEFT JOIN app_media m ON (
-                    s.id=m.owner_id
-                )
-
-            )
-
-            SELECT * FROM (
-                SELECT 
-                    *,
-                    ROW_NUMBER() OVER (PARTITION BY cid ORDER BY distance ASC) AS n
-                FROM computed
             ) a
-            WHERE n<={settings.CLUSTER_NESTED_ITEMS_COUNT}
+            WHERE n <= {settings.CLUSTER_NESTED_ITEMS_COUNT}
+            ORDER BY cid
         '''
         return self.model.objects.raw(raw_sql)
 
+    def aggregates_filters(self, kwargs):
+        """ Нормализованные параметры выборки для ключа кэша агрегатов (точки округляются до ~1 м) """
+        return {
+            'kwargs': kwargs,
+            'point': [round(self.point.x, 5), round(self.point.y, 5)] if self.point else None,
+            'screen': [
+                [round(p.x, 5), round(p.y, 5)] for p in self.screen_diagonal_points
+            ] if self.screen_diagonal_points else None,
+            # Выборка зависит от пользователя только при фильтрах по избранному и откликам
+            'me': self.me.id if self.me and any(
+                key.startswith(self.AGGREGATES_USER_FILTERS) for key in kwargs
+            ) else None,
+        }
+
+    def get_stats(self, kwargs):
+        self.modify_kwargs(kwargs)
+        return AggregatesCache.get_or_compute(
+            self.AGGREGATES_GROUP, 'stats', self.aggregates_filters(kwargs),
+            lambda: self.aggregate_stats(self.filter_by_kwargs(kwargs))
+        )
+
     @staticmethod
-    def aggregate_stats(queryset):
+    def aggregate_prices():
+        return Vacancy.objects.filter(deleted=False).values('price').order_by('price').annotate(
+            count=Count('id'),
+        ).aggregate(all_prices=ArrayAgg('price', ordering='price'), all_counts=ArrayAgg('count', ordering='price'))
+
+    @classmethod
+    def aggregate_stats(cls, queryset):
         count = queryset.aggregate(
             result_count=Count('id'),
         )
 
-        prices = Vacancy.objects.filter(deleted=False).values('price').order_by('price').annotate(
-            count=Count('id'),
-        ).aggregate(all_prices=ArrayAgg('price', ordering='price'), all_counts=ArrayAgg('count', ordering='price'))
+        # Гистограмма цен по всем вакансиям от фильтров не зависит - кэшируется одна на всех
+        prices = AggregatesCache.get_or_compute(cls.AGGREGATES_GROUP, 'prices', None, cls.aggregate_prices)
 
         return {**count, **prices}
 
-    def aggregate_distributors(self, queryset, pagination=None):
+    def get_distributors(self, kwargs, pagination=None):
+        self.modify_kwargs(kwargs)
+        distributors_ids_list = AggregatesCache.get_or_compute(
+            self.AGGREGATES_GROUP, 'distributors', self.aggregates_filters(kwargs),
+            lambda: self.aggregate_distributors_ids(self.filter_by_kwargs(kwargs))
+        )
+        return self.distributors_page(distributors_ids_list, pagination)
+
+    @staticmethod
+    def aggregate_distributors_ids(queryset):
+        """ id торговых сетей выборки по убыванию количества вакансий """
         annotated = queryset.values('shop__distributor').annotate(count=Count('shop__distributor')).order_by('-count')
+        return list(annotated.values_list('shop__distributor', flat=True))
 
-        distributors_ids_list = annotated.values_list('shop__distributor', flat=True)
+    def distributors_page(self, distributors_ids_list, pagination=None):
+        # Порядок через Case строится только для id текущей страницы, а не для всех сетей
+        distributors_ids_list = distributors_ids_list[pagination.offset:pagination.limit] \
+            if pagination else distributors_ids_list
         records = Distributor.objects.filter(pk__in=distributors_ids_list)
         if distributors_ids_list:
             preserved = Case(*[When(pk=pk, then=pos) for pos, pk in enumerate(distributors_ids_list)])
             records = records.order_by(preserved)
 
         return DistributorsRepository.fast_related_loading(  # Предзагрузка связанных сущностей
-            queryset=records[pagination.offset:pagination.limit] if pagination else records,
+            queryset=records,
             me=self.me
         )
 
@@ -1138,7 +1252,8 @@ class VacanciesRepository(MakeReviewMethodProviderRepository):
             deleted=False
         ).count()
 
-        self.me.save()
+        # Только счетчик: self.me может быть копией из AuthCache, полное сохранение затрет свежие значения
+        self.me.save(update_fields=['favourite_vacancies_count', 'updated_at'])
 
     def get_similar(self, record_id, pagination=None):
         current_vacancy = self.model.objects.filter(pk=record_id, deleted=False).select_related('shop').first()
@@ -1285,17 +1400,9 @@ class VacanciesRepository(MakeReviewMethodProviderRepository):
         return None
 
     @staticmethod
-    def get_managers_and_sockets_for_vacancy(vacancy: Vacancy):
-        sockets = []
-        managers = vacancy.shop.staff.filter(account_type=AccountType.MANAGER.value)
-
-        if managers:
-            # TODO учитывать настройки отпуска для менеджера
-            sockets = managers.aggregate(
-                sockets=ArrayRemove(ArrayAgg('sockets__socket_id'), None)
-            )['sockets']
-
-        return managers, sockets
+    def get_managers_for_vacancy(vacancy: Vacancy):
+        # TODO учитывать настройки отпуска для менеджера
+        return list(vacancy.shop.staff.filter(account_type=AccountType.MANAGER.value))
 
     def admin_filter_by_kwargs(self, kwargs, paginator=None, order_by: list = None):
         self.modify_kwargs(kwargs)  # Изменяем kwargs для работы с objects.filter(**kwargs)
@@ -1333,6 +1440,11 @@ class ShiftAppealsRepository(MasterRepository):
 
         self.limit = 10
 
+    # Интервалы автоматических переходов статусов отклика
+    JOB_SOON_INTERVAL = timedelta(minutes=30)  # "работа скоро" за 30 минут до начала
+    WAITING_FOR_COMPLETION_INTERVAL = timedelta(hours=1)  # час на решение вопроса после окончания смены
+    COMPLETED_INTERVAL = timedelta(minutes=15)  # окончательное закрытие через 15 минут после завершения
+
     @staticmethod
     def fast_related_loading(queryset, point=None):
         """ Подгрузка зависимостей с 3 уровнями вложенности по ForeignKey + GenericRelation
@@ -1377,15 +1489,38 @@ class ShiftAppealsRepository(MasterRepository):
 
         return queryset
 
+    def pass_queryset(self):
+        """ Отклик для QR-пропуска одним запросом: заявитель, смена, вакансия, магазин и серия паспорта """
+        return self.model.objects.filter(deleted=False).select_related(
+            'applier', 'shift__vacancy__shop'
+        ).annotate(
+            passport_series=Subquery(
+                Document.objects.filter(
+                    user=OuterRef('applier'), type=DocumentType.PASSPORT.value
+                ).order_by('id').values('series')[:1]  # Как .first() в handle_pass_data
+            )
+        )
+
     def get_by_qr_text(self, qr_text):
         try:
-            return self.model.objects.get(qr_text=qr_text, deleted=False)
-        except self.model.DoesNotExist:
+            ids = QRHandler.verify(qr_text)
+        except ValueError:
+            # Подпись не сошлась - в бд не идем
             raise HttpException(detail='Appeal not found', status_code=RESTErrors.NOT_FOUND.value)
 
+        queryset = self.pass_queryset().filter(qr_text=qr_text)
+        if ids is not None:
+            user_id, appeal_id = ids
+            queryset = queryset.filter(pk=appeal_id, applier_id=user_id)
+
+        appeal = queryset.first()
+        if not appeal:
+            raise HttpException(detail='Appeal not found', status_code=RESTErrors.NOT_FOUND.value)
+        return appeal
+
     @staticmethod
     def handle_date_for_appeals(shift, shift_active_date, by_end: bool = None):
-        utc_offset = pytz.timezone(shift.vacancy.timezone).utcoffset(datetime.utcnow()).total_seconds() / 3600
+        utc_offset = get_utc_offset(shift.vacancy.timezone) / 3600
         if by_end:
             time_object = shift.time_end
         else:
@@ -1588,6 +1723,7 @@ class ShiftAppealsRepository(MasterRepository):
         self.check_time_range(queryset=queryset, time_start=time_start, time_end=time_end)
 
         updated = super().update(record_id, **data)
+        self.refresh_next_transitions([updated.id])
 
         prefetched_appeals = self.prefetch_applier_and_managers(ShiftAppeal.objects.filter(id=updated.id))
 
@@ -1629,11 +1765,12 @@ class ShiftAppealsRepository(MasterRepository):
 
     def is_related_security(self, instance):
         if self.me.account_type == AccountType.SECURITY.value and \
-                instance.shift.vacancy.shop not in self.me.shops.all():
+                not self.me.shops.filter(pk=instance.shift.vacancy.shop_id).exists():
             raise PermissionDenied()
 
     def is_related_manager(self, instance):
-        if self.me.account_type == AccountType.MANAGER.value and instance.shift.vacancy.shop not in self.me.shops.all():
+        if self.me.account_type == AccountType.MANAGER.value and \
+                not self.me.shops.filter(pk=instance.shift.vacancy.shop_id).exists():
             raise PermissionDenied()
 
     def confirm_by_manager(self, record_id):
@@ -1776,10 +1913,13 @@ class ShiftAppealsRepository(MasterRepository):
 
     @staticmethod
     def handle_pass_data(appeal):
-        series = None
-        document = Document.objects.filter(user=appeal.applier, type=DocumentType.PASSPORT.value).first()
-        if document:
-            series = document.series
+        if hasattr(appeal, 'passport_series'):  # Загружен через pass_queryset
+            series = appeal.passport_series
+        else:
+            series = None
+            document = Document.objects.filter(user=appeal.applier, type=DocumentType.PASSPORT.value).first()
+            if document:
+                series = document.series
 
         data = {
             'appeal_id': appeal.id,
@@ -1796,19 +1936,21 @@ class ShiftAppealsRepository(MasterRepository):
 
         return self.handle_pass_data(appeal=appeal)
 
-    def handle_pass_data_for_security(self, qr_text):
+    def check_pass_by_security(self, qr_text):
+        """ Сканирование QR-пропуска охранником, возвращает отклик с данными для пропуска """
         appeal = self.get_by_qr_text(qr_text=qr_text)
         self.is_related_security(instance=appeal)
         appeal.security_qr_scan_time = now()
-        appeal.save()
-        return self.handle_pass_data(appeal=appeal)
+        appeal.save(update_fields=['security_qr_scan_time', 'updated_at'])
+        return appeal
 
-    def handle_pass_data_for_manager(self, qr_text):
+    def check_pass_by_manager(self, qr_text):
+        """ Сканирование QR-пропуска менеджером, возвращает отклик с данными для пропуска """
         appeal = self.get_by_qr_text(qr_text=qr_text)
         self.is_related_manager(instance=appeal)
         appeal.manager_qr_scan_time = now()
-        appeal.save()
-        return self.handle_pass_data(appeal=appeal)
+        appeal.save(update_fields=['manager_qr_scan_time', 'updated_at'])
+        return appeal
 
     def allow_pass_by_manager(self, record_id):
         appeal = self.get_by_id(record_id=record_id)
@@ -1866,31 +2008,27 @@ class ShiftAppealsRepository(MasterRepository):
         qr_pass = None
         leave_time = None
         appeal = None
-        confirmed_appeals = self.model.objects.filter(
+        confirmed_appeals = self.pass_queryset().filter(
             applier=self.me,
             status=ShiftAppealStatus.CONFIRMED.value,
-            deleted=False
         )
 
-        if confirmed_appeals.exists():
-            appeal_having_job_status = confirmed_appeals.filter(job_status__isnull=False).select_related(
-                'shift', 'shift__vacancy', 'shift__vacancy__shop'
-            ).first()
-            if appeal_having_job_status:
-                job_status = appeal_having_job_status.job_status
-                appeal = appeal_having_job_status
-                if appeal.job_status == JobStatus.JOB_IN_PROCESS.value:
-                    qr_pass = self.handle_pass_data_for_self_employed(appeal=appeal_having_job_status)
-                elif job_status == JobStatus.COMPLETED.value:
-                    leave_time = appeal_having_job_status.completed_real_time + timedelta(minutes=15)
-                    leave_time = datetime_to_timestamp(leave_time)
-                else:
-                    qr_text = appeal_having_job_status.qr_text
+        appeal_having_job_status = confirmed_appeals.filter(job_status__isnull=False).first()
+        if appeal_having_job_status:
+            job_status = appeal_having_job_status.job_status
+            appeal = appeal_having_job_status
+            if appeal.job_status == JobStatus.JOB_IN_PROCESS.value:
+                qr_pass = self.handle_pass_data_for_self_employed(appeal=appeal_having_job_status)
+            elif job_status == JobStatus.COMPLETED.value:
+                leave_time = appeal_having_job_status.completed_real_time + timedelta(minutes=15)
+                leave_time = datetime_to_timestamp(leave_time)
             else:
+                qr_text = appeal_having_job_status.qr_text
+        else:
+            # Ближайший подтвержденный отклик (без отдельной проверки exists)
+            appeal = confirmed_appeals.order_by('time_start').first()
+            if appeal:
                 job_status = JobStatusForClient.JOB_NOT_SOON.value
-                appeal = confirmed_appeals.select_related(
-                    'shift', 'shift__vacancy', 'shift__vacancy__shop'
-                ).earliest('time_start')
         return job_status, qr_text, qr_pass, leave_time, appeal
 
     def complete_appeal(self, record_id, **data):
@@ -2022,77 +2160,119 @@ class ShiftAppealsRepository(MasterRepository):
                     )
                 ).annotate(  # Аггрегируем коды документов, которые есть у пользователя
                     documents_types=ArrayRemove(ArrayAgg('documents__type', distinct=True), None),
-                    sockets_array=ArrayRemove(ArrayAgg('sockets__socket_id'), None)
                 )
             ),
             Prefetch(
                 # TODO учитывать настройки отпуска у менеджера
                 'shift__vacancy__shop__staff',
-                queryset=UserProfile.objects.filter(account_type=AccountType.MANAGER.value, deleted=False).annotate(
-                    sockets_array=ArrayRemove(ArrayAgg('sockets__socket_id'), None)
-                ),
+                queryset=UserProfile.objects.filter(account_type=AccountType.MANAGER.value, deleted=False),
                 to_attr='relevant_managers'
             )
         )
 
     @staticmethod
     def prefetch_applier_and_managers(queryset):
+        # Менеджеры магазина для оповещений об изменениях отклика, см. get_self_employed_and_managers
         return queryset.prefetch_related(
             Prefetch(
                 'applier',
-                queryset=UserProfile.objects.filter(account_type=AccountType.SELF_EMPLOYED.value).annotate(
-                    sockets_array=ArrayRemove(ArrayAgg('sockets__socket_id'), None)
-                )
+                queryset=UserProfile.objects.filter(account_type=AccountType.SELF_EMPLOYED.value)
             ),
             Prefetch(
                 # TODO учитывать настройки отпуска у менеджера
                 'shift__vacancy__shop__staff',
-                queryset=UserProfile.objects.filter(account_type=AccountType.MANAGER.value, deleted=False).annotate(
-                    sockets_array=ArrayRemove(ArrayAgg('sockets__socket_id'), None)
-                ),
+                queryset=UserProfile.objects.filter(account_type=AccountType.MANAGER.value, deleted=False),
                 to_attr='relevant_managers'
             )
         )
 
     @staticmethod
-    def get_self_employed_and_managers_with_sockets(appeal):
-        users_and_managers = []
-        applier_sockets = appeal.applier.sockets_array or []
-        managers_sockets = []
+    def get_self_employed_and_managers(appeal):
+        """
+            id менеджеров магазина и все участники отклика (менеджеры и заявитель).
+            Реестр подключений не читается: события по сокетам отправляются в личные группы пользователей
+        """
+        managers = appeal.shift.vacancy.shop.relevant_managers or []
+        return [m.id for m in managers], list(managers) + [appeal.applier]
 
-        if appeal.shift.vacancy.shop.relevant_managers:
-            for m in appeal.shift.vacancy.shop.relevant_managers:
-                managers_sockets += m.sockets_array
-                users_and_managers.append(m)
+    @classmethod
+    def get_next_transition_at(cls, appeal):
+        """ Момент, когда отклику понадобится автоматический переход статуса (None - переходов не ожидается) """
+        if appeal.deleted:
+            return None
 
-        users_and_managers.append(appeal.applier)  # Добавляем заявителя
+        def aware(value):
+            # time_start/time_end при создании отклика приходят naive в UTC
+            return make_aware(value, pytz.utc) if value and is_naive(value) else value
 
-        return applier_sockets, managers_sockets, users_and_managers
+        time_start, time_end = aware(appeal.time_start), aware(appeal.time_end)
+        deadlines = []
 
-    def bulk_cancel(self):
-        # закрытие неподтвержденных смен, у которых уже прошло время начала
+        if appeal.status == ShiftAppealStatus.INITIAL.value:
+            # Неподтвержденный отклик отменяется в момент начала смены
+            deadlines.append(time_start)
 
-        # Переводим в list ид откликов, чтобы они не перетерлись после .update()
-        appeals_ids = list(self.model.objects.annotate(
-            timezone=F('shift__vacancy__timezone')
-        ).filter(
-            deleted=False,
-            status=ShiftAppealStatus.INITIAL.value,
-            time_start__ltedttz=now()  # сравнивается время вакансии в ее часовом поясе
-        ).values_list('id', flat=True))
+        elif appeal.status == ShiftAppealStatus.CONFIRMED.value:
+            if appeal.job_status is None:
+                if time_start and time_start > now():
+                    deadlines.append(time_start - cls.JOB_SOON_INTERVAL)
+            elif appeal.job_status in [JobStatus.JOB_SOON.value, JobStatus.JOB_IN_PROCESS.value]:
+                deadlines.append(time_end)
+            elif appeal.job_status == JobStatus.WAITING_FOR_COMPLETION.value and time_end:
+                deadlines.append(time_end + cls.WAITING_FOR_COMPLETION_INTERVAL)
+            elif appeal.job_status == JobStatus.COMPLETED.value and appeal.completed_real_time:
+                deadlines.append(appeal.completed_real_time + cls.COMPLETED_INTERVAL)
 
-        self.model.objects.filter(
-            id__in=appeals_ids
-        ).update(status=ShiftAppealStatus.CANCELED.value)
+            deadlines.append(aware(appeal.fire_at))
 
-        appeals = self.model.objects.filter(
-            id__in=appeals_ids
+        deadlines = [d for d in deadlines if d is not None]
+        return min(deadlines) if deadlines else None
+
+    @classmethod
+    def refresh_next_transitions(cls, appeals_ids):
+        # Пересчет времени следующего перехода после массовых .update(), которые не вызывают pre_save
+        appeals = list(cls.model.objects.filter(id__in=appeals_ids).only(
+            'id', 'deleted', 'status', 'job_status', 'time_start', 'time_end', 'completed_real_time', 'fire_at'
+        ))
+        for appeal in appeals:
+            appeal.next_transition_at = cls.get_next_transition_at(appeal)
+        cls.model.objects.bulk_update(appeals, ['next_transition_at'], batch_size=500)
+
+    def due_appeals(self, **filters):
+        # Отклики, у которых наступил момент перехода, выборка идет по индексу next_transition_at
+        return self.model.objects.filter(
+            next_transition_at__lte=now(),
+            deleted=False,
+            **filters
         )
 
-        appeals = self.prefetch_applier_and_managers(appeals)
+    def bulk_transition(self, appeals_ids, **data):
+        # Переводим отклики в новое состояние и ставим им следующий дедлайн
+        self.model.objects.filter(id__in=appeals_ids).update(**data)
+        self.refresh_next_transitions(appeals_ids)
+
+        appeals = self.model.objects.filter(id__in=appeals_ids)
 
         # Нужны заявители, которым отправлять данные по сокетам и по пушам
-        return appeals
+        return self.prefetch_applier_and_managers(appeals)
+
+    def release_stale_transitions(self):
+        # Отклики, дедлайн которых наступил, но ни один переход не сработал (статус поменялся вручную,
+        # отклик удален и т.п.) - пересчитываем, чтобы они не попадали в выборку на каждом запуске
+        appeals_ids = list(self.model.objects.filter(next_transition_at__lte=now()).values_list('id', flat=True))
+        if appeals_ids:
+            self.refresh_next_transitions(appeals_ids)
+
+    def bulk_cancel(self):
+        # закрытие неподтвержденных смен, у которых уже прошло время начала
+
+        # Переводим в list ид откликов, чтобы они не перетерлись после .update()
+        appeals_ids = list(self.due_appeals(
+            status=ShiftAppealStatus.INITIAL.value,
+            time_start__lte=now()
+        ).values_list('id', flat=True))
+
+        return self.bulk_transition(appeals_ids, status=ShiftAppealStatus.CANCELED.value)
 
     def bulk_cancel_with_job_soon_status(self):
         # Сценарий 1: Смена началась, QR для начала смены не отсканирован.
@@ -2101,41 +2281,29 @@ class ShiftAppealsRepository(MasterRepository):
         # В таком случае, самозанятый замотивирован найти менеджера, чтобы отсканировать QR,
         # а менеджер уволить, если cамозанятый не явился.
         # Если оба оказываются безответственными, то отклик автоматически отменяется в конце смены.
-        appeals_ids = list(self.model.objects.annotate(
-            timezone=F('shift__vacancy__timezone')
-        ).filter(
-            deleted=False,
-            status=ShiftAppealStatus.CONFIRMED,
+        appeals_ids = list(self.due_appeals(
+            status=ShiftAppealStatus.CONFIRMED.value,
             job_status=JobStatus.JOB_SOON.value,
             # qr_text__isnull=False,
-            time_end__ltedttz=now()
+            time_end__lte=now()
         ).values_list('id', flat=True))
 
-        self.model.objects.filter(id__in=appeals_ids).update(
+        return self.bulk_transition(
+            appeals_ids,
             status=ShiftAppealStatus.CANCELED.value,
             # qr_text=None
         )
 
-        appeals = self.model.objects.filter(id__in=appeals_ids)
-
-        appeals = self.prefetch_applier_and_managers(appeals)
-
-        return appeals
-
     def bulk_set_job_soon_status(self):
-        soon = now() + timedelta(minutes=30)
-
-        appeals_ids = list(self.model.objects.annotate(
-            timezone=F('shift__vacancy__timezone')
-        ).filter(
-            deleted=False,
-            status=ShiftAppealStatus.CONFIRMED,
+        appeals_ids = list(self.due_appeals(
+            status=ShiftAppealStatus.CONFIRMED.value,
             job_status__isnull=True,
-            time_start__ltdttz=soon,
-            time_start__gtdttz=now(),
+            time_start__lt=now() + self.JOB_SOON_INTERVAL,
+            time_start__gt=now(),
         ).values_list('id', flat=True))
 
-        self.model.objects.filter(id__in=appeals_ids).update(
+        return self.bulk_transition(
+            appeals_ids,
             qr_text=ExpressionWrapper(
                 Concat(Value('userId='), F('applier_id'), Value('&appealId='), F('id')),
                 output_field=CharField()
@@ -2143,23 +2311,15 @@ class ShiftAppealsRepository(MasterRepository):
             job_status=JobStatus.JOB_SOON.value
         )
 
-        upcoming_appeals = self.model.objects.filter(id__in=appeals_ids)
-
-        upcoming_appeals = self.prefetch_applier_and_managers(upcoming_appeals)
-
-        return upcoming_appeals
-
     def bulk_set_waiting_for_completion_status(self):
-        appeals_ids = list(self.model.objects.annotate(
-            timezone=F('shift__vacancy__timezone')
-        ).filter(
-            deleted=False,
-            status=ShiftAppealStatus.CONFIRMED,
+        appeals_ids = list(self.due_appeals(
+            status=ShiftAppealStatus.CONFIRMED.value,
             job_status=JobStatus.JOB_IN_PROCESS.value,
-            time_end__ltdttz=now()
+            time_end__lte=now()
         ).values_list('id', flat=True))
 
-        self.model.objects.filter(id__in=appeals_ids).update(
+        return self.bulk_transition(
+            appeals_ids,
             qr_text=ExpressionWrapper(
                 Concat(Value('userId='), F('applier_id'), Value('&appealId='), F('id')),
                 output_field=CharField()
@@ -2167,86 +2327,54 @@ class ShiftAppealsRepository(MasterRepository):
             job_status=JobStatus.WAITING_FOR_COMPLETION.value
         )
 
-        appeals = self.model.objects.filter(id__in=appeals_ids)
-
-        appeals = self.prefetch_applier_and_managers(appeals)
-
-        return appeals
-
     def bulk_set_job_completed_status(self):
         # Сценарий 2: Смена закончилась, QR для завершения смены не отсканирован.
         # В данном случае, если ситуация по вине менеджера, то по истечении 1 часа после завершения смены,
         # она автоматически переходит в статус Завершена и отрабатывается метод для выплаты денег.
         # Если по вине самозанятого, то у менеджера есть час, чтобы решить вопрос
         # (продлить смену или вернуть человека) или уволить.
-        interval = timedelta(hours=1)
-
-        appeals_ids = list(self.model.objects.annotate(
-            timezone=F('shift__vacancy__timezone')
-        ).filter(
-            deleted=False,
+        appeals_ids = list(self.due_appeals(
             status=ShiftAppealStatus.CONFIRMED.value,
             job_status=JobStatus.WAITING_FOR_COMPLETION.value,
-            time_end__ltdttz=now() - interval
+            time_end__lte=now() - self.WAITING_FOR_COMPLETION_INTERVAL
         ).values_list('id', flat=True))
 
-        self.model.objects.filter(id__in=appeals_ids).update(
+        return self.bulk_transition(
+            appeals_ids,
             job_status=JobStatus.COMPLETED.value,
             completed_real_time=now()
         )
 
-        appeals_to_complete = self.model.objects.filter(id__in=appeals_ids)
-
-        appeals_to_complete = self.prefetch_applier_and_managers(appeals_to_complete)
-
-        return appeals_to_complete
-
     def bulk_set_completed_status(self):
         # После завершения смены есть таймер 15 минут, по истечении времени переводить статус в COMPLETE
-        interval = timedelta(minutes=15)
-
-        appeals_ids = list(self.model.objects.annotate(
-            timezone=F('shift__vacancy__timezone')
-        ).filter(
-            deleted=False,
+        appeals_ids = list(self.due_appeals(
             status=ShiftAppealStatus.CONFIRMED.value,
             job_status=JobStatus.COMPLETED.value,
-            completed_real_time__ltdttz=now() - interval
+            completed_real_time__lte=now() - self.COMPLETED_INTERVAL
         ).values_list('id', flat=True))
 
-        self.model.objects.filter(id__in=appeals_ids).update(
-            status=ShiftAppealStatus.COMPLETED.value,
-        )
+        appeals = self.bulk_transition(appeals_ids, status=ShiftAppealStatus.COMPLETED.value)
 
-        completed_appeals = self.model.objects.filter(id__in=appeals_ids)
-
-        completed_appeals = self.prefetch_applier_and_managers(completed_appeals)
-
-        return completed_appeals
+        # update() не вызывает сигналы - отмечаем заявителей для проверки ежедневных заданий
+        if appeals_ids:
+            UserProfile.daily_tasks_queue.mark(
+                *self.model.objects.filter(id__in=appeals_ids).values_list('applier_id', flat=True).distinct()
+            )
+        return appeals
 
     def fire_pending_appeals(self):
         # Проставить jobStatus 6 уволен при всем ожидающим увольнения заявкам
-
-        appeals_ids = list(self.model.objects.annotate(
-            timezone=F('shift__vacancy__timezone')
-        ).filter(
-            deleted=False,
+        appeals_ids = list(self.due_appeals(
             status=ShiftAppealStatus.CONFIRMED.value,
-            fire_at__isnull=False,
             fire_at__lte=now()
         ).values_list('id', flat=True))
 
-        self.model.objects.filter(id__in=appeals_ids).update(
+        return self.bulk_transition(
+            appeals_ids,
             status=ShiftAppealStatus.CANCELED.value,
             job_status=JobStatusForClient.FIRED.value
         )
 
-        appeals = self.model.objects.filter(id__in=appeals_ids)
-
-        appeals = self.prefetch_applier_and_managers(appeals)
-
-        return appeals
-
     @staticmethod
     def modify_order_for_confirmed_workers(order_by):
         if 'shift__time_start' in order_by:
@@ -2393,6 +2521,7 @@ class ShiftAppealsRepository(MasterRepository):
             status=ShiftAppealStatus.CONFIRMED.value,
             updated_at=now()
         )
+        cls.refresh_next_transitions(appeals_ids)
 
         # TODO удалять другие отклики на то же время или слишком далекие
 
@@ -2436,6 +2565,7 @@ class ShiftAppealsRepository(MasterRepository):
             cancel_reason_text=reason_text,
             updated_at=now()
         )
+        cls.refresh_next_transitions(appeals_ids)
 
         rejected_appeals = ShiftAppeal.objects.filter(
             id__in=appeals_ids
@@ -3174,11 +3304,11 @@ class OrdersRepository(MasterRepository):
         t.save()
 
     def complete_decrease_bonus_transaction(self, t):
-        if t.from_currency == Currency.BONUS.value:
-            self.check_bonus_balance_for_decreasing(t.amount)
-            TransactionsRepository(me=self.me).recalculate_money(Currency.BONUS.value)
-        t.status = TransactionStatus.COMPLETED.value
-        t.save()
+        with transaction.atomic():
+            if t.from_currency == Currency.BONUS.value:
+                self.check_bonus_balance_for_decreasing(t.amount)
+            t.status = TransactionStatus.COMPLETED.value
+            t.save()  # Баланс списывается в сигнале, под той же блокировкой строки UserMoney
 
     @staticmethod
     def fail_transaction(t):
@@ -3205,62 +3335,19 @@ class OrdersRepository(MasterRepository):
         order.status = OrderStatus.COMPLETED.value
         order.save()
 
-    def get_bonus_balance(self):
+    def get_bonus_balance(self, for_update=False):
         """
-            # Сумма всех успешных транзакций на пополнение бонусов
-            # Минус сумма всех успешных транзакций на вывод бонусов
+            # Баланс бонусов из материализованного UserMoney,
+            # который обновляется при создании и смене статуса транзакций (сигналы Transaction)
         """
-        user_ct = ContentType.objects.get_for_model(self.me)
-        # TODO учитывать exchange_rate в транзакциях на конвертацию (из бонусов в рубли например)
-        bonus_transactions = Transaction.objects.filter(
-            Q(status=TransactionStatus.COMPLETED.value) &  # Только успешные транзакции
-            Q(
-                Q(  # Уменьшение бонусов на счете пользователя (куда уходят - неважно)
-                    from_ct=user_ct,
-                    from_id=self.me.id,
-                    from_currency=Currency.BONUS.value
-                ) |
-                Q(  # Поступление бонусов на счет пользователя
-                    to_ct=user_ct,
-                    to_id=self.me.id,
-                    to_currency=Currency.BONUS.value
-                )
-            ) &
-            ~Q(  # Исключаем транзакции со своего счета на свой (если вдруг появятся)
-                from_ct=user_ct,
-                from_id=self.me.id,
-                from_currency=F('to_currency'),
-                to_ct=user_ct,
-                to_id=self.me.id,
-            )
-        ).annotate(
-            increase=Case(
-                When(
-                    # Увеличение средств, если транзакция на счет
-                    Q(to_ct=user_ct, to_id=self.me.id),
-                    then=True
-                ),
-                When(
-                    # Уменьшение средств, если транзакция со счета
-                    Q(from_ct=user_ct, from_id=self.me.id),
-                    then=False
-                ),
-                default=False,
-                output_field=BooleanField()
-            ),
-        )
-
-        amounts = bonus_transactions.aggregate(
-            increase_amount=Coalesce(Sum('amount', filter=Q(increase=True)), 0),
-            decrease_amount=Coalesce(Sum('amount', filter=Q(increase=False)), 0)
-        )
-
-        bonus_balance = amounts['increase_amount'] - amounts['decrease_amount']
-
-        return bonus_balance
+        money = UserMoney.objects.filter(user=self.me, currency=Currency.BONUS.value)
+        if for_update:
+            # Блокируем строку баланса до конца транзакции, чтобы параллельные списания не ушли в минус
+            money = money.select_for_update()
+        return money.values_list('amount', flat=True).first() or 0
 
     def check_bonus_balance_for_decreasing(self, amount):
-        if amount > self.get_bonus_balance():
+        if amount > self.get_bonus_balance(for_update=True):
             raise CustomException(errors=[
                 dict(Error(ErrorsCodes.NOT_ENOUGH_BONUS_BALANCE))
             ])
@@ -3439,6 +3526,11 @@ class CouponsRepository(MasterRepository):
 class TransactionsRepository(MasterRepository):
     model = Transaction
 
+    # Поля транзакции, от которых зависит ее вклад в материализованные балансы UserMoney
+    BALANCE_FIELDS = (
+        'status', 'amount', 'kind', 'from_ct_id', 'from_id', 'from_currency', 'to_ct_id', 'to_id', 'to_currency'
+    )
+
     def __init__(self, me=None):
         super().__init__()
         self.me = me
@@ -3492,7 +3584,7 @@ class TransactionsRepository(MasterRepository):
     def get_grouped_stats(self, interval, currency, paginator=None, timezone_name='UTC'):
         interval_name = FinancesInterval(interval).name.lower()
 
-        utc_offset = pytz.timezone(timezone_name).utcoffset(datetime.utcnow()).total_seconds()
+        utc_offset = get_utc_offset(timezone_name)
 
         transactions = self.base_query.filter(
             Q(from_currency=currency) |
@@ -3529,76 +3621,86 @@ class TransactionsRepository(MasterRepository):
             '-interval_date'
         )
 
-        if paginator:
-            return transactions[paginator.offset:paginator.limit]
-        return transactions
+        return paginate(transactions, paginator)
 
     def recalculate_money(self, currency=Currency.RUB.value):
-        user_ct = ContentType.objects.get_for_model(self.me)
+        """ Перезапись баланса пользователя полным пересчетом по истории транзакций (для восстановления) """
+        balance = self.aggregate_balances(users_ids=[self.me.id]).get((self.me.id, currency), 0)
+        UserMoney.objects.update_or_create(user=self.me, currency=currency, defaults={'amount': balance})
+
+    @staticmethod
+    def is_balance_kind(currency, kind):
         # TODO kind для бонусов
+        # В бонусный баланс идут транзакции любого вида (как в прежнем get_bonus_balance), в денежный - только с видом
+        return currency == Currency.BONUS.value or kind is not None
+
+    @classmethod
+    def get_balance_deltas(cls, values):
+        """
+            Вклад транзакции в балансы пользователей {(user_id, currency): сумма со знаком}
+            values - значения полей BALANCE_FIELDS транзакции
+        """
+        if not values or values['status'] != TransactionStatus.COMPLETED.value:
+            return {}  # Только успешные транзакции
+
+        user_ct_id = ContentType.objects.get_for_model(UserProfile).id
+        from_user_id = values['from_id'] if values['from_ct_id'] == user_ct_id else None
+        to_user_id = values['to_id'] if values['to_ct_id'] == user_ct_id else None
 
-        kind_is_null = False
-        if currency == Currency.BONUS.value:
-            kind_is_null = True
+        if from_user_id and from_user_id == to_user_id and values['from_currency'] == values['to_currency']:
+            return {}  # Со своего счета на свой в одной валюте
 
         # TODO учитывать exchange_rate в транзакциях на конвертацию (из бонусов в рубли например)
-        transactions = self.model.objects.filter(
-            Q(
-                status=TransactionStatus.COMPLETED.value,  # Только успешные транзакции
-                kind__isnull=kind_is_null  # Вид не должен быть пустым (не для бонусов)
-            ) &
-            Q(
-                Q(  # Уменьшение средств на счете пользователя (куда уходят - неважно)
-                    from_ct=user_ct,
-                    from_id=self.me.id,
-                    from_currency=currency
-                ) |
-                Q(  # Поступление средств на счет пользователя
-                    to_ct=user_ct,
-                    to_id=self.me.id,
-                    to_currency=currency
-                )
-            ) &
-            ~Q(  # Исключаем транзакции со своего счета на свой в одной валюте (если вдруг появятся)
-                from_ct=user_ct,
-                from_id=self.me.id,
-                from_currency=F('to_currency'),
-                to_ct=user_ct,
-                to_id=self.me.id
-            )
-        ).annotate(
-            # Величина транзакции со знаком (со знаком '-' если на уменьшение баланса)
-            signed_amount=Case(
-                When(
-                    # Входящая транзакция на счет
-                    Q(to_ct=user_ct, to_id=self.me.id),
-                    then=F('amount')  # Оставляем само значение
-                ),
-                When(
-                    # Исходящая со счета транзакция
-                    Q(from_ct=user_ct, from_id=self.me.id),
-                    then=ExpressionWrapper(
-                        # Меняем знак величины транзакции (0-amount)
-                        Value(0, output_field=IntegerField()) - F('amount'),
-                        output_field=IntegerField()
-                    )
-                ),
-                default=0,
-                output_field=IntegerField()
-            ),
-        )
+        deltas = {}
+        if to_user_id and cls.is_balance_kind(values['to_currency'], values['kind']):
+            # Поступление средств на счет пользователя
+            deltas[(to_user_id, values['to_currency'])] = values['amount']
+        if from_user_id and cls.is_balance_kind(values['from_currency'], values['kind']):
+            # Уменьшение средств на счете пользователя
+            key = (from_user_id, values['from_currency'])
+            deltas[key] = deltas.get(key, 0) - values['amount']
+        return deltas
 
-        money_balance = transactions.aggregate(
-            total=Coalesce(Sum('signed_amount'), 0),
-        )['total']
+    @staticmethod
+    def apply_balance_deltas(deltas):
+        with transaction.atomic():
+            # Сортировка - одинаковый порядок блокировок строк в параллельных транзакциях
+            for (user_id, currency), delta in sorted(deltas.items()):
+                if not delta:
+                    continue
+                money = UserMoney.objects.filter(user_id=user_id, currency=currency)
+                data = {'amount': Coalesce(F('amount'), 0) + delta, 'updated_at': now()}
+                if not money.update(**data):
+                    # Первая транзакция пользователя в этой валюте
+                    UserMoney.objects.get_or_create(user_id=user_id, currency=currency, defaults={'amount': 0})
+                    money.update(**data)
 
-        money, created = UserMoney.objects.get_or_create(
-            user=self.me,
-            currency=currency
-        )
+    @classmethod
+    def aggregate_balances(cls, users_ids=None):
+        """ Балансы {(user_id, currency): сумма} полным пересчетом по всей истории транзакций """
+        user_ct = ContentType.objects.get_for_model(UserProfile)
+        completed = Transaction.objects.filter(
+            status=TransactionStatus.COMPLETED.value  # Только успешные транзакции
+        ).exclude(  # Исключаем транзакции со своего счета на свой в одной валюте
+            from_ct=user_ct,
+            to_ct=user_ct,
+            from_id=F('to_id'),
+            from_currency=F('to_currency')
+        )
+
+        balances = {}
+        for side, sign in (('to', 1), ('from', -1)):
+            transactions = completed.filter(**{f'{side}_ct': user_ct}).filter(
+                Q(**{f'{side}_currency': Currency.BONUS.value}) |
+                Q(kind__isnull=False) & ~Q(**{f'{side}_currency': Currency.BONUS.value})
+            )
+            if users_ids is not None:
+                transactions = transactions.filter(**{f'{side}_id__in': users_ids})
 
-        money.amount = money_balance
-        money.save()
+            for row in transactions.values(f'{side}_id', f'{side}_currency').annotate(total=Sum('amount')).order_by():
+                key = (row[f'{side}_id'], row[f'{side}_currency'])
+                balances[key] = balances.get(key, 0) + sign * row['total']
+        return balances
 
 
 class InsuranceRepository(MasterRepository):
@@ -1,6 +1,3 @@
-from datetime import datetime
-
-import pytz
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.geos import GEOSGeometry
 from django.contrib.postgres.aggregates import ArrayAgg
@@ -31,6 +28,7 @@ from backend.errors.enums import ErrorsCodes
 from backend.errors.http_exceptions import CustomException
 from backend.fields import DateTimeField
 from backend.mixins import CRUDSerializer
+from backend.timezones import get_utc_offset
 from backend.utils import chained_get, datetime_to_timestamp, timestamp_to_datetime, ArrayRemove, choices, \
     filter_valid_uuids
 from giberno import settings
@@ -552,8 +550,7 @@ class VacanciesSerializer(CRUDSerializer):
         return vacancy.is_favourite if hasattr(vacancy, 'is_favourite') else None
 
     def get_utc_offset(self, vacancy):
-        return pytz.timezone(vacancy.timezone).utcoffset(
-            datetime.utcnow()).total_seconds() if vacancy.timezone else None
+        return get_utc_offset(vacancy.timezone)
 
     def get_is_hot(self, vacancy):
         return vacancy.is_hot if hasattr(vacancy, 'is_hot') else None
@@ -810,8 +807,7 @@ class VacancySerializer(VacanciesSerializer):
         )
 
     def get_utc_offset(self, vacancy):
-        return pytz.timezone(vacancy.timezone).utcoffset(
-            datetime.utcnow()).total_seconds() if vacancy.timezone else None
+        return get_utc_offset(vacancy.timezone)
 
     class Meta:
         model = Vacancy
@@ -870,7 +866,7 @@ class VacancyInShiftSerializer(VacanciesSerializer):
     shop = serializers.SerializerMethodField()
 
     def get_utc_offset(self, vacancy):
-        return pytz.timezone(vacancy.timezone).utcoffset(datetime.utcnow()).total_seconds()
+        return get_utc_offset(vacancy.timezone)
 
     def get_shop(self, instance):
         if instance.shop:
@@ -995,16 +991,17 @@ class VacanciesWithAppliersForManagerSerializer(CRUDSerializer):
         return 0
 
     def active_shifts(self, instance):
-        active_shifts_ids_by_date = []
-        shifts = ShiftsRepository(
+        shifts_repository = ShiftsRepository(
             calendar_from=self.context.get('current_date'),
             calendar_to=self.context.get('next_day')
-        ).filter_by_kwargs({'vacancy': instance})
-        for item in shifts:
-            if self.context.get('current_date') in item.active_dates:
-                active_shifts_ids_by_date.append(item.id)
+        )
+        active_shifts_ids_by_date = shifts_repository.occurrences_in_range(
+            shifts_repository.calendar_from, shifts_repository.calendar_to, shifts_repository.vacancy_timezone_name
+        ).filter(
+            occurs_at=self.context.get('current_date')
+        ).values('shift_id')
 
-        return Shift.objects.filter(id__in=list(set(active_shifts_ids_by_date)))
+        return Shift.objects.filter(deleted=False, vacancy=instance, id__in=active_shifts_ids_by_date)
 
     def active_appeals(self, instance):
         return ShiftAppeal.objects.annotate(
@@ -1460,7 +1457,7 @@ class ConfirmedWorkerDatesSerializer(serializers.ModelSerializer):
         return datetime_to_timestamp(instance.time_start)
 
     def get_utc_offset(self, instance):
-        return pytz.timezone(instance.shift.vacancy.timezone).utcoffset(datetime.utcnow()).total_seconds()
+        return get_utc_offset(instance.shift.vacancy.timezone)
 
     class Meta:
         model = ShiftAppeal
@@ -1865,7 +1862,7 @@ class InsuranceSerializer(serializers.ModelSerializer):
     is_confirmed = serializers.SerializerMethodField()
 
     def get_utc_offset(self, data):
-        return pytz.timezone(data.timezone).utcoffset(datetime.utcnow()).total_seconds()
+        return get_utc_offset(data.timezone)
 
     def get_is_confirmed(self, data):
         return data.confirmed_at is not None
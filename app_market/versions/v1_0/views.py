@@ -12,7 +12,8 @@ from app_feedback.versions.v1_0.serializers import POSTReviewSerializer, ReviewM
     POSTReviewByManagerSerializer, POSTShopReviewSerializer, DistributorReviewsSerializer, \
     VacancyReviewsSerializer, ShopVacanciesReviewsSerializer
 from app_market.enums import AppealCancelReason, ShiftAppealStatus, NotificationTitle, OrderType
-from app_market.utils import QRHandler, send_socket_event_on_appeal_statuses
+from app_market.qr import QRHandler
+from app_market.utils import send_socket_event_on_appeal_statuses
 from app_market.versions.v1_0.repositories import VacanciesRepository, ProfessionsRepository, SkillsRepository, \
     DistributorsRepository, ShopsRepository, ShiftsRepository, ShiftAppealsRepository, \
     MarketDocumentsRepository, PartnersRepository, AchievementsRepository, AdvertisementsRepository, OrdersRepository, \
@@ -41,10 +42,10 @@ from backend.controllers import PushController
 from backend.entity import Error
 from backend.errors.enums import ErrorsCodes, RESTErrors
 from backend.errors.http_exceptions import CustomException, HttpException
-from backend.mappers import RequestMapper, DataMapper
+from backend.mappers import RequestMapper
 from backend.mixins import CRUDAPIView
 from backend.utils import get_request_body, chained_get, get_request_headers, timestamp_to_datetime, \
-    get_timezone_name_by_geo
+    get_timezone_name_by_geo, pagination_headers
 
 
 class Distributors(CRUDAPIView):
@@ -205,7 +206,8 @@ class Vacancies(CRUDAPIView):
             'headers': get_request_headers(request),
         })
 
-        return Response(camelize(serialized.data), status=status.HTTP_200_OK)
+        headers = pagination_headers(pagination, dataset) if self.many else None
+        return Response(camelize(serialized.data), status=status.HTTP_200_OK, headers=headers)
 
 
 class ShiftAppeals(CRUDAPIView):
@@ -268,11 +270,11 @@ class ShiftAppeals(CRUDAPIView):
             if serializer.is_valid(raise_exception=True):
                 instance, created = self.repository_class(me=request.user).get_or_create(**serializer.validated_data)
                 # Отправляем по сокетам смену status и job_status смз и менеджерам
-                applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-                    .get_self_employed_and_managers_with_sockets(appeal=instance)
+                managers_ids, users_and_managers = self.repository_class \
+                    .get_self_employed_and_managers(appeal=instance)
 
                 send_socket_event_on_appeal_statuses(
-                    appeal=instance, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                    appeal=instance, managers_ids=managers_ids
                 )
 
                 if created:
@@ -291,11 +293,11 @@ class ShiftAppeals(CRUDAPIView):
             instance = self.repository_class(me=request.user).update(record_id, **serializer.validated_data)
 
             # Отправляем по сокетам смену status и job_status смз и менеджерам
-            applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-                .get_self_employed_and_managers_with_sockets(appeal=instance)
+            managers_ids, users_and_managers = self.repository_class \
+                .get_self_employed_and_managers(appeal=instance)
 
             send_socket_event_on_appeal_statuses(
-                appeal=instance, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=instance, managers_ids=managers_ids
             )
 
             return Response(camelize(ShiftAppealsSerializer(instance=instance, many=False).data))
@@ -316,14 +318,11 @@ class ShiftAppealCancel(CRUDAPIView):
         appeal, is_confirmed_appeal_canceled = self.repository_class(me=request.user).cancel(
             record_id=record_id, reason=reason, text=data.get('text')
         )
-        managers, sockets = VacanciesRepository.get_managers_and_sockets_for_vacancy(appeal.shift.vacancy)
+        managers = VacanciesRepository.get_managers_for_vacancy(appeal.shift.vacancy)
+        managers_ids = [m.id for m in managers]
 
         # Отправляем по сокетам смену status и job_status смз и менеджерам
-        send_socket_event_on_appeal_statuses(
-            appeal=appeal,
-            applier_sockets=list(appeal.applier.sockets.all().values_list('socket_id', flat=True)) or [],
-            managers_sockets=sockets
-        )
+        send_socket_event_on_appeal_statuses(appeal=appeal, managers_ids=managers_ids)
 
         if is_confirmed_appeal_canceled and managers:
             title = NotificationTitle.WORKER_CANCELED_APPEAL_TITLE.value
@@ -350,7 +349,7 @@ class ShiftAppealCancel(CRUDAPIView):
             )
 
             # Отправка уведомления по сокетам
-            SocketController(request.user, version='1.0').send_notification_to_many_connections(sockets, {
+            SocketController(request.user, version='1.0').send_notification_to_users(managers_ids, {
                 'title': title,
                 'message': message,
                 'uuid': str(common_uuid),
@@ -375,11 +374,11 @@ class ShiftAppealComplete(CRUDAPIView):
                 record_id=record_id, **serializer.validated_data
             )
             # Отправляем по сокетам смену status и job_status смз и менеджерам
-            applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-                .get_self_employed_and_managers_with_sockets(appeal=appeal)
+            managers_ids, users_and_managers = self.repository_class \
+                .get_self_employed_and_managers(appeal=appeal)
 
             send_socket_event_on_appeal_statuses(
-                appeal=appeal, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=appeal, managers_ids=managers_ids
             )
 
             return Response(None, status=status.HTTP_200_OK)
@@ -539,9 +538,7 @@ class VacanciesClusteredMap(Vacancies):
         point, screen_diagonal_points, radius = RequestMapper().geo(request)
 
         self.many = True
-        clustered = self.repository_class(point, screen_diagonal_points).map(kwargs=filters, order_by=order_params)
-
-        clusters = DataMapper.clustering_raw_qs(clustered, 'cid')
+        clusters = self.repository_class(point, screen_diagonal_points).map(kwargs=filters, order_by=order_params)
 
         serialized = self.serializer_class(clusters, many=self.many, context={
             'me': request.user,
@@ -606,16 +603,11 @@ class Shifts(CRUDAPIView):
 class VacanciesStats(Vacancies):
     def get(self, request, **kwargs):
         filters = RequestMapper(self).filters(request) or dict()
-        order_params = RequestMapper(self).order(request)
 
         point, screen_diagonal_points, radius = RequestMapper().geo(request)
-        dataset = self.repository_class(
+        stats = self.repository_class(
             point=point, screen_diagonal_points=screen_diagonal_points, me=request.user
-        ).filter_by_kwargs(
-            kwargs=filters, order_by=order_params
-        )
-
-        stats = self.repository_class.aggregate_stats(dataset)
+        ).get_stats(kwargs=filters)
 
         return Response(camelize({
             'all_prices': chained_get(stats, 'all_prices'),
@@ -628,16 +620,11 @@ class VacanciesDistributors(Vacancies):
 
     def get(self, request, **kwargs):
         filters = RequestMapper(self).filters(request) or dict()
-        order_params = RequestMapper(self).order(request)
         pagination = RequestMapper.pagination(request)
         point, screen_diagonal_points, radius = RequestMapper().geo(request)
-        dataset = self.repository_class(
+        distributors = self.repository_class(
             point=point, screen_diagonal_points=screen_diagonal_points, me=request.user
-        ).filter_by_kwargs(
-            kwargs=filters, order_by=order_params
-        )
-
-        distributors = self.repository_class(me=request.user).aggregate_distributors(dataset, pagination)
+        ).get_distributors(kwargs=filters, pagination=pagination)
         serialized = DistributorsSerializer(distributors, many=True, context={
             'me': request.user,
             'headers': get_request_headers(request),
@@ -789,11 +776,11 @@ class ConfirmAppealByManagerAPIView(CRUDAPIView):
 
         if status_changed:
             # Отправляем по сокетам смену status и job_status смз и менеджерам
-            applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-                .get_self_employed_and_managers_with_sockets(appeal=appeal)
+            managers_ids, users_and_managers = self.repository_class \
+                .get_self_employed_and_managers(appeal=appeal)
 
             send_socket_event_on_appeal_statuses(
-                appeal=appeal, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=appeal, managers_ids=managers_ids
             )
 
             title = NotificationTitle.MANAGER_ACCEPTED_APPEAL_TITLE.value
@@ -820,8 +807,8 @@ class ConfirmAppealByManagerAPIView(CRUDAPIView):
             )
 
             # Отправка уведомления по сокетам
-            SocketController(request.user, version='1.0').send_notification_to_many_connections(
-                applier_sockets,
+            SocketController(request.user, version='1.0').send_notification_to_users(
+                [appeal.applier_id],
                 {
                     'title': title,
                     'message': message,
@@ -849,11 +836,11 @@ class RejectAppealByManagerAPIView(CRUDAPIView):
 
         if status_changed:
             # Отправляем по сокетам смену status и job_status смз и менеджерам
-            applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-                .get_self_employed_and_managers_with_sockets(appeal=appeal)
+            managers_ids, users_and_managers = self.repository_class \
+                .get_self_employed_and_managers(appeal=appeal)
 
             send_socket_event_on_appeal_statuses(
-                appeal=appeal, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=appeal, managers_ids=managers_ids
             )
 
             title = NotificationTitle.MANAGER_REJECTED_APPEAL_TITLE.value
@@ -880,8 +867,8 @@ class RejectAppealByManagerAPIView(CRUDAPIView):
             )
 
             # Отправка уведомления по сокетам
-            SocketController(request.user, version='1.0').send_notification_to_many_connections(
-                applier_sockets,
+            SocketController(request.user, version='1.0').send_notification_to_users(
+                [appeal.applier_id],
                 {
                     'title': title,
                     'message': message,
@@ -1210,10 +1197,11 @@ class CheckPassByManagerAPIView(APIView):
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=get_request_body(request))
         if serializer.is_valid(raise_exception=True):
-            appeal = self.repository_class().get_by_qr_text(qr_text=serializer.validated_data.get('qr_text'))
-            data = self.repository_class(me=request.user).handle_pass_data_for_manager(
+            # Отклик, заявитель, вакансия, магазин и паспорт загружаются одним запросом
+            appeal = self.repository_class(me=request.user).check_pass_by_manager(
                 qr_text=serializer.validated_data.get('qr_text')
             )
+            data = self.repository_class.handle_pass_data(appeal=appeal)
             data.update(ConfirmedWorkerSerializer(instance=appeal.applier).data)
             return Response(camelize(data))
 
@@ -1225,10 +1213,11 @@ class CheckPassBySecurityAPIView(APIView):
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=get_request_body(request))
         if serializer.is_valid(raise_exception=True):
-            appeal = self.repository_class().get_by_qr_text(qr_text=serializer.validated_data.get('qr_text'))
-            data = self.repository_class(me=request.user).handle_pass_data_for_security(
+            # Отклик, заявитель, вакансия, магазин и паспорт загружаются одним запросом
+            appeal = self.repository_class(me=request.user).check_pass_by_security(
                 qr_text=serializer.validated_data.get('qr_text')
             )
+            data = self.repository_class.handle_pass_data(appeal=appeal)
             data.update(ConfirmedWorkerSerializer(instance=appeal.applier).data)
             return Response(camelize(data))
 
@@ -1244,14 +1233,11 @@ class RefusePassBySecurityAPIView(APIView):
                 record_id=kwargs.get('record_id'),
                 validated_data=serializer.validated_data
             )
-            managers, sockets = VacanciesRepository.get_managers_and_sockets_for_vacancy(appeal.shift.vacancy)
+            managers = VacanciesRepository.get_managers_for_vacancy(appeal.shift.vacancy)
+            managers_ids = [m.id for m in managers]
 
             # Отправляем по сокетам смену status и job_status смз и менеджерам
-            send_socket_event_on_appeal_statuses(
-                appeal=appeal,
-                applier_sockets=list(appeal.applier.sockets.all().values_list('socket_id', flat=True)) or [],
-                managers_sockets=sockets
-            )
+            send_socket_event_on_appeal_statuses(appeal=appeal, managers_ids=managers_ids)
 
             title = NotificationTitle.SECURITY_REFUSED_APPEAL_TITLE.value
             message = f'Сотрудники охраны не пропустили работника {appeal.applier.first_name} {appeal.applier.last_name} по вакансии {appeal.shift.vacancy.title}'
@@ -1277,7 +1263,7 @@ class RefusePassBySecurityAPIView(APIView):
             )
 
             # Отправка уведомления по сокетам
-            SocketController(request.user, version='1.0').send_notification_to_many_connections(sockets, {
+            SocketController(request.user, version='1.0').send_notification_to_users(managers_ids, {
                 'title': title,
                 'message': message,
                 'uuid': str(common_uuid),
@@ -1298,11 +1284,11 @@ class AllowPassByManagerAPIView(APIView):
             record_id=kwargs.get('record_id'))
 
         # Отправляем по сокетам смену status и job_status смз и менеджерам
-        applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-            .get_self_employed_and_managers_with_sockets(appeal=appeal)
+        managers_ids, users_and_managers = self.repository_class \
+            .get_self_employed_and_managers(appeal=appeal)
 
         send_socket_event_on_appeal_statuses(
-            appeal=appeal, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+            appeal=appeal, managers_ids=managers_ids
         )
 
         return Response(None, status=status.HTTP_204_NO_CONTENT)
@@ -1321,11 +1307,11 @@ class RefusePassByManagerAPIView(APIView):
             )
 
             # Отправляем по сокетам смену status и job_status смз и менеджерам
-            applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-                .get_self_employed_and_managers_with_sockets(appeal=appeal)
+            managers_ids, users_and_managers = self.repository_class \
+                .get_self_employed_and_managers(appeal=appeal)
 
             send_socket_event_on_appeal_statuses(
-                appeal=appeal, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=appeal, managers_ids=managers_ids
             )
 
             return Response(None, status=status.HTTP_204_NO_CONTENT)
@@ -1344,11 +1330,11 @@ class ShiftAppealCompleteByManager(APIView):
             )
 
             # Отправляем по сокетам смену status и job_status смз и менеджерам
-            applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-                .get_self_employed_and_managers_with_sockets(appeal=appeal)
+            managers_ids, users_and_managers = self.repository_class \
+                .get_self_employed_and_managers(appeal=appeal)
 
             send_socket_event_on_appeal_statuses(
-                appeal=appeal, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=appeal, managers_ids=managers_ids
             )
 
             return Response(None, status=status.HTTP_204_NO_CONTENT)
@@ -1390,11 +1376,11 @@ class ProlongByManager(APIView):
                 validated_data=serializer.validated_data
             )
             # Отправляем по сокетам смену status и job_status смз и менеджерам
-            applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-                .get_self_employed_and_managers_with_sockets(appeal=appeal)
+            managers_ids, users_and_managers = self.repository_class \
+                .get_self_employed_and_managers(appeal=appeal)
 
             send_socket_event_on_appeal_statuses(
-                appeal=appeal, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=appeal, managers_ids=managers_ids
             )
             return Response(None, status=status.HTTP_204_NO_CONTENT)
 
@@ -1407,7 +1393,7 @@ def work_location(request, **kwargs):
     if not body.get('shift'):
         raise HttpException(status_code=RESTErrors.BAD_REQUEST.value, detail='Необходимо передать номер смены')
 
-    should_notify_managers, managers, sockets, chat_id = ShiftsRepository(
+    should_notify_managers, managers, chat_id = ShiftsRepository(
         me=request.user
     ).work_location_update(
         point=point,
@@ -1439,7 +1425,7 @@ def work_location(request, **kwargs):
         )
 
         # Отправка уведомления по сокетам
-        SocketController(version='1.0').send_notification_to_many_connections(sockets, {
+        SocketController(version='1.0').send_notification_to_users([m.id for m in managers], {
             'title': title,
             'message': message,
             'uuid': str(common_uuid),
@@ -1761,7 +1747,9 @@ class Finances(CRUDAPIView):
                 'me': request.user,
                 'headers': get_request_headers(request),
             })
-            return Response(camelize(serialized.data), status=status.HTTP_200_OK)
+            return Response(
+                camelize(serialized.data), status=status.HTTP_200_OK, headers=pagination_headers(pagination, dataset)
+            )
 
 
 @api_view(['GET'])
@@ -2268,11 +2256,11 @@ class AdminAppeals(CRUDAPIView):
             if serializer.is_valid(raise_exception=True):
                 instance, created = self.repository_class(me=request.user).get_or_create(**serializer.validated_data)
                 # Отправляем по сокетам смену status и job_status смз и менеджерам
-                applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-                    .get_self_employed_and_managers_with_sockets(appeal=instance)
+                managers_ids, users_and_managers = self.repository_class \
+                    .get_self_employed_and_managers(appeal=instance)
 
                 send_socket_event_on_appeal_statuses(
-                    appeal=instance, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                    appeal=instance, managers_ids=managers_ids
                 )
 
                 if created:
@@ -2291,11 +2279,11 @@ class AdminAppeals(CRUDAPIView):
             instance = self.repository_class(me=request.user).update(record_id, **serializer.validated_data)
 
             # Отправляем по сокетам смену status и job_status смз и менеджерам
-            applier_sockets, managers_sockets, users_and_managers = self.repository_class \
-                .get_self_employed_and_managers_with_sockets(appeal=instance)
+            managers_ids, users_and_managers = self.repository_class \
+                .get_self_employed_and_managers(appeal=instance)
 
             send_socket_event_on_appeal_statuses(
-                appeal=instance, applier_sockets=applier_sockets, managers_sockets=managers_sockets
+                appeal=instance, managers_ids=managers_ids
             )
 
             return Response(camelize(ShiftAppealsSerializer(instance=instance, many=False).data))
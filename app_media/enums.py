@@ -35,6 +35,13 @@ class MediaType(IntEnumM):
     MIGRATION_CARD = 22  # Миграционная карта
 
 
+class MediaStatus(IntEnumM):
+    READY = 0  # Обработан (или не требует обработки)
+    PENDING = 1  # Загружен, ждет обработки в фоне
+    PROCESSING = 2  # Обрабатывается
+    FAILED = 3  # Не удалось обработать
+
+
 class FileDownloadStatus(IntEnumM):
     INITIAL = 0
     SAVED = 1
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import uuid as uuid_lib
+from time import perf_counter
+
+from PIL import Image
+from django.core.files.uploadedfile import UploadedFile
+from django.core.management.base import BaseCommand
+from ffmpy import FFmpeg
+
+from app_media.enums import MediaFormat, MimeTypes
+from app_media.mappers import MediaMapper
+from app_users.models import UserProfile
+from backend.entity import File
+
+# python manage.py media_benchmark --images=20 --videos=3 --image-side=4000 --video-duration=5
+# Время запроса (combine) и пропускная способность одного воркера на обработке (MediaMapper.process)
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк загрузки и фоновой обработки медиафайлов на сгенерированных изображениях и видео."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=20, help="Количество изображений")
+        parser.add_argument('--videos', type=int, default=3, help="Количество видео (нужен ffmpeg)")
+        parser.add_argument('--image-side', type=int, default=4000, help="Больший размер стороны изображения, px")
+        parser.add_argument('--video-duration', type=int, default=5, help="Длительность видео, сек")
+
+    @staticmethod
+    def make_image(directory, side, index):
+        path = os.path.join(directory, f'image_{index}.jpg')
+        img = Image.effect_noise((side, side * 3 // 4), 48).convert('RGB')
+        img.save(path, 'jpeg', quality=90)
+        return path, MimeTypes.JPEG.value
+
+    @staticmethod
+    def make_video(directory, duration, index):
+        path = os.path.join(directory, f'video_{index}.mp4')
+        FFmpeg(
+            inputs={f'testsrc=duration={duration}:size=1920x1080:rate=30': ['-f', 'lavfi']},
+            outputs={path: ['-pix_fmt', 'yuv420p', '-loglevel', 'error', '-y']}
+        ).run()
+        return path, MimeTypes.MP4.value[0]  # Значения видео mime-типов в MimeTypes - кортежи
+
+    @staticmethod
+    def open_upload(path, content_type):
+        return UploadedFile(
+            file=open(path, 'rb'), name=os.path.basename(path), content_type=content_type, size=os.path.getsize(path)
+        )
+
+    def handle(self, *args, **options):
+        owner = UserProfile.objects.first()
+        if not owner:
+            self.stdout.write("Нет пользователей для бенчмарка\n")
+            return
+
+        directory = tempfile.mkdtemp(prefix='media_benchmark_')
+        try:
+            samples = [self.make_image(directory, options['image_side'], i) for i in range(options['images'])]
+            if options['videos'] and shutil.which('ffmpeg'):
+                samples += [self.make_video(directory, options['video_duration'], i) for i in range(options['videos'])]
+
+            results = {}
+            for path, content_type in samples:
+                # Путь запроса: только сопоставление с владельцем, без обработки
+                upload = self.open_upload(path, content_type)
+                started = perf_counter()
+                entity = MediaMapper.combine(upload, owner, file_title=os.path.basename(path))
+                request_time = perf_counter() - started
+                upload.close()
+
+                # Фоновая обработка: то, что раньше выполнялось прямо в запросе
+                source = self.open_upload(path, content_type)
+                started = perf_counter()
+                processed = MediaMapper.process(File(uuid=uuid_lib.uuid4(), format=entity.format, file=source))
+                processing_time = perf_counter() - started
+                source.close()
+
+                stats = results.setdefault(MediaFormat(entity.format).name, {
+                    'count': 0, 'failed': 0, 'bytes': 0, 'request': 0, 'processing': 0
+                })
+                stats['count'] += 1
+                stats['failed'] += processed is None
+                stats['bytes'] += os.path.getsize(path)
+                stats['request'] += request_time
+                stats['processing'] += processing_time
+
+            for name, stats in results.items():
+                self.stdout.write(
+                    f"{name}: файлов {stats['count']} (ошибок {stats['failed']}), "
+                    f"{stats['bytes'] / stats['count'] / 1024 / 1024:.1f} МБ в среднем\n"
+                    f"  запрос (combine): {stats['request'] / stats['count'] * 1000:.2f} мс/файл\n"
+                    f"  обработка: {stats['processing'] / stats['count'] * 1000:.0f} мс/файл, "
+                    f"{stats['count'] / stats['processing']:.2f} файлов/с, "
+                    f"{stats['bytes'] / stats['processing'] / 1024 / 1024:.1f} МБ/с на воркер\n"
+                )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        self.stdout.write("[DONE]\n")
@@ -2,7 +2,7 @@ import uuid as uuid
 
 from django.contrib.contenttypes.models import ContentType
 
-from app_media.enums import MediaType, MediaFormat, MimeTypes
+from app_media.enums import MediaType, MediaFormat, MimeTypes, MediaStatus
 from backend.entity import File, Error
 from backend.errors.enums import ErrorsCodes
 from backend.errors.http_exceptions import CustomException
@@ -60,15 +60,31 @@ class MediaMapper:
                 # Не обрабатываем SVG, превью - тот же файл
                 file_entity.preview = file_data
             else:
-                resize_image(file_entity)
+                # Поворот, ресайз и превью - в фоне (MediaRepository.process), в запросе файл только сохраняется
+                file_entity.status = MediaStatus.PENDING.value
 
         if file_entity.format == MediaFormat.AUDIO:
             # duration
             pass
+        if file_entity.format == MediaFormat.VIDEO:
+            # Конвертация и превью через ffmpeg - в фоне
+            file_entity.status = MediaStatus.PENDING.value
+
+        return file_entity
+
+    @staticmethod
+    def process(file_entity):
+        """
+        Обработка загруженного файла (вызывается из фоновой задачи)
+        :param file_entity: File с исходным файлом в file
+        :return: File с результатом или None, если файл не удалось обработать
+        """
+        if file_entity.format == MediaFormat.IMAGE:
+            resize_image(file_entity)
         if file_entity.format == MediaFormat.VIDEO:
             convert_video(file_entity)
 
-        # Не создаем пустые записи, если файл не удалось обработать
+        # Не сохраняем результат, если файл не удалось обработать
         if file_entity.file is not None:
             return file_entity
 
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_media', '0016_auto_20210802_1415'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediamodel',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'READY'), (1, 'PENDING'), (2, 'PROCESSING'), (3, 'FAILED')], db_index=True, default=0, verbose_name='Статус обработки'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индекс строится без блокировки записи в таблицу (CREATE INDEX CONCURRENTLY вне транзакции)
+    atomic = False
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('app_media', '0017_mediamodel_status'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='mediamodel',
+            index=models.Index(fields=['owner_ct', 'owner_id', 'type', 'deleted'], name='app_media__owner'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_media', '0018_mediamodel_owner_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediamodel',
+            name='processing_attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Попыток обработки'),
+        ),
+    ]
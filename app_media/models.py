@@ -4,7 +4,7 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
 
-from app_media.enums import MediaType, MediaFormat
+from app_media.enums import MediaType, MediaFormat, MediaStatus
 from backend.models import BaseModel
 from backend.utils import choices
 
@@ -24,6 +24,10 @@ class MediaModel(BaseModel):
     height = models.IntegerField(blank=True, null=True)
     duration = models.BigIntegerField(default=None, blank=True, null=True)
     size = models.BigIntegerField(blank=True, null=True)
+    status = models.IntegerField(
+        choices=choices(MediaStatus), default=MediaStatus.READY, db_index=True, verbose_name="Статус обработки"
+    )
+    processing_attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток обработки")
 
     owner_id = models.PositiveIntegerField(null=True, blank=True)
     owner_ct = models.ForeignKey(ContentType, null=True, blank=True, on_delete=models.SET_NULL)
@@ -37,3 +41,6 @@ class MediaModel(BaseModel):
         db_table = 'app_media'
         verbose_name = 'Медиафайл'
         verbose_name_plural = 'Медиафайлы'
+        indexes = [
+            models.Index(fields=['owner_ct', 'owner_id', 'type', 'deleted'], name='app_media__owner'),
+        ]
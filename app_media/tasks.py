@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from app_media.versions.v1_0.repositories import MediaRepository
+from giberno.celery import app
+
+
+@app.task
+def process_media(media_ids: list = None):
+    for media_id in media_ids or []:
+        MediaRepository.process(media_id)
+
+
+@app.task
+def requeue_stuck_media():
+    # Повторно ставим в обработку файлы, которые ждут дольше обычного
+    media_ids = MediaRepository.get_stuck_media_ids(
+        pending_timeout=timedelta(minutes=5), processing_timeout=timedelta(minutes=30)
+    )
+    if media_ids:
+        process_media.s(media_ids=media_ids).apply_async()
@@ -1,8 +1,14 @@
+import os
+
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import QuerySet, Q
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import QuerySet, Q, F
 from django.utils.timezone import now
+from loguru import logger
 
-from app_media.enums import MediaType
+from app_media.enums import MediaType, MediaStatus
+from app_media.mappers import MediaMapper
 from app_media.models import MediaModel
 from app_users.models import UserProfile
 from backend.entity import File
@@ -15,6 +21,8 @@ from backend.utils import chained_get, filter_valid_uuids
 class MediaRepository(MasterRepository):
     model = MediaModel
 
+    MAX_PROCESSING_ATTEMPTS = 3  # После стольких зависаний (воркер упал посреди обработки) файл помечается FAILED
+
     def __init__(self, me=None) -> None:
         super().__init__()
         self.me = me
@@ -53,7 +61,84 @@ class MediaRepository(MasterRepository):
                 self.model(**dict(avatar))
             )
 
-        return self.model.objects.bulk_create(media_models)
+        created = self.model.objects.bulk_create(media_models)
+
+        pending_ids = [m.id for m in created if m.status == MediaStatus.PENDING.value]
+        if pending_ids:
+            # Локальный импорт: задачи app_media сами используют этот репозиторий
+            from app_media.tasks import process_media
+            # Обработка начнется после коммита, когда записи и файлы уже доступны воркеру
+            transaction.on_commit(lambda: process_media.s(media_ids=pending_ids).apply_async())
+
+        return created
+
+    @classmethod
+    def get_stuck_media_ids(cls, pending_timeout, processing_timeout):
+        """ Файлы, задача на обработку которых потерялась или воркер упал посреди обработки """
+        stuck = cls.model.objects.filter(status=MediaStatus.PROCESSING.value, updated_at__lt=now() - processing_timeout)
+        # Файл, который раз за разом роняет воркер, больше не ставим в обработку
+        stuck.filter(processing_attempts__gte=cls.MAX_PROCESSING_ATTEMPTS).update(
+            status=MediaStatus.FAILED.value, updated_at=now()
+        )
+        stuck.filter(processing_attempts__lt=cls.MAX_PROCESSING_ATTEMPTS).update(
+            status=MediaStatus.PENDING.value, updated_at=now()
+        )
+
+        return list(cls.model.objects.filter(
+            status=MediaStatus.PENDING.value, updated_at__lt=now() - pending_timeout
+        ).values_list('id', flat=True))
+
+    @classmethod
+    def process(cls, media_id):
+        """ Фоновая обработка загруженного файла: поворот/ресайз изображения, конвертация видео, превью """
+
+        # Берем файл в обработку, только если его еще никто не взял
+        if not cls.model.objects.filter(id=media_id, status=MediaStatus.PENDING.value).update(
+                status=MediaStatus.PROCESSING.value, processing_attempts=F('processing_attempts') + 1, updated_at=now()
+        ):
+            return None
+
+        media = cls.model.objects.get(id=media_id)
+        try:
+            return cls.apply_processing(media)
+        except Exception as e:
+            # Ошибка повторится и при следующей попытке - не оставляем файл в PROCESSING для requeue_stuck_media
+            logger.error(f'Не удалось обработать медиафайл {media_id}: {e}')
+            cls.model.objects.filter(id=media_id).update(status=MediaStatus.FAILED.value, updated_at=now())
+            return None
+
+    @classmethod
+    def apply_processing(cls, media):
+        source_name = media.file.name
+        source = UploadedFile(
+            file=open(media.file.path, 'rb'),
+            name=os.path.basename(source_name),
+            content_type=media.mime_type,
+            size=media.size,
+        )
+
+        try:
+            processed = MediaMapper.process(File(uuid=media.uuid, format=media.format, file=source))
+        finally:
+            source.close()
+
+        if not processed:
+            media.status = MediaStatus.FAILED.value
+            media.save(update_fields=['status', 'updated_at'])
+            return media
+
+        # Результат заменяет исходный файл под тем же именем
+        media.file.delete(save=False)
+        media.file.save(os.path.basename(source_name), processed.file, save=False)
+        if processed.preview:
+            media.preview.save(os.path.basename(processed.preview.name), processed.preview, save=False)
+        media.width = processed.width
+        media.height = processed.height
+        media.duration = processed.duration
+        media.size = processed.size
+        media.status = MediaStatus.READY.value
+        media.save()
+        return media
 
     @staticmethod
     def get_mime_cond(x, media_types, mime_type=None):
@@ -13,7 +13,8 @@ class MediaSerializer(serializers.ModelSerializer):
             'preview',
             'format',
             'type',
-            'mime_type'
+            'mime_type',
+            'status'
         ]
 
 
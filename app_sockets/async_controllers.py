@@ -28,6 +28,7 @@ class AsyncSocketController:
             await self.own_repository_class(me).add_socket(
                 self.consumer.channel_name  # ид соединения
             )
+            await self.join_user_group()
         except Exception as e:
             logger.error(e)
             raise WebSocketError(code=SocketErrors.BAD_REQUEST.value, details=e)
@@ -48,7 +49,33 @@ class AsyncSocketController:
 
     async def remove_connection(self):
         me = self.consumer.user  # Пользователь текущего соединения
-        await self.own_repository_class(me).remove_socket(self.consumer.channel_name)
+        await self.own_repository_class(me).remove_socket(
+            self.consumer.channel_name, self.consumer.room_name, self.consumer.room_id
+        )
+        if not self.consumer.is_group_consumer:
+            await self.consumer.channel_layer.group_discard(
+                self.own_repository_class.get_user_group(me.id), self.consumer.channel_name
+            )
+
+    async def join_user_group(self):
+        # Личная группа пользователя для серверных событий (см. SocketController.send_messages_to_users)
+        await self.consumer.channel_layer.group_add(
+            self.own_repository_class.get_user_group(self.consumer.user.id), self.consumer.channel_name
+        )
+
+    async def heartbeat(self):
+        # Периодически продлеваем запись о подключении в реестре, пока соединение живо
+        repository = self.own_repository_class(self.consumer.user)
+        while True:
+            await asyncio.sleep(repository.HEARTBEAT_INTERVAL)
+            try:
+                await repository.add_socket(
+                    self.consumer.channel_name, self.consumer.room_name, self.consumer.room_id
+                )
+                if not self.consumer.is_group_consumer:
+                    await self.join_user_group()  # Продлеваем членство, группы channel layer истекают по group_expiry
+            except Exception as e:
+                logger.error(e)
 
     async def send_error(self, code, details):
         await self.consumer.channel_layer.send(self.consumer.channel_name, {
@@ -170,7 +197,7 @@ class AsyncSocketController:
             })
 
     async def send_chat_message(self, room_id, group_name, prepared_message):
-        personalized_chat_variants_with_sockets, chat_users, push_title, inactive_mng_ids = await self.repository_class(
+        personalized_chat_variants, chat_users, push_title, inactive_mng_ids = await self.repository_class(
             me=self.consumer.user
         ).get_chat_for_all_participants(  # 10
             chat_id=room_id
@@ -183,19 +210,19 @@ class AsyncSocketController:
             'prepared_data': prepared_message,
         })
 
-        # Отправляем обновленные данные о чате всем участникам чата по одиночным сокетам
-        for data in personalized_chat_variants_with_sockets:
-            for connection_name in data['sockets']:
-                await self.send_last_msg_updated_to_one_connection(
-                    socket_id=connection_name,
-                    room_id=room_id,
-                    unread_cnt=chained_get(data, 'chat', 'unreadCount'),
-                    first_unread=chained_get(data, 'chat', 'firstUnreadMessage'),
-                    last_msg=prepared_message,
-                    chats_unread_messages_count=chained_get(data, 'chats_unread_messages'),
-                    blocked_at=chained_get(data, 'chat', 'blockedAt'),
-                    state=chained_get(data, 'chat', 'state'),
-                )
+        # Отправляем обновленные данные о чате всем участникам чата в личные группы, параллельно
+        await asyncio.gather(*[
+            self.send_last_msg_updated_to_user(
+                user_id=data['user_id'],
+                room_id=room_id,
+                unread_cnt=chained_get(data, 'chat', 'unreadCount'),
+                first_unread=chained_get(data, 'chat', 'firstUnreadMessage'),
+                last_msg=prepared_message,
+                chats_unread_messages_count=chained_get(data, 'chats_unread_messages'),
+                blocked_at=chained_get(data, 'chat', 'blockedAt'),
+                state=chained_get(data, 'chat', 'state'),
+            ) for data in personalized_chat_variants
+        ])
 
         # Отправляем сообщение по пушам всем участникам чата, кроме самого себя
         # Заголовки сообщения формируется исходя из роли отправителя
@@ -366,10 +393,19 @@ class AsyncSocketController:
                 await self.consumer.close(code=SocketErrors.BAD_REQUEST.value)
             raise WebSocketError(code=SocketErrors.CUSTOM_DETAILED_ERROR.value, details=str(e))
 
-    async def send_last_msg_updated_to_one_connection(
-            self, socket_id, room_id, unread_cnt, first_unread, last_msg, chats_unread_messages_count, blocked_at, state
-    ):
-        await self.consumer.channel_layer.send(socket_id, {
+    async def send_last_msg_updated_to_one_connection(self, socket_id, **kwargs):
+        await self.consumer.channel_layer.send(socket_id, self.get_last_msg_updated_data(**kwargs))
+
+    async def send_last_msg_updated_to_user(self, user_id, **kwargs):
+        # Во все одиночные соединения пользователя через его личную группу
+        await self.consumer.channel_layer.group_send(
+            self.own_repository_class.get_user_group(user_id), self.get_last_msg_updated_data(**kwargs)
+        )
+
+    @staticmethod
+    def get_last_msg_updated_data(room_id, unread_cnt, first_unread, last_msg, chats_unread_messages_count, blocked_at,
+                                  state):
+        return {
             'type': 'chat_last_msg_updated',
             'prepared_data': {
                 'id': room_id,
@@ -382,7 +418,7 @@ class AsyncSocketController:
             'indicators': {
                 'chatsUnreadMessages': chats_unread_messages_count
             }
-        })
+        }
 
     async def send_message_was_read(
             self, unread_cnt, room_id, first_unread, uuid, chats_unread_messages_count, blocked_at, state
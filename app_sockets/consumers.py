@@ -1,10 +1,14 @@
+import asyncio
+
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
 from loguru import logger
 
 from app_sockets.async_controllers import AsyncSocketController
 from app_sockets.enums import SocketEventType
 from backend.errors.enums import SocketErrors
 from backend.errors.ws_exceptions import WebSocketError
+from backend.profiling import profile_queries
 from backend.utils import chained_get
 
 
@@ -18,6 +22,15 @@ class Consumer(AsyncJsonWebsocketConsumer):
         self.room_id = None
         self.group_name = None
         self.is_group_consumer = False
+        self.heartbeat_task = None
+
+    def start_heartbeat(self):
+        self.heartbeat_task = asyncio.ensure_future(self.socket_controller.heartbeat())
+
+    def stop_heartbeat(self):
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
 
     async def connect(self):
         self.version = chained_get(self.scope, 'url_route', 'kwargs', 'version')
@@ -28,6 +41,7 @@ class Consumer(AsyncJsonWebsocketConsumer):
 
             if self.user.is_authenticated:  # Проверка авторизации подключаемого соединения
                 await self.socket_controller.store_single_connection()
+                self.start_heartbeat()
                 await self.socket_controller.send_counters()
             else:
                 # После установления сразу закрываем содинение, чтобы не было ERR_CONNECTION_REFUSED
@@ -38,11 +52,21 @@ class Consumer(AsyncJsonWebsocketConsumer):
 
     async def disconnect(self, code):
         try:
+            self.stop_heartbeat()
             if self.user and self.user.is_authenticated:
                 await self.socket_controller.remove_connection()
         except Exception as e:
             logger.error(e)
 
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if text_data and settings.QUERY_PROFILER:
+            # Профилирование SQL-запросов по типу события
+            content = await self.decode_json(text_data)
+            with profile_queries(f"ws {self.__class__.__name__} {content.get('eventType')}"):
+                await self.receive_json(content, **kwargs)
+        else:
+            await super().receive(text_data, bytes_data, **kwargs)
+
     async def receive_json(self, content, **kwargs):
         logger.info(content)
 
@@ -306,6 +330,7 @@ class GroupConsumer(Consumer):
                     # Добавляем соединение в группу
                     await self.channel_layer.group_add(self.group_name, self.channel_name)
                     await self.socket_controller.store_group_connection()
+                    self.start_heartbeat()
             else:
                 # Принимаем соединение и сразу закрываем, чтобы не было ERR_CONNECTION_REFUSED
                 await self.close(code=SocketErrors.NOT_AUTHORIZED.value)  # Закрываем соединение с кодом UNAUTHORIZED
@@ -315,6 +340,7 @@ class GroupConsumer(Consumer):
 
     async def disconnect(self, code):
         try:
+            self.stop_heartbeat()
             # Удаляем из группы
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
             await self.socket_controller.remove_connection()
@@ -1,3 +1,5 @@
+import asyncio
+
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from loguru import logger
@@ -5,6 +7,7 @@ from loguru import logger
 from app_sockets.enums import AvailableRoom, AvailableVersion
 from app_sockets.mappers import RoutingMapper
 from app_users.enums import NotificationAction, NotificationType
+from app_sockets.versions.v1_0.repositories import SocketsRepository
 from app_users.models import UserProfile
 from backend.controllers import PushController
 from backend.utils import chained_get, datetime_to_timestamp
@@ -28,12 +31,17 @@ class SocketController:
         })
 
     def send_notification_to_many_connections(self, sockets, prepared_data):
-        channel_layer = get_channel_layer()
-        for socket in sockets:
-            async_to_sync(channel_layer.send)(socket, {
-                'type': 'notification_handler',
-                'prepared_data': prepared_data
-            })
+        self.send_message_to_many_connections(sockets, {
+            'type': 'notification_handler',
+            'prepared_data': prepared_data
+        })
+
+    def send_notification_to_users(self, users_ids, prepared_data):
+        # Отправка уведомления во все одиночные каналы пользователей
+        self.send_messages_to_users([(users_ids, {
+            'type': 'notification_handler',
+            'prepared_data': prepared_data
+        })])
 
     def send_notification_to_my_connection(self, prepared_data):
         # Отправка уведомления в одиночный канал подключенного пользователя
@@ -43,9 +51,9 @@ class SocketController:
                 'room_name': None,
             })
 
-            for connection in connections:
+            for socket_id in connections:
                 channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.send)(connection.socket_id, {
+                async_to_sync(channel_layer.send)(socket_id, {
                     'type': 'notification_handler',
                     'prepared_data': prepared_data
                 })
@@ -75,9 +83,9 @@ class SocketController:
                 'room_name': None,
             })
 
-            for connection in connections:
+            for socket_id in connections:
                 channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.send)(connection.socket_id, data)
+                async_to_sync(channel_layer.send)(socket_id, data)
         except Exception as e:
             logger.error(e)
 
@@ -92,10 +100,40 @@ class SocketController:
 
     @staticmethod
     def send_message_to_many_connections(sockets, data):
+        if not sockets:
+            return
+
+        channel_layer = get_channel_layer()
+
+        async def send_all():
+            await asyncio.gather(*[channel_layer.send(socket, data) for socket in sockets])
+
+        # Один переход в event loop на все сокеты вместо async_to_sync на каждый
+        async_to_sync(send_all)()
+
+    @staticmethod
+    def send_messages_to_users(messages):
+        """
+            Отправка сообщений в личные группы пользователей (одиночные соединения, см. SocketsRepository)
+            без чтения реестра подключений: одна публикация на пользователя, а не на сокет.
+            Все публикации идут параллельно за один переход в event loop
+        :param messages: [(users_ids, data), ...]
+        """
         channel_layer = get_channel_layer()
-        if sockets:
-            for socket in sockets:
-                async_to_sync(channel_layer.send)(socket, data)
+
+        async def send_all():
+            await asyncio.gather(*[
+                channel_layer.group_send(SocketsRepository.get_user_group(user_id), data)
+                for users_ids, data in messages
+                for user_id in dict.fromkeys(users_ids)  # Уникальные получатели каждого сообщения
+            ])
+
+        if any(users_ids for users_ids, _ in messages):
+            async_to_sync(send_all)()
+
+    @classmethod
+    def send_message_to_users(cls, users_ids, data):
+        cls.send_messages_to_users([(users_ids, data)])
 
     def send_chat_message(self, prepared_message=None, chat_id=None):
         try:
@@ -108,30 +146,30 @@ class SocketController:
                 'prepared_data': prepared_message,
             })
 
-            personalized_chat_variants_with_sockets, chat_users, push_title, inactive_mng_ids = self.repository_class(
+            personalized_chat_variants, chat_users, push_title, inactive_mng_ids = self.repository_class(
                 me=self.me
             ).get_chat_for_all_participants(chat_id)
 
-            # Отправляем обновленные данные о чате всем участникам чата по сокетам
-            for data in personalized_chat_variants_with_sockets:
-                for connection_name in data['sockets']:
-                    self.send_message_to_one_connection(
-                        connection_name,
-                        {
-                            'type': 'chat_last_msg_updated',
-                            'prepared_data': {
-                                'id': chat_id,
-                                'unreadCount': chained_get(data, 'chat', 'unreadCount'),
-                                'state': chained_get(data, 'chat', 'state'),
-                                'firstUnreadMessage': chained_get(data, 'chat', 'firstUnreadMessage'),
-                                'lastMessage': prepared_message,
-                                'blockedAt': chained_get(data, 'chat', 'blockedAt'),
-                            },
-                            'indicators': {
-                                'chatsUnreadMessages': chained_get(data, 'chats_unread_messages'),
-                            }
+            # Отправляем обновленные данные о чате всем участникам чата в личные группы
+            self.send_messages_to_users([
+                (
+                    [data['user_id']],
+                    {
+                        'type': 'chat_last_msg_updated',
+                        'prepared_data': {
+                            'id': chat_id,
+                            'unreadCount': chained_get(data, 'chat', 'unreadCount'),
+                            'state': chained_get(data, 'chat', 'state'),
+                            'firstUnreadMessage': chained_get(data, 'chat', 'firstUnreadMessage'),
+                            'lastMessage': prepared_message,
+                            'blockedAt': chained_get(data, 'chat', 'blockedAt'),
+                        },
+                        'indicators': {
+                            'chatsUnreadMessages': chained_get(data, 'chats_unread_messages'),
                         }
-                    )
+                    }
+                ) for data in personalized_chat_variants
+            ])
 
             # Отправляем сообщение по пушам всем участникам чата
             PushController().send_message(
@@ -4,14 +4,23 @@ from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from loguru import logger
-from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from backend.authentication import CachedJWTAuthentication, AuthCache
 
 
 @database_sync_to_async
-def get_user(jwt):
+def get_user_from_db(jwt):
+    user, _ = CachedJWTAuthentication().authenticate_token(jwt)
+    return user
+
+
+async def get_user(jwt):
     try:
-        validated_token = JWTAuthentication().get_validated_token(jwt)
-        return JWTAuthentication().get_user(validated_token)
+        cached = AuthCache.get(jwt)
+        if cached is not None:
+            # Токен уже в кэше - без перехода в поток для работы с бд
+            return cached[0]
+        return await get_user_from_db(jwt)
     except Exception as e:
         logger.error(e)
         return AnonymousUser()
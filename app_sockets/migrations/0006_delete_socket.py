@@ -0,0 +1,15 @@
+# Generated by Django 3.1.4 on 2026-10-18 14:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('app_sockets', '0005_auto_20210324_1010'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='Socket',
+        ),
+    ]
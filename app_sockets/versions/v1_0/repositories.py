@@ -1,31 +1,102 @@
+from time import time
+
 from channels.db import database_sync_to_async
-from django.contrib.postgres.aggregates import ArrayAgg
 
-from app_sockets.models import Socket
 from app_users.models import UserProfile
+from backend.utils import get_redis_connection
 
 
 class SocketsRepository:
+    """
+        Реестр подключений (presence) в redis вместо таблицы сокетов
+        presence:<user_id>:<room_name><room_id> -> sorted set socket_id, score = время истечения записи
+        presence:<user_id> -> то же по всем подключениям пользователя, включая комнаты (статус онлайн)
+
+        Соединение продлевает свою запись heartbeat'ом (см. AsyncSocketController.heartbeat),
+        записи оборвавшихся соединений перестают учитываться по score и удаляются при следующей записи
+
+        Одиночные соединения пользователя (без комнаты) также входят в его личную группу channel layer
+        user_<user_id>, серверные события пользователю отправляются в группу без чтения реестра
+    """
+
+    KEY = 'presence:{user_id}:{room}'
+    ALL_ROOMS_KEY = 'presence:{user_id}'
+    USER_GROUP = 'user_{user_id}'
+    TTL = 120  # Время жизни записи о подключении без heartbeat, секунд
+    HEARTBEAT_INTERVAL = 45  # Период продления записи, секунд
+
     def __init__(self, me: UserProfile = None) -> None:
         super().__init__()
         self.me = me
 
+    @classmethod
+    def get_key(cls, user_id, room_name=None, room_id=None):
+        room = f'{room_name}{room_id}' if room_name and room_id else ''
+        return cls.KEY.format(user_id=user_id, room=room)
+
+    @classmethod
+    def get_all_rooms_key(cls, user_id):
+        return cls.ALL_ROOMS_KEY.format(user_id=user_id)
+
+    @classmethod
+    def get_user_group(cls, user_id):
+        return cls.USER_GROUP.format(user_id=user_id)
+
     def add_socket(self, socket_id, room_name=None, room_id=None):
-        Socket.objects.create(
-            user=self.me,
-            socket_id=socket_id,
-            room_name=room_name,
-            room_id=room_id
-        )
+        # Используется и для первичной записи, и для heartbeat
+        current_time = time()
+
+        pipe = get_redis_connection().pipeline()
+        for key in [self.get_key(self.me.id, room_name, room_id), self.get_all_rooms_key(self.me.id)]:
+            pipe.zadd(key, {socket_id: current_time + self.TTL})
+            pipe.zremrangebyscore(key, '-inf', current_time)  # Чистим записи оборвавшихся соединений
+            pipe.expire(key, self.TTL)
+        pipe.execute()
+
+    def remove_socket(self, socket_id, room_name=None, room_id=None):
+        pipe = get_redis_connection().pipeline()
+        pipe.zrem(self.get_key(self.me.id, room_name, room_id), socket_id)
+        pipe.zrem(self.get_all_rooms_key(self.me.id), socket_id)
+        pipe.execute()
+
+    def get_user_connections(self, room_name=None, room_id=None):
+        return self.get_connections_by_users([self.me.id], room_name, room_id).get(self.me.id, [])
+
+    @classmethod
+    def get_connections_by_users(cls, users_ids, room_name=None, room_id=None, all_rooms=False):
+        """
+        :param all_rooms: подключения пользователя во всех комнатах и без комнаты
+        :return: словарь {user_id: [socket_id, ...]} только для живых подключений
+        """
+        users_ids = list(dict.fromkeys(users_ids))  # Уникальные с сохранением порядка
+        if not users_ids:
+            return {}
+
+        current_time = time()
+        pipe = get_redis_connection().pipeline(transaction=False)
+        for user_id in users_ids:
+            key = cls.get_all_rooms_key(user_id) if all_rooms else cls.get_key(user_id, room_name, room_id)
+            pipe.zrangebyscore(key, current_time, '+inf')
 
-    def remove_socket(self, socket_id):
-        Socket.objects.filter(user=self.me, socket_id=socket_id).delete()
+        return {
+            user_id: [socket_id.decode() for socket_id in sockets]
+            for user_id, sockets in zip(users_ids, pipe.execute())
+        }
 
-    def check_if_connected(self, room_name=None, room_id=None):
-        return Socket.objects.filter(user=self.me, room_name=room_name, room_id=room_id).exists()
+    @classmethod
+    def get_connections_for_users_ids(cls, users_ids, room_name=None, room_id=None):
+        # Плоский список подключений указанных пользователей
+        connections = []
+        for sockets in cls.get_connections_by_users(users_ids, room_name, room_id).values():
+            connections += sockets
+        return connections
 
-    def get_user_connections(self, **kwargs):
-        return Socket.objects.filter(user=self.me, **kwargs)
+    @classmethod
+    def get_online_users_ids(cls, users_ids):
+        # Пользователи, у которых есть живое подключение в любой комнате, одним pipeline
+        return {
+            user_id for user_id, sockets in cls.get_connections_by_users(users_ids, all_rooms=True).items() if sockets
+        }
 
 
 class AsyncSocketsRepository(SocketsRepository):
@@ -37,15 +108,9 @@ class AsyncSocketsRepository(SocketsRepository):
         return super().add_socket(socket_id, room_name, room_id)
 
     @database_sync_to_async
-    def remove_socket(self, socket_id):
-        super().remove_socket(socket_id)
+    def remove_socket(self, socket_id, room_name=None, room_id=None):
+        super().remove_socket(socket_id, room_name, room_id)
 
     @database_sync_to_async
     def get_connections_for_users(self, users, room_name=None, room_id=None):
-        return Socket.objects.filter(
-            user__in=users,
-            room_name=room_name,
-            room_id=room_id
-        ).aggregate(
-            connections=ArrayAgg('socket_id')
-        )['connections']
+        return self.get_connections_for_users_ids([u.id for u in users], room_name, room_id)
@@ -11,7 +11,7 @@ from rest_framework_simplejwt.tokens import RefreshToken
 
 from app_games.versions.v1_0.repositories import PrizesRepository
 from app_market.enums import TransactionType, TransactionStatus, Currency, TransactionKind
-from app_market.versions.v1_0.repositories import OrdersRepository, TransactionsRepository
+from app_market.versions.v1_0.repositories import OrdersRepository
 from app_sockets.controllers import SocketController
 from app_users.enums import NotificationAction, NotificationIcon, NotificationType
 from app_users.models import UserProfile
@@ -120,9 +120,7 @@ class TestBonusesDeposit(APIView):
             )
 
         request.user.bonuses_acquired += amount
-        request.user.save()
-
-        TransactionsRepository(request.user).recalculate_money(currency=Currency.BONUS.value)
+        request.user.save(update_fields=['bonuses_acquired', 'updated_at'])
 
         title = 'Начислены бонусы'
         message = f'Начисление {amount} очков славы'
@@ -235,8 +233,6 @@ class TestMoneyPay(APIView):
                 ins.created_at = validator.validated_data.get('date')
                 ins.save()
 
-            TransactionsRepository(request.user).recalculate_money(currency=Currency.RUB.value)
-
             title = 'Начислены деньги'
             message = f'Начисление {amount} рублей на Ваш счет.'
             action = NotificationAction.USER.value
@@ -303,8 +299,6 @@ class TestMoneyReward(APIView):
             pay.created_at = validator.validated_data.get('date')
             pay.save()
 
-            TransactionsRepository(request.user).recalculate_money(currency=Currency.RUB.value)
-
             title = 'Начислены деньги'
             message = f'Начисление вознаграждения за друга в размере {amount} рублей.'
             action = NotificationAction.USER.value
@@ -371,8 +365,6 @@ class TestMoneyPenalty(APIView):
             pay.created_at = validator.validated_data.get('date')
             pay.save()
 
-            TransactionsRepository(request.user).recalculate_money(currency=Currency.RUB.value)
-
             title = 'Списаны деньги'
             message = f'Вам выписан штраф и списаны средства в размере {amount} рублей.'
             action = NotificationAction.USER.value
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AppUsersConfig(AppConfig):
     name = 'app_users'
+
+    def ready(self):
+        import app_users.signals  # Импортируем сигналы
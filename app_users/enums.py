@@ -20,6 +20,14 @@ class AccountType(IntEnumM):
     SELF_EMPLOYED = 3
 
 
+class RatingPeriod(IntEnumM):
+    # Периоды предрассчитанного рейтинга смз (UserRating), отсчитываются от момента пересчета
+    ALL = 0  # За все время
+    YEAR = 1  # Последние 365 дней
+    MONTH = 2  # Последние 30 дней
+    WEEK = 3  # Последние 7 дней
+
+
 class LanguageProficiency(IntEnumM):
     BEGINNER = 0
     ELEMENTARY = 1
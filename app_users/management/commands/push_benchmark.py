@@ -0,0 +1,110 @@
+import random
+import uuid as uuid_lib
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction, connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from fcm_django.models import FCMDevice
+
+from app_users.enums import NotificationType, NotificationAction, NotificationIcon
+from app_users.models import UserProfile, NotificationsSettings
+from backend.controllers import PushController, FakePushSender
+from backend.enums import Platform
+
+# python manage.py push_benchmark --users=200 --jobs=2000 --batch=500
+# Все созданные записи (токены, уведомления, настройки) откатываются в конце
+
+
+class Command(BaseCommand):
+    help = "Пропускная способность отправки пушей: по одному вызову и пачками через очередь, с локальной заглушкой FCM."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help="Сколько существующих пользователей взять")
+        parser.add_argument('--jobs', type=int, default=2000, help="Количество вызовов send_notification")
+        parser.add_argument('--recipients', type=int, default=3, help="Получателей на один вызов")
+        parser.add_argument('--subjects', type=int, default=300,
+                            help="Количество разных объектов (чем меньше, тем больше повторов внутри окна)")
+        parser.add_argument('--batch', type=int, default=500, help="Заданий в одной пачке")
+        parser.add_argument('--seed', type=int, default=42)
+
+    @staticmethod
+    def make_job(rnd, users_ids, recipients, subjects):
+        return {
+            'kind': PushController.NOTIFICATION,
+            'users_ids': rnd.sample(users_ids, min(recipients, len(users_ids))),
+            'title': 'Смена',
+            'message': 'Статус отклика изменился',
+            'uuid': str(uuid_lib.uuid4()),
+            'action': NotificationAction.SHIFT.value,
+            'subject_id': rnd.randint(1, subjects),
+            'notification_type': NotificationType.SYSTEM.value,
+            'icon_type': NotificationIcon.DEFAULT.value,
+            'created_at': 0,
+            'kwargs': {}
+        }
+
+    def run(self, batches):
+        FakePushSender.reset()
+        with CaptureQueriesContext(connection) as queries:
+            started = perf_counter()
+            notifications = sum(PushController.process_batch(jobs) for jobs in batches)
+            elapsed = perf_counter() - started
+        return notifications, elapsed, len(queries), FakePushSender.requests_count, FakePushSender.pushes_count
+
+    def report(self, title, jobs_count, result):
+        notifications, elapsed, queries, requests, pushes = result
+        self.stdout.write(
+            f"{title}:\n"
+            f"  уведомлений: {notifications}, пушей: {pushes}, запросов в FCM: {requests}, запросов в бд: {queries}\n"
+            f"  время: {elapsed:.2f} с, {jobs_count / elapsed if elapsed else 0:.0f} вызовов/с, "
+            f"{notifications / elapsed if elapsed else 0:.0f} уведомлений/с\n"
+        )
+
+    @override_settings(PUSH_FAKE_SENDER=True)
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        users_ids = list(
+            UserProfile.objects.filter(deleted=False).values_list('id', flat=True)[:options['users']]
+        )
+        if not users_ids:
+            self.stdout.write("Нет пользователей для бенчмарка\n")
+            return
+
+        with transaction.atomic():
+            # Включаем системные уведомления и выдаем по два фейковых токена каждому пользователю
+            NotificationsSettings.objects.filter(user_id__in=users_ids).update(
+                enabled_types=[NotificationType.SYSTEM.value, NotificationType.CHAT.value]
+            )
+            with_settings = set(
+                NotificationsSettings.objects.filter(user_id__in=users_ids).values_list('user_id', flat=True)
+            )
+            NotificationsSettings.objects.bulk_create([
+                NotificationsSettings(
+                    user_id=user_id, enabled_types=[NotificationType.SYSTEM.value, NotificationType.CHAT.value]
+                ) for user_id in users_ids if user_id not in with_settings
+            ])
+            FCMDevice.objects.bulk_create([
+                FCMDevice(
+                    user_id=user_id, type=platform.value, active=True, registration_id=f'benchmark-{platform.value}-{user_id}'
+                ) for user_id in users_ids for platform in (Platform.ANDROID, Platform.IOS)
+            ])
+
+            jobs = [
+                self.make_job(rnd, users_ids, options['recipients'], options['subjects'])
+                for _ in range(options['jobs'])
+            ]
+
+            # Прежнее поведение: каждый вызов обрабатывается отдельно
+            single = self.run([[job] for job in jobs])
+            # Очередь: вызовы, накопленные за окно, обрабатываются пачками
+            batched = self.run([jobs[i:i + options['batch']] for i in range(0, len(jobs), options['batch'])])
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"Пользователей: {len(users_ids)}, вызовов: {len(jobs)}, получателей на вызов: {options['recipients']}\n"
+        )
+        self.report("По одному вызову", len(jobs), single)
+        self.report(f"Пачками по {options['batch']}", len(jobs), batched)
+        self.stdout.write("[DONE]\n")
@@ -0,0 +1,117 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Avg
+
+from app_feedback.models import Review
+from app_users.enums import AccountType
+from app_users.models import UserProfile
+from app_users.versions.v1_0.repositories import ProfileRepository
+from backend.ranking import RatingRanks
+
+# python manage.py rating_load_test --users=50 --reviews=2000 --threads=16
+# Созданные отзывы удаляются в конце, рейтинги пересчитываются полностью (--keep - оставить)
+
+LOAD_TEST_TEXT = '[rating_load_test]'
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный тест оценок смз: параллельная отправка отзывов, проверка рейтингов и мест после нагрузки."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help="Сколько смз оценивать")
+        parser.add_argument('--reviews', type=int, default=2000, help="Количество отзывов")
+        parser.add_argument('--threads', type=int, default=16, help="Количество параллельных потоков")
+        parser.add_argument('--keep', action='store_true', help="Не удалять созданные отзывы")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        users_ids = list(UserProfile.objects.filter(
+            account_type=AccountType.SELF_EMPLOYED, deleted=False
+        ).values_list('id', flat=True)[:options['users']])
+        if not users_ids:
+            raise CommandError('Нет самозанятых пользователей')
+
+        user_ct = ContentType.objects.get_for_model(UserProfile)
+        rnd = random.Random(options['seed'])
+        reviews = [(rnd.choice(users_ids), float(rnd.randint(1, 5))) for _ in range(options['reviews'])]
+
+        def submit(review):
+            target_id, value = review
+            started = perf_counter()
+            # Как в ProfileRepository.make_review_to_self_employed_by_admin_or_manager
+            Review.objects.create(
+                owner_ct_id=user_ct.id,
+                owner_id=target_id,
+                owner_ct_name=user_ct.model,
+                target_ct_id=user_ct.id,
+                target_id=target_id,
+                target_ct_name=user_ct.model,
+                value=value,
+                text=LOAD_TEST_TEXT
+            )
+            ProfileRepository.add_rating(target_id, value)
+            return perf_counter() - started
+
+        started = perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            latencies = sorted(executor.map(submit, reviews))
+        elapsed = perf_counter() - started
+
+        self.stdout.write(
+            f"Отзывов: {len(reviews)}, потоков: {options['threads']}, смз: {len(users_ids)}\n"
+            f"  время: {elapsed:.2f} с, {len(reviews) / elapsed:.0f} отзывов/с\n"
+            f"  задержка p50: {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+            f"p95: {latencies[int(len(latencies) * 0.95)] * 1000:.1f} мс\n"
+        )
+
+        try:
+            self.check_consistency(user_ct)
+
+            # Прежняя стоимость одной оценки - полный пересчет мест по всей таблице
+            started = perf_counter()
+            with transaction.atomic():
+                ProfileRepository.recalculate_rating_place_for_users()
+                transaction.set_rollback(True)
+            self.stdout.write(f"Полный пересчет (прежняя стоимость одной оценки): {perf_counter() - started:.3f} с\n")
+        finally:
+            if not options['keep']:
+                Review.objects.filter(target_ct_id=user_ct.id, text=LOAD_TEST_TEXT).delete()
+                ProfileRepository.recalculate_rating_place_for_users()
+
+        self.stdout.write("[DONE]\n")
+
+    def check_consistency(self, user_ct):
+        expected = {
+            r['target_id']: r['avg'] for r in Review.objects.filter(
+                target_ct_id=user_ct.id, value__isnull=False
+            ).values('target_id').annotate(avg=Avg('value')).order_by()
+        }
+        ratings = dict(UserProfile.objects.filter(
+            account_type=AccountType.SELF_EMPLOYED, rating_value__isnull=False
+        ).values_list('id', 'rating_value'))
+
+        wrong_ratings = [
+            user_id for user_id, value in ratings.items()
+            if user_id in expected and abs(value - expected[user_id]) > 1e-6
+        ]
+
+        # Ожидаемые места - DenseRank по убыванию рейтинга
+        distinct_values = sorted({RatingRanks.normalize(v) for v in ratings.values()}, key=float, reverse=True)
+        places = {value: place for place, value in enumerate(distinct_values, start=1)}
+        ranks = RatingRanks()
+        wrong_places = [
+            user_id for user_id, value in ratings.items()
+            if ranks.get_place(user_id) != places[RatingRanks.normalize(value)]
+        ]
+
+        self.stdout.write(
+            f"Проверка: рейтингов с расхождением {len(wrong_ratings)} из {len(ratings)}, "
+            f"мест с расхождением {len(wrong_places)}\n"
+        )
+        if wrong_ratings or wrong_places:
+            self.stderr.write(f"  рейтинги: {wrong_ratings[:20]}, места: {wrong_places[:20]}\n")
@@ -0,0 +1,67 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.db import migrations
+from django.db.models import F, Q, Sum
+
+# Значения enum приложения: миграция не должна зависеть от текущего кода
+BONUS = 0  # Currency.BONUS
+COMPLETED = 4  # TransactionStatus.COMPLETED
+
+
+def fill_balances(apps, schema_editor):
+    # Удаляем дубли и пересчитываем балансы по всей истории (аналог TransactionsRepository.aggregate_balances)
+    UserMoney = apps.get_model('app_users', 'UserMoney')
+    Transaction = apps.get_model('app_market', 'Transaction')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+
+    kept = {}
+    for money in UserMoney.objects.order_by('id'):
+        if (money.user_id, money.currency) in kept:
+            money.delete()
+        else:
+            kept[(money.user_id, money.currency)] = money
+
+    user_ct = ContentType.objects.filter(app_label='app_users', model='userprofile').first()
+    if not user_ct:
+        return
+
+    completed = Transaction.objects.filter(status=COMPLETED).exclude(
+        from_ct=user_ct, to_ct=user_ct, from_id=F('to_id'), from_currency=F('to_currency')
+    )
+    balances = {}
+    for side, sign in (('to', 1), ('from', -1)):
+        transactions = completed.filter(**{f'{side}_ct': user_ct}).filter(
+            # В бонусный баланс идут транзакции любого вида, в денежный - только с видом
+            Q(**{f'{side}_currency': BONUS}) | Q(kind__isnull=False) & ~Q(**{f'{side}_currency': BONUS})
+        )
+        for row in transactions.values(f'{side}_id', f'{side}_currency').annotate(total=Sum('amount')).order_by():
+            key = (row[f'{side}_id'], row[f'{side}_currency'])
+            balances[key] = balances.get(key, 0) + sign * row['total']
+
+    # amount - PositiveIntegerField: отрицательный итог по истории (списания без учтенных поступлений)
+    # записываем нулем, расхождение покажет reconcile_balances
+    balances = {key: max(amount, 0) for key, amount in balances.items()}
+
+    for key, money in kept.items():
+        amount = balances.pop(key, 0)
+        if money.amount != amount:
+            money.amount = amount
+            money.save()
+
+    UserMoney.objects.bulk_create([
+        UserMoney(user_id=user_id, currency=currency, amount=amount) for (user_id, currency), amount in balances.items()
+    ])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('app_market', '0072_shiftappeal_next_transition_at'),
+        ('app_users', '0046_userprofile_nalog_status'),
+    ]
+
+    # Ограничение уникальности добавляется в 0050: ALTER TABLE в одной транзакции с изменением строк этой же
+    # таблицы PostgreSQL не выполняет (pending trigger events)
+    operations = [
+        migrations.RunPython(fill_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_feedback', '0003_review_shift'),
+        ('app_users', '0047_usermoney_user_currency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='rates_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество оценок'),
+        ),
+        # Количество оценок по существующим отзывам (как в ProfileRepository.recalculate_rating_place_for_users)
+        migrations.RunSQL(
+            '''
+                UPDATE app_users__profiles p
+                SET rates_count=r.rates_count
+                FROM (
+                    SELECT target_id, COUNT(value) AS rates_count
+                    FROM app_feedback__reviews
+                    WHERE target_ct_id=(
+                        SELECT id FROM django_content_type WHERE app_label='app_users' AND model='userprofile'
+                    )
+                    GROUP BY target_id
+                ) r
+                WHERE p.id=r.target_id
+            ''',
+            migrations.RunSQL.noop
+        ),
+    ]
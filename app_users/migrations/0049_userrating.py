@@ -0,0 +1,44 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_geo', '0011_upd_custom_func_plpython'),
+        ('app_users', '0048_userprofile_rates_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserRating',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('deleted', models.BooleanField(default=False)),
+                ('period', models.PositiveIntegerField(choices=[(0, 'ALL'), (1, 'YEAR'), (2, 'MONTH'), (3, 'WEEK')], default=0)),
+                ('rating', models.FloatField(blank=True, null=True, verbose_name='Рейтинг')),
+                ('rates_count', models.PositiveIntegerField(default=0, verbose_name='Количество оценок')),
+                ('place', models.PositiveIntegerField(verbose_name='Место в рейтинге')),
+                ('region', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='app_geo.region')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Место в рейтинге',
+                'verbose_name_plural': 'Рейтинг самозанятых',
+                'db_table': 'app_users__ratings',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='userrating',
+            index=models.Index(fields=['period', 'region', 'place'], name='app_users__ratings__page'),
+        ),
+        migrations.AddIndex(
+            model_name='userrating',
+            index=models.Index(fields=['user', 'period', 'region'], name='app_users__ratings__user'),
+        ),
+    ]
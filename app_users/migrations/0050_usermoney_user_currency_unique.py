@@ -0,0 +1,17 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_users', '0049_userrating'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='usermoney',
+            constraint=models.UniqueConstraint(fields=('user', 'currency'), name='app_users__profile_money__user_currency'),
+        ),
+    ]
@@ -6,11 +6,12 @@ from django.contrib.gis.db import models
 from django.contrib.postgres.fields import ArrayField
 
 from app_feedback.models import Review
-from app_geo.models import Language, Country, City
+from app_geo.models import Language, Country, City, Region
 from app_market.enums import Currency
 from app_media.models import MediaModel
 from app_users.enums import Gender, Status, AccountType, LanguageProficiency, NotificationType, NotificationAction, \
-    Education, DocumentType, NotificationIcon, CardType, CardPaymentNetwork, NalogUserStatus
+    Education, DocumentType, NotificationIcon, CardType, CardPaymentNetwork, NalogUserStatus, RatingPeriod
+from backend.counters import BufferedValues, DirtySet
 from backend.models import BaseModel
 from backend.utils import choices
 from giberno import settings
@@ -62,6 +63,7 @@ class UserProfile(AbstractUser, BaseModel):
     bonuses_acquired = models.PositiveIntegerField(default=0, verbose_name='Всего получено очков славы')
     rating_place = models.PositiveIntegerField(null=True, blank=True, verbose_name='Место в общем рейтинге')
     rating_value = models.FloatField(null=True, blank=True, verbose_name='Общий рейтинг')
+    rates_count = models.PositiveIntegerField(default=0, verbose_name='Количество оценок')
     favourite_vacancies_count = models.PositiveIntegerField(default=0, verbose_name='Количество избранных вакансий')
 
     media = GenericRelation(MediaModel, object_id_field='owner_id', content_type_field='owner_ct')
@@ -92,6 +94,20 @@ class UserProfile(AbstractUser, BaseModel):
 
     reviews = GenericRelation(Review, object_id_field='target_id', content_type_field='target_ct')
 
+    locations_buffer = BufferedValues('users:locations')
+    daily_tasks_queue = DirtySet('users:daily_tasks')  # Смз, у которых могли выполниться ежедневные задания
+
+    def update_location(self, point):
+        # Геопозиция копится в буфере redis (последняя на пользователя), в бд попадает пачкой задачей
+        # flush_users_locations
+        self.location = point
+        if point is None or not self.locations_buffer.set(self.id, f'{point.x},{point.y}'):
+            # Сброс геопозиции или redis недоступен - UPDATE одного поля без сохранения всей строки
+            UserProfile.objects.filter(pk=self.pk).update(location=point)
+            # simplejwt при импорте вызывает get_user_model() - в модуле модели импортировать нельзя
+            from backend.authentication import AuthCache
+            AuthCache.invalidate_user(self.pk)
+
     @property
     def is_manager(self):
         return self.account_type == AccountType.MANAGER
@@ -323,3 +339,33 @@ class UserMoney(BaseModel):
         db_table = 'app_users__profile_money'
         verbose_name = 'Деньги пользователя'
         verbose_name_plural = 'Деньги пользователей'
+        constraints = [
+            # Баланс материализован: ровно одна строка на пользователя и валюту
+            models.UniqueConstraint(fields=['user', 'currency'], name='app_users__profile_money__user_currency'),
+        ]
+
+
+class UserRating(BaseModel):
+    """
+        Предрассчитанный рейтинг смз (лидерборд) по региону и периоду, пересчитывается задачей refresh_users_rating.
+        region = null - рейтинг по всем регионам
+    """
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='ratings')
+    region = models.ForeignKey(Region, on_delete=models.CASCADE, null=True, blank=True)
+    period = models.PositiveIntegerField(choices=choices(RatingPeriod), default=RatingPeriod.ALL.value)
+
+    rating = models.FloatField(null=True, blank=True, verbose_name='Рейтинг')
+    rates_count = models.PositiveIntegerField(default=0, verbose_name='Количество оценок')
+    place = models.PositiveIntegerField(verbose_name='Место в рейтинге')
+
+    def __str__(self):
+        return f'{self.user_id} - {self.place}'
+
+    class Meta:
+        db_table = 'app_users__ratings'
+        verbose_name = 'Место в рейтинге'
+        verbose_name_plural = 'Рейтинг самозанятых'
+        indexes = [
+            models.Index(fields=['period', 'region', 'place'], name='app_users__ratings__page'),
+            models.Index(fields=['user', 'period', 'region'], name='app_users__ratings__user'),
+        ]
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from app_users.models import UserProfile
+from backend.authentication import AuthCache
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_auth_cache(sender, instance: UserProfile, **kwargs):
+    # Пользователь закэширован по токену в памяти процессов - сбрасываем, чтобы не работать с устаревшей копией
+    AuthCache.invalidate_user(instance.id)
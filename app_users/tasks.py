@@ -0,0 +1,15 @@
+from app_users.models import UserProfile
+from app_users.versions.v1_0.repositories import RatingRepository, ProfileRepository
+from giberno.celery import app
+
+
+@app.task
+def refresh_users_rating():
+    # Пересчет предрассчитанного рейтинга смз (лидерборда) по регионам и периодам
+    RatingRepository.refresh_leaderboard()
+
+
+@app.task
+def flush_users_locations():
+    # Сброс накопленных в redis геопозиций пользователей в бд
+    UserProfile.locations_buffer.flush(ProfileRepository.apply_locations)
@@ -1,9 +1,11 @@
+from datetime import timedelta
+
 from channels.db import database_sync_to_async
 from django.contrib.contenttypes.models import ContentType
-from django.db import connection
+from django.db import connection, transaction
 from django.db.models import Q, Prefetch, Subquery, OuterRef, FloatField, Window, Avg, F, \
-    Value
-from django.db.models.functions import DenseRank
+    Value, ExpressionWrapper
+from django.db.models.functions import DenseRank, Coalesce
 from django.utils.timezone import now
 from fcm_django.models import FCMDevice
 from rest_framework.exceptions import PermissionDenied
@@ -17,18 +19,22 @@ from app_media.enums import MediaType, MediaFormat
 from app_media.models import MediaModel
 from app_media.versions.v1_0.repositories import MediaRepository
 from app_users.entities import JwtTokenEntity, SocialEntity
-from app_users.enums import AccountType, NotificationType
+from app_users.enums import AccountType, NotificationType, RatingPeriod
 from app_users.models import SocialModel, UserProfile, JwtToken, NotificationsSettings, Notification, UserCareer, \
-    Document, Card, UserMoney
+    Document, Card, UserMoney, UserRating
 from app_users.utils import validate_username, generate_username, generate_password, EmailSender
+from backend.authentication import AuthCache
+from backend.counters import UnreadCounters
 from backend.entity import Error
 from backend.errors.enums import RESTErrors, ErrorsCodes
 from backend.errors.exceptions import EntityDoesNotExistException
 from backend.errors.http_exceptions import HttpException, CustomException
 from backend.mappers import DataMapper
 from backend.mixins import MasterRepository
+from backend.ranking import RatingRanks
 from backend.repositories import BaseRepository
-from backend.utils import is_valid_uuid, make_hash_and_salt
+from backend.utils import is_valid_uuid, make_hash_and_salt, paginate
+from giberno import settings
 
 
 class UsersRepository:
@@ -193,13 +199,16 @@ class JwtRepository:
 
     @staticmethod
     def remove_old(user):
-        JwtToken.objects.filter(**{'user_id': user.id}).delete()
+        tokens = JwtToken.objects.filter(**{'user_id': user.id})
+        AuthCache.revoke(list(tokens.values_list('access_token', flat=True)))
+        tokens.delete()
 
     @staticmethod
     def refresh(refresh_token, new_access_token):
         # TODO нужно доработать, если потребуется ROTATE_REFRESH_TOKENS=True и BLACKLIST_AFTER_ROTATION=True
         pair = JwtToken.objects.filter(**{'refresh_token': refresh_token}).first()
         if pair:
+            AuthCache.revoke([pair.access_token])
             pair.access_token = new_access_token
             pair.save()
 
@@ -335,12 +344,36 @@ class ProfileRepository(MasterRepository):
             ])
         return user
 
+    def update(self, record_id, **kwargs):
+        user = super().update(record_id, **kwargs)
+        AuthCache.invalidate_user(record_id)  # queryset.update() не шлет post_save
+        return user
+
     def update_location(self, data):
         point = DataMapper.geo_point(data)
-        self.me.location = point
-        self.me.save()
+        self.me.update_location(point)
         return self.me
 
+    @staticmethod
+    def apply_locations(locations, chunk_size=1000):
+        """ Запись накопленных геопозиций {user_id: 'lon,lat'} одним UPDATE на пачку, без updated_at """
+        items = list(locations.items())
+        for i in range(0, len(items), chunk_size):
+            chunk = items[i:i + chunk_size]
+            values = []
+            for user_id, location in chunk:
+                lon, lat = location.split(',')
+                values += [user_id, float(lon), float(lat)]
+            with connection.cursor() as c:
+                c.execute(f'''
+                    UPDATE {UserProfile._meta.db_table} AS p
+                    SET location = ST_SetSRID(ST_MakePoint(v.lon, v.lat), %s)
+                    FROM (VALUES {', '.join(['(%s, %s::double precision, %s::double precision)'] * len(chunk))})
+                        AS v(id, lon, lat)
+                    WHERE p.id = v.id
+                ''', [settings.SRID] + values)
+            AuthCache.invalidate_users([user_id for user_id, _ in chunk])
+
     def update_username(self, username):
         username = validate_username(username=username)
         if self.me.username == username:
@@ -353,10 +386,36 @@ class ProfileRepository(MasterRepository):
             ])
 
         self.me.username = username
-        self.me.save()
+        # Только изменяемые поля: self.me может быть копией из AuthCache, полное сохранение затрет свежие значения
+        self.me.save(update_fields=['username', 'updated_at'])
+
+    @staticmethod
+    def add_rating(user_id, value):
+        """ Учет новой оценки в рейтинге смз за O(1): без агрегации по отзывам и пересчета мест остальных """
+        if value is None:
+            return  # Пустые оценки в среднем не учитываются (как в Avg)
+
+        with transaction.atomic():
+            # Строка пользователя блокируется update до конца транзакции - параллельные оценки применяются по очереди
+            UserProfile.objects.filter(pk=user_id).update(
+                rating_value=ExpressionWrapper(
+                    (Coalesce(F('rating_value'), 0.0) * F('rates_count') + value) / (F('rates_count') + 1),
+                    output_field=FloatField()
+                ),
+                rates_count=F('rates_count') + 1
+            )
+            rates_count, rating_value = UserProfile.objects.filter(pk=user_id).values_list(
+                'rates_count', 'rating_value'
+            ).get()
+            transaction.on_commit(lambda: RatingRanks().set_rating(user_id, rates_count, rating_value))
+            transaction.on_commit(lambda: AuthCache.invalidate_user(user_id))
 
     @staticmethod
     def recalculate_rating_place_for_users():
+        """
+            Полный пересчет рейтингов и мест всех смз по отзывам.
+            В обычной работе рейтинг обновляется инкрементально (add_rating), здесь - сверка и заполнение RatingRanks
+        """
         user_ct = ContentType.objects.get_for_model(UserProfile)
         updated_ratings = UserProfile.objects.filter(  # Фильтруем смз, только с оценками
             reviews__isnull=False,
@@ -390,7 +449,12 @@ class ProfileRepository(MasterRepository):
                 SELECT 
                     p.id, 
                     ur.place,
-                    ur.total_rating
+                    ur.total_rating,
+                    (
+                        SELECT COUNT(r.value) 
+                        FROM app_feedback__reviews r 
+                        WHERE r.target_ct_id={user_ct.id} AND r.target_id=p.id
+                    ) AS rates_count
                 FROM app_users__profiles p 
                 LEFT JOIN updated_rating ur ON p.id=ur.id
                 WHERE 
@@ -400,7 +464,8 @@ class ProfileRepository(MasterRepository):
             UPDATE app_users__profiles p 
             SET 
                 rating_place=jr.place,
-                rating_value=jr.total_rating
+                rating_value=jr.total_rating,
+                rates_count=jr.rates_count
             FROM joined_ratings jr
             WHERE 
                 p.id=jr.id
@@ -409,6 +474,8 @@ class ProfileRepository(MasterRepository):
         with connection.cursor() as c:
             c.execute(sql)  # Update запросы выполняются через cursor
 
+        RatingRanks().rebuild()
+
     def make_review_to_self_employed_by_admin_or_manager(self, user_id, shift_id, text, value, point=None):
         # TODO добавить загрузку attachments
 
@@ -477,8 +544,8 @@ class ProfileRepository(MasterRepository):
                 shift=shift
             )
 
-            # пересчитываем место в общем рейтинге для всех пользователей
-            self.recalculate_rating_place_for_users()
+            # Обновляем рейтинг только оцененного пользователя, места остальных вычисляются в RatingRanks
+            self.add_rating(target_id, value)
 
 
 class AsyncProfileRepository(ProfileRepository):
@@ -525,7 +592,7 @@ class NotificationsRepository(MasterRepository):
                 records = self.model.objects.filter(**kwargs)
 
         return self.fast_related_loading(  # Предзагрузка связанных сущностей
-            queryset=records[paginator.offset:paginator.limit] if paginator else records,
+            queryset=paginate(records, paginator),
         )
 
     @staticmethod
@@ -549,9 +616,24 @@ class NotificationsRepository(MasterRepository):
 
         return queryset
 
-    def get_unread_notifications_count(self):
+    def load_unread_notifications_count(self):
         return self.model.objects.filter(user=self.me, read_at__isnull=True).count()
 
+    def get_unread_notifications_count(self):
+        return UnreadCounters().get_notifications(self.me.id, self.load_unread_notifications_count)
+
+    def read_notification(self, record_id):
+        notifications = self.model.objects.filter(id=record_id, read_at__isnull=True)
+        users_ids = list(notifications.values_list('user_id', flat=True))
+
+        notifications.update(
+            read_at=now(),
+            updated_at=now(),
+        )
+
+        for user_id in users_ids:
+            UnreadCounters().decr_notifications(user_id)
+
 
 class AsyncNotificationsRepository(NotificationsRepository):
     def __init__(self, me=None) -> None:
@@ -665,10 +747,88 @@ class DocumentsRepository(MasterRepository):
 class RatingRepository(MasterRepository):
     model = UserProfile
 
+    # Окна периодов предрассчитанного рейтинга (UserRating)
+    PERIODS = {
+        RatingPeriod.ALL: None,
+        RatingPeriod.YEAR: timedelta(days=365),
+        RatingPeriod.MONTH: timedelta(days=30),
+        RatingPeriod.WEEK: timedelta(days=7),
+    }
+
+    # Фильтры, которые поддерживаются предрассчитанным рейтингом, остальные (произвольные даты) - расчет на лету
+    LEADERBOARD_FILTERS = {'reviews__region_id', 'period'}
+
     def __init__(self, me=None) -> None:
         super().__init__()
         self.me = me
 
+    @classmethod
+    def refresh_leaderboard(cls):
+        """
+            Пересчет лидерборда: средняя оценка и DenseRank по убыванию рейтинга для каждого периода,
+            по каждому региону и по всем регионам (region_id = null). Как и в расчете на лету, в регионе участвуют
+            оценки, оставленные в этом регионе. Строки периода заменяются в одной транзакции -
+            читатели видят либо старый, либо новый рейтинг
+        """
+        user_ct = ContentType.objects.get_for_model(UserProfile)
+        sql = '''
+            WITH 
+            
+            stats AS (
+                SELECT 
+                    r.target_id AS user_id,
+                    r.region_id,
+                    GROUPING(r.region_id) AS all_regions,
+                    AVG(r.value) AS rating,
+                    COUNT(r.value) AS rates_count
+                FROM app_feedback__reviews r
+                JOIN app_users__profiles p ON p.id=r.target_id AND p.deleted=false
+                WHERE 
+                    r.target_ct_id=%(user_ct_id)s 
+                    AND (%(date_from)s::timestamptz IS NULL OR r.created_at >= %(date_from)s::timestamptz)
+                GROUP BY GROUPING SETS ((r.target_id, r.region_id), (r.target_id))
+            )
+            
+            INSERT INTO app_users__ratings 
+                (created_at, updated_at, deleted, user_id, region_id, period, rating, rates_count, place)
+            SELECT 
+                now(), now(), false, user_id, region_id, %(period)s, rating, rates_count,
+                DENSE_RANK() OVER (PARTITION BY region_id ORDER BY rating DESC)
+            FROM stats
+            -- Оценки без региона входят только в рейтинг по всем регионам
+            WHERE region_id IS NOT NULL OR all_regions=1
+        '''
+
+        for period, window in cls.PERIODS.items():
+            with transaction.atomic():
+                UserRating.objects.filter(period=period).delete()
+                with connection.cursor() as c:
+                    c.execute(sql, {
+                        'user_ct_id': user_ct.id,
+                        'date_from': now() - window if window else None,
+                        'period': period.value
+                    })
+
+    def leaderboard_queryset(self, kwargs):
+        """ Пользователи из предрассчитанного рейтинга с place и total_rating, как в расчете на лету """
+        try:
+            period = RatingPeriod(int(kwargs.get('period', RatingPeriod.ALL.value)))
+        except ValueError:
+            raise HttpException(detail='Неизвестный период рейтинга', status_code=RESTErrors.BAD_REQUEST)
+
+        region_id = kwargs.get('reviews__region_id')
+        return self.model.objects.filter(
+            deleted=False,
+            ratings__period=period.value,
+            **({'ratings__region_id': region_id} if region_id else {'ratings__region__isnull': True})
+        ).annotate(
+            place=F('ratings__place'),
+            total_rating=F('ratings__rating')
+        )
+
+    def use_leaderboard(self, kwargs):
+        return set(kwargs.keys()) <= self.LEADERBOARD_FILTERS
+
     def get_kwargs_for_reviews(self, kwargs):
         m_kwargs = kwargs.copy()
         for k in m_kwargs.keys():
@@ -698,6 +858,13 @@ class RatingRepository(MasterRepository):
         return queryset
 
     def get_users_rating(self, kwargs, paginator=None):
+        if self.use_leaderboard(kwargs):
+            records = self.leaderboard_queryset(kwargs).order_by('place', 'id')  # Индекс (period, region, place)
+            return self.fast_related_loading(
+                queryset=records[paginator.offset:paginator.limit] if paginator else records,
+            )
+
+        kwargs = {k: v for k, v in kwargs.items() if k != 'period'}
         user_ct = ContentType.objects.get_for_model(UserProfile)
         kwargs_for_reviews = self.get_kwargs_for_reviews(kwargs)
         records = self.model.objects.filter(  # Фильтруем смз по нужным параметрам (регион оценки, смена, дата)
@@ -728,6 +895,16 @@ class RatingRepository(MasterRepository):
         )
 
     def get_my_rating(self, kwargs):
+        if self.use_leaderboard(kwargs):
+            my_profile = self.leaderboard_queryset(kwargs).filter(id=self.me.id).first()
+            if not my_profile:  # Если нет рейтинга по своему профилю, то проставляем null
+                my_profile = UserProfile.objects.filter(id=self.me.id).annotate(
+                    place=Value(None, output_field=FloatField()),
+                    total_rating=Value(None, output_field=FloatField())
+                ).first()
+            return my_profile
+
+        kwargs = {k: v for k, v in kwargs.items() if k != 'period'}
         user_ct = ContentType.objects.get_for_model(UserProfile)
         kwargs_for_reviews = self.get_kwargs_for_reviews(kwargs)
         queryset = self.model.objects.filter(  # Фильтруем смз по нужным параметрам (регион оценки, смена, дата)
@@ -30,6 +30,7 @@ from backend.errors.enums import ErrorsCodes
 from backend.errors.http_exceptions import CustomException
 from backend.fields import DateTimeField
 from backend.mixins import CRUDSerializer
+from backend.ranking import RatingRanks
 from backend.utils import choices, credit_regex
 
 
@@ -83,6 +84,8 @@ class ProfileSerializer(CRUDSerializer):
 
     distributors = serializers.SerializerMethodField(read_only=True)
 
+    rating_place = serializers.SerializerMethodField(read_only=True)
+
     def validate(self, attrs):
         errors = []
 
@@ -380,6 +383,19 @@ class ProfileSerializer(CRUDSerializer):
             return True
         return False
 
+    @staticmethod
+    def get_rating_places(users):
+        """ Места пользователей страницы одним обращением к RatingRanks, передаются в context['rating_places'] """
+        return RatingRanks().get_places([user.id for user in users if user.rating_value is not None])
+
+    def get_rating_place(self, instance):
+        # Места меняются при каждой оценке любого смз, в бд не пересчитываются - берем из RatingRanks
+        if instance.rating_value is None:
+            return None
+        rating_places = self.context.get('rating_places')
+        place = rating_places.get(instance.id) if rating_places is not None else RatingRanks().get_place(instance.id)
+        return place if place is not None else instance.rating_place
+
     @staticmethod
     def get_distributors(instance):
         # TODO префетчить
@@ -42,7 +42,7 @@ from backend.errors.enums import RESTErrors, ErrorsCodes
 from backend.errors.http_exceptions import HttpException, CustomException
 from backend.mappers import RequestMapper
 from backend.mixins import CRUDAPIView
-from backend.utils import get_request_headers, get_request_body, chained_get
+from backend.utils import get_request_headers, get_request_body, chained_get, pagination_headers
 from app_games.tasks import check_everyday_tasks_for_user
 
 
@@ -240,17 +240,21 @@ class Users(CRUDAPIView):
         pagination = RequestMapper.pagination(request)
         order_params = RequestMapper(self).order(request)
 
+        rating_places = None
         if record_id:
             dataset = self.repository_class().get_by_id(record_id)
         else:
-            dataset = self.repository_class().filter_by_kwargs(
+            dataset = list(self.repository_class().filter_by_kwargs(
                 kwargs=filters, paginator=pagination, order_by=order_params
-            )
+            ))
+            # Места в рейтинге всей страницы - одним запросом в redis, а не по несколько на каждого пользователя
+            rating_places = self.serializer_class.get_rating_places(dataset)
             self.many = True
 
         serialized = self.serializer_class(dataset, many=self.many, context={
             'me': request.user,
             'headers': get_request_headers(request),
+            'rating_places': rating_places,
         })
         return Response(camelize(serialized.data), status=status.HTTP_200_OK)
 
@@ -327,7 +331,8 @@ class Notifications(CRUDAPIView):
             'me': request.user,
             'headers': get_request_headers(request),
         })
-        return Response(camelize(serialized.data), status=status.HTTP_200_OK)
+        headers = pagination_headers(pagination, dataset) if self.many else None
+        return Response(camelize(serialized.data), status=status.HTTP_200_OK, headers=headers)
 
 
 class NotificationsSettings(APIView):
@@ -541,13 +546,7 @@ class MyProfileDocument(MyProfileDocuments):
 
 @api_view(['POST'])
 def read_notification(request, **kwargs):
-    NotificationsRepository().filter_by_kwargs({
-        'id': kwargs.get('record_id'),
-        'read_at__isnull': True
-    }).update(
-        read_at=now(),
-        updated_at=now(),
-    )
+    NotificationsRepository().read_notification(kwargs.get('record_id'))
 
     indicators_dict = {
         'newNotifications': NotificationsRepository(me=request.user).get_unread_notifications_count(),
@@ -668,7 +667,7 @@ class ChangeManagerPasswordAPIView(BaseAPIView):
         if serializer.is_valid(raise_exception=True):
             request.user.set_password(raw_password=serializer.validated_data['password'])
             request.user.password_changed = True
-            request.user.save()
+            request.user.save(update_fields=['password', 'password_changed', 'updated_at'])
             return Response(status=status.HTTP_200_OK)
 
 
@@ -732,7 +731,8 @@ class UsersRating(CRUDAPIView):
     allowed_http_methods = ['get']
 
     filter_params = {
-        'region': 'reviews__region_id'
+        'region': 'reviews__region_id',
+        'period': 'period'  # RatingPeriod, рейтинг берется из предрассчитанного лидерборда
     }
 
     date_filter_params = {
@@ -769,7 +769,8 @@ class MyRating(CRUDAPIView):
     allowed_http_methods = ['get']
 
     filter_params = {
-        'region': 'reviews__region_id'
+        'region': 'reviews__region_id',
+        'period': 'period'  # RatingPeriod, рейтинг берется из предрассчитанного лидерборда
     }
 
     date_filter_params = {
@@ -985,7 +986,7 @@ class AdminProfilePassword(BaseAPIView):
         if serializer.is_valid(raise_exception=True):
             request.user.set_password(raw_password=serializer.validated_data['password'])
             request.user.password_changed = True
-            request.user.save()
+            request.user.save(update_fields=['password', 'password_changed', 'updated_at'])
             return Response(status=status.HTTP_204_NO_CONTENT)
 
 
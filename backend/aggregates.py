@@ -0,0 +1,53 @@
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from loguru import logger
+from redis import RedisError
+
+from backend.utils import get_redis_connection
+
+
+class AggregatesCache:
+    """
+        Кэш агрегатов выборок (статистика, фасеты фильтров) в redis по ключу (группа, версия, вид, хэш фильтров).
+        Как и ClustersCache: версия группы увеличивается сигналами при изменении объектов,
+        старые ключи истекают по TTL. TTL ограничивает и устаревание значений, зависящих от текущего времени
+    """
+
+    TTL = 60 * 5
+    KEY = 'aggregates:{}:{}:{}:{}'
+    VERSION_KEY = 'aggregates:{}:version'
+
+    @classmethod
+    def get_or_compute(cls, group, kind, filters, compute):
+        filters_hash = hashlib.md5(
+            json.dumps(filters, sort_keys=True, cls=DjangoJSONEncoder, default=str).encode()
+        ).hexdigest()
+
+        try:
+            connection = get_redis_connection()
+            version = int(connection.get(cls.VERSION_KEY.format(group)) or 0)
+            key = cls.KEY.format(group, version, kind, filters_hash)
+            cached = connection.get(key)
+            if cached is not None:
+                return json.loads(cached)
+        except RedisError as e:
+            logger.error(e)
+            return compute()
+
+        result = compute()
+        try:
+            connection.set(key, json.dumps(result, cls=DjangoJSONEncoder), ex=cls.TTL)
+        except RedisError as e:
+            logger.error(e)
+        return result
+
+    @classmethod
+    def invalidate(cls, *groups):
+        try:
+            connection = get_redis_connection()
+            for group in groups:
+                connection.incr(cls.VERSION_KEY.format(group))
+        except RedisError as e:
+            logger.error(e)
@@ -0,0 +1,203 @@
+import hashlib
+import pickle
+import threading
+from time import monotonic, time
+
+from django.conf import settings
+from loguru import logger
+from redis import RedisError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
+from rest_framework_simplejwt.tokens import UntypedToken
+
+from backend.utils import get_redis_connection
+
+
+def token_hash(token):
+    return hashlib.sha1(token.encode() if isinstance(token, str) else token).hexdigest()
+
+
+class AuthCache:
+    """
+        Кэш аутентификации в памяти процесса.
+        - токен -> пользователь (в pickle, каждому запросу своя копия) на JWT_AUTH_CACHE_TTL сек, но не дольше жизни токена
+        - множество отозванных токенов (выход, повторный вход, обновление токена) {хэш токена: exp}
+
+        Отзывы и изменения пользователей пишутся в redis:
+        - zset auth:revoked {хэш токена: exp} - все действующие отзывы, читается целиком при старте процесса
+        - zset auth:events {'t:<хэш>:<exp>' | 'u:<user_id>:<время>': время события} - журнал событий,
+          процессы раз в JWT_AUTH_SYNC_INTERVAL сек дочитывают из него только новые события
+    """
+
+    REVOKED_KEY = 'auth:revoked'
+    EVENTS_KEY = 'auth:events'
+    EVENTS_TTL = 60 * 60  # Журнал событий хранится час, отставшие процессы перечитывают auth:revoked целиком
+
+    _tokens = {}  # {токен: (user_id, pickle пользователя, валидированный токен, monotonic истечения)}
+    _users_tokens = {}  # {user_id: {токены}} для сброса кэша по пользователю
+    _revoked = {}  # {хэш токена: exp}
+    _synced_at = None  # Время (time) последней синхронизации с redis
+    _sync_checked_at = None  # monotonic последней проверки
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, token):
+        cls.sync()
+        entry = cls._tokens.get(token)
+        if entry is None:
+            return None
+        user_id, pickled_user, validated_token, expires_at = entry
+        if expires_at < monotonic() or token_hash(token) in cls._revoked:
+            cls._forget(token, user_id)
+            return None
+        return pickle.loads(pickled_user), validated_token
+
+    @classmethod
+    def set(cls, token, user, validated_token):
+        ttl = min(settings.JWT_AUTH_CACHE_TTL, validated_token['exp'] - time())
+        if ttl <= 0:
+            return
+        if len(cls._tokens) >= settings.JWT_AUTH_CACHE_SIZE:
+            cls.clear()
+        cls._tokens[token] = (user.id, pickle.dumps(user), validated_token, monotonic() + ttl)
+        cls._users_tokens.setdefault(user.id, set()).add(token)
+
+    @classmethod
+    def is_revoked(cls, token):
+        cls.sync()
+        return token_hash(token) in cls._revoked
+
+    @classmethod
+    def clear(cls):
+        cls._tokens.clear()
+        cls._users_tokens.clear()
+
+    @classmethod
+    def _forget(cls, token, user_id):
+        cls._tokens.pop(token, None)
+        tokens = cls._users_tokens.get(user_id)
+        if tokens:
+            tokens.discard(token)
+
+    @classmethod
+    def _forget_user(cls, user_id):
+        for token in cls._users_tokens.pop(user_id, set()):
+            cls._tokens.pop(token, None)
+
+    @classmethod
+    def revoke(cls, tokens):
+        """ Отзыв access-токенов во всех процессах """
+        revoked = {}
+        for token in tokens:
+            try:
+                exp = UntypedToken(token, verify=False)['exp']
+            except (TokenError, KeyError):
+                continue
+            if exp > time():
+                revoked[token_hash(token)] = exp
+
+        if not revoked:
+            return
+
+        for token in tokens:
+            cls._tokens.pop(token, None)
+        cls._revoked.update(revoked)
+
+        now = time()
+        try:
+            pipe = get_redis_connection().pipeline()
+            pipe.zadd(cls.REVOKED_KEY, revoked)
+            pipe.zadd(cls.EVENTS_KEY, {f't:{h}:{exp}': now for h, exp in revoked.items()})
+            pipe.zremrangebyscore(cls.REVOKED_KEY, '-inf', now)
+            pipe.zremrangebyscore(cls.EVENTS_KEY, '-inf', now - cls.EVENTS_TTL)
+            pipe.execute()
+        except RedisError as e:
+            logger.error(e)
+
+    @classmethod
+    def invalidate_user(cls, user_id):
+        """ Сброс закэшированного пользователя во всех процессах (изменился профиль) """
+        cls.invalidate_users([user_id])
+
+    @classmethod
+    def invalidate_users(cls, user_ids):
+        """
+            Сброс закэшированных пользователей во всех процессах одним событием на пользователя.
+            post_save сбрасывает кэш сам, вызывать явно нужно после queryset.update() и сырых UPDATE
+        """
+        if not user_ids:
+            return
+        for user_id in user_ids:
+            cls._forget_user(user_id)
+        now = time()
+        try:
+            get_redis_connection().zadd(cls.EVENTS_KEY, {f'u:{user_id}:{now}': now for user_id in user_ids})
+        except RedisError as e:
+            logger.error(e)
+
+    @classmethod
+    def sync(cls):
+        checked_at = cls._sync_checked_at
+        if checked_at is not None and monotonic() - checked_at < settings.JWT_AUTH_SYNC_INTERVAL:
+            return
+        if not cls._lock.acquire(blocking=False):
+            return  # Синхронизирует другой поток
+        try:
+            cls._sync_checked_at = monotonic()
+            now = time()
+            connection = get_redis_connection()
+            if cls._synced_at is None or now - cls._synced_at > cls.EVENTS_TTL:
+                # Первый запуск или процесс долго не синхронизировался - читаем все действующие отзывы
+                cls._revoked = {
+                    h.decode(): int(exp) for h, exp in connection.zrangebyscore(
+                        cls.REVOKED_KEY, now, '+inf', withscores=True
+                    )
+                }
+                cls.clear()
+            else:
+                # Небольшой запас по времени на расхождение часов между серверами
+                for event in connection.zrangebyscore(cls.EVENTS_KEY, cls._synced_at - 5, '+inf'):
+                    kind, key, value = event.decode().split(':')
+                    if kind == 't':
+                        cls._revoked[key] = int(float(value))
+                    else:
+                        cls._forget_user(int(key))
+                cls._revoked = {h: exp for h, exp in cls._revoked.items() if exp > now}
+            cls._synced_at = now
+        except RedisError as e:
+            logger.error(e)
+        finally:
+            cls._lock.release()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+        JWTAuthentication с кэшем: для известного токена не проверяется подпись и пользователь не читается из бд.
+        Отозванные токены (AuthCache.revoke) отклоняются
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        return self.authenticate_token(raw_token)
+
+    def authenticate_token(self, raw_token):
+        token = raw_token.decode() if isinstance(raw_token, bytes) else raw_token
+        cached = AuthCache.get(token)
+        if cached is not None:
+            return cached
+
+        validated_token = self.get_validated_token(raw_token)
+        if AuthCache.is_revoked(token):
+            raise InvalidToken({'detail': 'Токен отозван', 'code': 'token_not_valid'})
+
+        user = self.get_user(validated_token)
+        AuthCache.set(token, user, validated_token)
+        return user, validated_token
+
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import math
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.serializers.json import DjangoJSONEncoder
+from loguru import logger
+from redis import RedisError
+
+from backend.utils import get_redis_connection
+
+EARTH_RADIUS = 6370986  # Радиус сферы как в ST_DistanceSphere, м
+
+
+class MapTiles:
+    """
+        Квантование области карты по сетке тайлов (в градусах).
+        Уровень зума подбирается так, чтобы тайл был от половины до целой ширины экрана,
+        область расширяется до границ тайлов - соседние запросы при панорамировании и небольшом
+        зуме попадают в одну и ту же область и в один ключ кэша
+    """
+
+    MAX_ZOOM = 22
+    EPS_TILE_FRACTION = 0.2  # eps кластеризации ~ 1/10 диагонали экрана (экран - от 1 до 2 тайлов в ширину)
+
+    def __init__(self, screen_diagonal_points):
+        lons = [screen_diagonal_points[0].x, screen_diagonal_points[1].x]
+        lats = [screen_diagonal_points[0].y, screen_diagonal_points[1].y]
+        span = max(max(lons) - min(lons), max(lats) - min(lats), 360 / 2 ** self.MAX_ZOOM)
+
+        self.zoom = min(max(math.ceil(math.log2(360 / span)), 0), self.MAX_ZOOM)
+        self.tile_size = 360 / 2 ** self.zoom
+        self.x_min = math.floor(min(lons) / self.tile_size)
+        self.y_min = math.floor(min(lats) / self.tile_size)
+        self.x_max = math.ceil(max(lons) / self.tile_size)
+        self.y_max = math.ceil(max(lats) / self.tile_size)
+
+        self.eps = self.tile_size * self.EPS_TILE_FRACTION
+
+    @staticmethod
+    def tile_of(point, zoom):
+        tile_size = 360 / 2 ** zoom
+        return math.floor(point.x / tile_size), math.floor(point.y / tile_size)
+
+    @property
+    def tiles(self):
+        # Тайлы области вместе с граничными: точка на правой/верхней границе относится к следующему тайлу
+        return [(x, y) for x in range(self.x_min, self.x_max + 1) for y in range(self.y_min, self.y_max + 1)]
+
+    def snap_point(self, point):
+        """
+            Положение пользователя, выровненное по сетке с шагом eps (центр ячейки).
+            По нему в SQL выбираются ближайшие объекты кластеров и оно входит в ключ кэша
+        """
+        if point is None:
+            return None
+        return Point(
+            (math.floor(point.x / self.eps) + 0.5) * self.eps,
+            (math.floor(point.y / self.eps) + 0.5) * self.eps,
+            srid=settings.SRID
+        )
+
+    @property
+    def screen_diagonal_points(self):
+        # Углы области, выровненной по тайлам
+        return [
+            Point(
+                max(self.x_min * self.tile_size, -180), max(self.y_min * self.tile_size, -90), srid=settings.SRID
+            ),
+            Point(
+                min(self.x_max * self.tile_size, 180), min(self.y_max * self.tile_size, 90), srid=settings.SRID
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.zoom}:{self.x_min}:{self.y_min}:{self.x_max}:{self.y_max}'
+
+
+class ClustersCache:
+    """
+        Кэш результатов кластеризации в redis по ключу (модель, версия, область тайлов, хэш фильтров).
+        Версия ключа - сумма версии модели и версий тайлов области (без области экрана - версии "всей карты").
+        Сигналы увеличивают версии только тайлов с измененным объектом на всех уровнях зума (invalidate_points)
+        или, для редко меняющихся моделей, версию всей модели (invalidate). Старые ключи просто истекают по TTL
+    """
+
+    TTL = 60 * 10
+    KEY = 'clusters:{}:{}:{}:{}'
+    VERSION_KEY = 'clusters:{}:version'
+    TILE_VERSION_KEY = 'clusters:{}:tile:{}:{}:{}:version'  # Модель, зум, x, y
+    AREA_VERSION_KEY = 'clusters:{}:area:version'  # Кластеры без области экрана
+    TILE_VERSION_TTL = 60 * 60 * 24  # Намного дольше TTL, чтобы сброс версии не совпал с живым ключом
+
+    @classmethod
+    def versions_keys(cls, model_name, tiles: MapTiles):
+        if tiles is None:
+            return [cls.VERSION_KEY.format(model_name), cls.AREA_VERSION_KEY.format(model_name)]
+        return [cls.VERSION_KEY.format(model_name)] + [
+            cls.TILE_VERSION_KEY.format(model_name, tiles.zoom, x, y) for x, y in tiles.tiles
+        ]
+
+    @classmethod
+    def get_or_compute(cls, model_name, tiles: MapTiles, filters, compute):
+        filters_hash = hashlib.md5(
+            json.dumps(filters, sort_keys=True, cls=DjangoJSONEncoder, default=str).encode()
+        ).hexdigest()
+
+        try:
+            connection = get_redis_connection()
+            # Версии только растут, поэтому их сумма меняется при любом сбросе
+            version = sum(int(v or 0) for v in connection.mget(cls.versions_keys(model_name, tiles)))
+            key = cls.KEY.format(model_name, version, tiles, filters_hash)
+            cached = connection.get(key)
+            if cached is not None:
+                return json.loads(cached)
+        except RedisError as e:
+            logger.error(e)
+            return compute()
+
+        clusters = compute()
+        try:
+            connection.set(key, json.dumps(clusters, cls=DjangoJSONEncoder), ex=cls.TTL)
+        except RedisError as e:
+            logger.error(e)
+        return clusters
+
+    @classmethod
+    def invalidate(cls, *models_names):
+        try:
+            connection = get_redis_connection()
+            for model_name in models_names:
+                connection.incr(cls.VERSION_KEY.format(model_name))
+        except RedisError as e:
+            logger.error(e)
+
+    @classmethod
+    def invalidate_points(cls, model_name, points):
+        """ Сброс кэша только областей, содержащих точки, на всех уровнях зума """
+        try:
+            pipe = get_redis_connection().pipeline()
+            pipe.incr(cls.AREA_VERSION_KEY.format(model_name))
+            for point in points:
+                if point is None:
+                    continue
+                for zoom in range(MapTiles.MAX_ZOOM + 1):
+                    key = cls.TILE_VERSION_KEY.format(model_name, zoom, *MapTiles.tile_of(point, zoom))
+                    pipe.incr(key)
+                    pipe.expire(key, cls.TILE_VERSION_TTL)
+            pipe.execute()
+        except RedisError as e:
+            logger.error(e)
+
+
+def distance_sphere(lon1, lat1, lon2, lat2):
+    """ Расстояние между точками по сфере (как ST_DistanceSphere), м """
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def nearest_clustered_items(clusters, point, count=None):
+    """
+        Сортирует объекты кластеров по расстоянию до точки и оставляет count ближайших.
+        Из SQL приходят не больше CLUSTER_NESTED_ITEMS_COUNT ближайших к MapTiles.snap_point,
+        здесь они упорядочиваются по точному положению пользователя
+    """
+    count = count or settings.CLUSTER_NESTED_ITEMS_COUNT
+    for cluster in clusters:
+        items = cluster['clustered_items']
+        for item in items:
+            item['distance'] = distance_sphere(point.x, point.y, item['lon'], item['lat']) \
+                if point and item['lon'] is not None and item['lat'] is not None else None
+        items.sort(key=lambda i: (i['distance'] is None, i['distance']))
+        cluster['clustered_items'] = items[:count]
+    return clusters
+
+
+def clusters_to_dicts(clusters, fields):
+    """ Кластеры из DataMapper.clustering_raw_qs в простые словари для кэша """
+    return [{
+        **cluster,
+        'clustered_items': [{f: getattr(item, f) for f in fields} for item in cluster['clustered_items']]
+    } for cluster in clusters]
@@ -1,21 +1,53 @@
+import json
+
 from asgiref.sync import sync_to_async
 from celery import group
-from django.contrib.postgres.aggregates import ArrayAgg
-from django.db.models import Case, When, CharField, F
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.timezone import now
 from djangorestframework_camel_case.util import camelize
 from fcm_django.models import FCMDevice
 from loguru import logger
+from redis import RedisError
 
 from app_users.enums import NotificationType, NotificationChannelFromAndroid8
-from app_users.models import UserProfile, Notification
+from app_users.models import UserProfile, Notification, NotificationsSettings
+from backend.counters import UnreadCounters
 from backend.enums import Platform
-from backend.tasks import async_send_push
-from backend.utils import chunks, ArrayRemove, datetime_to_timestamp
-from giberno.settings import FCM_MAX_DEVICES_PER_REQUEST
+from backend.tasks import async_send_push, flush_push_queue
+from backend.utils import chunks, datetime_to_timestamp, get_redis_connection
+
+
+class FakePushSender:
+    """ Локальная заглушка Firebase: ничего не отправляет, только считает пуши (для бенчмарков) """
+    requests_count = 0
+    pushes_count = 0
+
+    @classmethod
+    def send(cls, title, message, push_data=None, sound=None, devices_ids=[], **kwargs):
+        cls.requests_count += 1
+        cls.pushes_count += len(devices_ids)
+
+    @classmethod
+    def reset(cls):
+        cls.requests_count = 0
+        cls.pushes_count = 0
 
 
 class PushController:
+    """
+        Пуши отправляются через очередь в redis: send_notification/send_message только кладут задание в очередь,
+        задача flush_push_queue через PUSH_BATCH_WINDOW сек забирает все накопившиеся задания и обрабатывает их
+        пачкой - настройки и токены всех получателей одним запросом, уведомления одним bulk_create,
+        повторные пуши пользователю по одному объекту за окно схлопываются в один
+    """
+
+    QUEUE_KEY = 'push:queue'
+    FLUSH_SCHEDULED_KEY = 'push:flush:scheduled'
+    MAX_JOB_ATTEMPTS = 3  # Задание, которое столько раз не удалось обработать, отбрасывается
+
+    NOTIFICATION = 'notification'  # Пуш с созданием записи уведомления
+    MESSAGE = 'message'  # Пуш без создания записи в бд
 
     def __init__(self, me=None) -> None:
         super().__init__()
@@ -33,46 +65,11 @@ class PushController:
             icon_type,
             **kwargs
     ):
-
-        if not NotificationType.has_value(notification_type):
-            # Если неизвестный тип уведомлений
-            return
-
-        users_to_send_queryset_sound, users_to_send_queryset_soundless = self.get_grouped_users_with_enabled_push(
-            users_to_send=users_to_send,
-            notification_type=notification_type
+        self.enqueue(
+            self.NOTIFICATION, users_to_send, title, message, common_uuid, action, subject_id, notification_type,
+            icon_type, **kwargs
         )
 
-        if users_to_send_queryset_sound:
-            # Пуши со звуком
-            self.process_notification_by_platform(
-                users_to_send_queryset=users_to_send_queryset_sound,
-                title=title,
-                message=message,
-                common_uuid=common_uuid,
-                action=action,
-                subject_id=subject_id,
-                notification_type=notification_type,
-                icon_type=icon_type,
-                is_sound_enabled=True,
-                **kwargs
-            )
-
-        if users_to_send_queryset_soundless:
-            # Пуши без звука
-            self.process_notification_by_platform(
-                users_to_send_queryset=users_to_send_queryset_soundless,
-                title=title,
-                message=message,
-                common_uuid=common_uuid,
-                action=action,
-                subject_id=subject_id,
-                notification_type=notification_type,
-                icon_type=icon_type,
-                is_sound_enabled=False,  # Отключаем звук
-                **kwargs
-            )
-
     def send_message(
             self,
             users_to_send: [UserProfile],
@@ -86,59 +83,228 @@ class PushController:
             **kwargs
     ):
         """ Отправка пуша как сообщения, без создания записи в бд """
+        self.enqueue(
+            self.MESSAGE, users_to_send, title, message, uuid, action, subject_id, notification_type, icon_type,
+            **kwargs
+        )
 
+    @classmethod
+    def enqueue(
+            cls, kind, users_to_send, title, message, uuid, action, subject_id, notification_type, icon_type, **kwargs
+    ):
         if not NotificationType.has_value(notification_type):
             # Если неизвестный тип уведомлений
             return
 
-        users_to_send_queryset_sound, users_to_send_queryset_soundless = self.get_grouped_users_with_enabled_push(
-            users_to_send=users_to_send,
-            notification_type=notification_type
-        )
+        users_ids = [u.id for u in users_to_send]
+        if not users_ids:
+            return
 
-        if users_to_send_queryset_sound:
-            # Пуши со звуком
-            self.process_message(
-                users_to_send_queryset=users_to_send_queryset_sound,
-                title=title,
-                message=message,
-                uuid=uuid,
-                action=action,
-                subject_id=subject_id,
-                notification_type=notification_type,
-                icon_type=icon_type,
-                is_sound_enabled=True,
-                **kwargs
-            )
-
-        if users_to_send_queryset_soundless:
-            # Пуши без звука
-            self.process_message(
-                users_to_send_queryset=users_to_send_queryset_soundless,
-                title=title,
-                message=message,
-                uuid=uuid,
-                action=action,
-                subject_id=subject_id,
-                notification_type=notification_type,
-                icon_type=icon_type,
-                is_sound_enabled=False,  # Отключаем звук
-                **kwargs
-            )
+        job = {
+            'kind': kind,
+            'users_ids': users_ids,
+            'title': title,
+            'message': message,
+            'uuid': str(uuid) if uuid else '',
+            'action': action,
+            'subject_id': subject_id,
+            'notification_type': notification_type,
+            'icon_type': icon_type,
+            'created_at': datetime_to_timestamp(now()),
+            'kwargs': kwargs
+        }
+
+        try:
+            connection = get_redis_connection()
+            connection.rpush(cls.QUEUE_KEY, json.dumps(job, cls=DjangoJSONEncoder))
+            cls.schedule_flush(countdown=settings.PUSH_BATCH_WINDOW)
+        except RedisError as e:
+            # Очередь недоступна - обрабатываем задание сразу, чтобы не потерять пуш
+            logger.error(e)
+            cls.process_batch([json.loads(json.dumps(job, cls=DjangoJSONEncoder))])
+
+    @classmethod
+    def schedule_flush(cls, countdown=0):
+        # Одна отложенная обработка на окно, флаг живет с запасом на случай потери задачи celery
+        if get_redis_connection().set(cls.FLUSH_SCHEDULED_KEY, 1, nx=True, ex=settings.PUSH_BATCH_WINDOW * 10 + 10):
+            flush_push_queue.apply_async(countdown=countdown)
+
+    @classmethod
+    def pop_batch(cls):
+        pipe = get_redis_connection().pipeline()  # LRANGE + LTRIM атомарно в транзакции
+        pipe.lrange(cls.QUEUE_KEY, 0, settings.PUSH_BATCH_SIZE - 1)
+        pipe.ltrim(cls.QUEUE_KEY, settings.PUSH_BATCH_SIZE, -1)
+        jobs, _ = pipe.execute()
+
+        parsed = []
+        for job in jobs:
+            try:
+                parsed.append(json.loads(job))
+            except ValueError as e:
+                logger.error(f'Невалидное задание пуша отброшено: {job}, {e}')
+        return parsed
+
+    @classmethod
+    def flush_queue(cls):
+        """ Обработка накопившихся в очереди заданий, вызывается из задачи flush_push_queue """
+        connection = get_redis_connection()
+        connection.delete(cls.FLUSH_SCHEDULED_KEY)
+
+        jobs = cls.pop_batch()
+        try:
+            if jobs:
+                cls.process_jobs(jobs)
+        finally:
+            if connection.llen(cls.QUEUE_KEY):
+                # В очереди осталось больше PUSH_BATCH_SIZE заданий или вернулись неудавшиеся - продолжаем
+                cls.schedule_flush()
+
+        return len(jobs)
+
+    @classmethod
+    def process_jobs(cls, jobs):
+        """
+            Пачка уже снята с очереди, поэтому ошибка не должна терять пуши всех заданий:
+            если пачка целиком не обработалась, задания обрабатываются по одному, неудавшиеся возвращаются в очередь
+        """
+        try:
+            cls.process_batch(jobs)
+            return
+        except Exception as e:
+            logger.error(e)
+
+        failed = []
+        for job in jobs:
+            try:
+                cls.process_batch([job])
+            except Exception as e:
+                logger.error(e)
+                failed.append(job)
+        cls.requeue(failed)
+
+    @classmethod
+    def requeue(cls, jobs):
+        retried = []
+        for job in jobs:
+            attempts = (job.get('attempts', 0) if isinstance(job, dict) else cls.MAX_JOB_ATTEMPTS) + 1
+            if attempts >= cls.MAX_JOB_ATTEMPTS:
+                logger.error(f'Задание пуша отброшено после {attempts} попыток: {job}')
+                continue
+            retried.append(json.dumps({**job, 'attempts': attempts}, cls=DjangoJSONEncoder))
+        if retried:
+            get_redis_connection().rpush(cls.QUEUE_KEY, *retried)
+
+    @classmethod
+    def process_batch(cls, jobs):
+        users_ids = set()
+        for job in jobs:
+            users_ids.update(job['users_ids'])
+
+        # Настройки уведомлений и живые токены всех получателей пачки - по одному запросу
+        users_settings = {
+            s['user_id']: s for s in NotificationsSettings.objects.filter(
+                user_id__in=users_ids
+            ).values('user_id', 'enabled_types', 'sound_enabled')
+        }
+        users_devices = {}
+        for d in FCMDevice.objects.filter(
+                active=True,  # Только живые токены
+                user_id__in=users_ids
+        ).values('id', 'user_id', 'type', 'registration_id'):
+            users_devices.setdefault(d['user_id'], []).append(d)
+
+        sound_parameters = {}  # {(индекс задания, звук из настроек): (sound, is_sound_enabled, kwargs)}
+        processed = set()  # Для отсева дублей (тип задания, uuid, пользователь), только для заданий с uuid
+        deliveries = {}  # {(пользователь, тип задания, action, subject_id, тип уведомления): (индекс задания, звук)}
+        jobs_notifications = {}  # {(индекс задания, звук): [уведомления получателей]}
+
+        for index, job in enumerate(jobs):
+            for user_id in job['users_ids']:
+                if job['uuid']:
+                    # Без uuid (например, сообщения чата без uuid) разные задания не считаются дублями
+                    if (job['kind'], job['uuid'], user_id) in processed:
+                        continue
+                    processed.add((job['kind'], job['uuid'], user_id))
+
+                # Отфильтровываем по настройкам уведомлений у пользователей
+                user_settings = users_settings.get(user_id)
+                if not user_settings or job['notification_type'] not in (user_settings['enabled_types'] or []):
+                    continue
+
+                key = (index, user_settings['sound_enabled'])
+                if key not in sound_parameters:
+                    kwargs = dict(job['kwargs'])
+                    sound, is_sound_enabled = cls.process_sound_parameters(key[1], job['notification_type'], kwargs)
+                    sound_parameters[key] = (sound, is_sound_enabled, kwargs)
+
+                if job['kind'] == cls.NOTIFICATION:
+                    devices = users_devices.get(user_id, [])
+                    jobs_notifications.setdefault(key, []).append(
+                        Notification(
+                            uuid=job['uuid'],
+                            user_id=user_id,
+                            subject_id=job['subject_id'],
+                            title=job['title'],
+                            message=job['message'],
+                            type=job['notification_type'],
+                            action=job['action'],
+                            push_tokens_android=[
+                                d['registration_id'] for d in devices if d['type'] == Platform.ANDROID.value
+                            ],
+                            push_tokens_ios=[d['registration_id'] for d in devices if d['type'] == Platform.IOS.value],
+                            icon_type=job['icon_type'],
+                            sound_enabled=sound_parameters[key][1],
+                        )
+                    )
 
-    @staticmethod
-    def get_grouped_users_with_enabled_push(users_to_send, notification_type):
-        # Отфильтровываем по настройкам уведомлений у пользователей
-        users_to_send_queryset_sound = UserProfile.objects.filter(pk__in=[u.id for u in users_to_send]).filter(
-            notificationssettings__enabled_types__contains=[notification_type],
-            notificationssettings__sound_enabled=True,  # Звук уведомлений включен в настройках
-        )
-        users_to_send_queryset_soundless = UserProfile.objects.filter(pk__in=[u.id for u in users_to_send]).filter(
-            notificationssettings__enabled_types__contains=[notification_type],
-            notificationssettings__sound_enabled=False,  # Звук уведомлений выключен в настройках
-        )
+                # Из нескольких пушей пользователю по одному объекту за окно отправляется только последний
+                deliveries[
+                    (user_id, job['kind'], job['action'], job['subject_id'], job['notification_type'])
+                ] = key
 
-        return users_to_send_queryset_sound, users_to_send_queryset_soundless
+        notifications_links = []  # Список объектов-связок для bulk_create
+        for links in jobs_notifications.values():
+            # Как и при отправке по одному вызову: если у получателей есть живые токены, уведомления создаются
+            # только им, если токенов нет ни у кого - всем получателям, но уже без отправки пушей
+            notifications_links += [n for n in links if n.push_tokens_android or n.push_tokens_ios] or links
+
+        # Группируем устройства по одинаковому содержимому пуша.
+        # Пуши собираются до записи в бд: ошибка в данных задания не должна оставить созданные уведомления,
+        # иначе при повторной обработке (process_jobs) они задублируются
+        grouped_devices = {}
+        for (user_id, *_), key in deliveries.items():
+            grouped_devices.setdefault(key, []).extend(d['id'] for d in users_devices.get(user_id, []))
+
+        pushes = []
+        for key, devices_ids in grouped_devices.items():
+            if not devices_ids:
+                continue
+            job = jobs[key[0]]
+            sound, _, kwargs = sound_parameters[key]
+
+            # Все данные должны быть строками
+            push_data = camelize({
+                'uuid': job['uuid'],
+                'type': str(job['notification_type']),
+                'action': str(job['action']),
+                'icon_type': str(job['icon_type']) if job['icon_type'] else '',
+                'subject_id': str(job['subject_id']) if job['subject_id'] else '',
+                'title': str(job['title']),
+                'message': str(job['message']),
+                'created_at': str(job['created_at'])
+            })
+            pushes.append((job['title'], job['message'], push_data, sound, devices_ids, kwargs))
+
+        if notifications_links:
+            Notification.objects.bulk_create(notifications_links)  # Массовое создание уведомлений
+            if not settings.PUSH_FAKE_SENDER:
+                # С заглушкой (бенчмарк откатывает уведомления) не трогаем реальные счетчики непрочитанного в redis
+                UnreadCounters().incr_notifications([n.user_id for n in notifications_links])
+
+        for title, message, push_data, sound, devices_ids, kwargs in pushes:
+            cls.send_push(title, message, push_data, sound, devices_ids, **kwargs)
+
+        return len(notifications_links)
 
     @staticmethod
     def process_sound_parameters(is_sound_enabled, notification_type, kwargs):
@@ -174,159 +340,11 @@ class PushController:
 
         return sound, is_sound_enabled
 
-    def process_notification_by_platform(
-            self,
-            users_to_send_queryset,
-            title,
-            message,
-            common_uuid,
-            action,
-            subject_id,
-            notification_type,
-            icon_type,
-            is_sound_enabled: bool,
-            **kwargs
-    ):
-        """ Отправка пуша как оповещения, создание записи в бд """
-
-        # Разделяем пуштокены iOS и Android, записываем в модель уведомления
-        users_with_divided_tokens = FCMDevice.objects.filter(
-            active=True,  # Только живые токены
-            user__in=users_to_send_queryset  # Берем токены только отфиьтрованных пользователей
-        ).values('user_id').annotate(
-            devices=ArrayAgg('id'),  # Собираем ID токенов в
-            ios=ArrayRemove(
-                ArrayAgg(  # Группируем ios токены
-                    Case(
-                        When(
-                            type=Platform.IOS.value,
-                            then=F('registration_id')
-                        ),
-                        default=None,
-                        output_field=CharField()
-                    )
-                ),
-                None  # Удаляем null'ы из массива
-            ),
-            android=ArrayRemove(
-                ArrayAgg(  # Группируем Android токены
-                    Case(
-                        When(
-                            type=Platform.ANDROID.value,
-                            then=F('registration_id')
-                        ),
-                        default=None,
-                        output_field=CharField()
-                    )
-                ),
-                None  # Удаляем null'ы из массива
-            )
-        )
-
-        # Обрабатываем параметры звука
-        sound, is_sound_enabled = self.process_sound_parameters(is_sound_enabled, notification_type, kwargs)
-
-        devices_ids = []  # Список ID моделей пуш-токенов
-        notifications_links = []  # Список объектов-связок для bulk_create
-
-        if users_with_divided_tokens:
-            # Если есть живые токены у указанных пользователей
-            for u in users_with_divided_tokens:
-                devices_ids += u['devices']  # Добавляем список устройств пользователя в общий массив
-
-                notifications_links.append(
-                    Notification(
-                        uuid=common_uuid,
-                        user_id=u['user_id'],
-                        subject_id=subject_id,
-                        title=title,
-                        message=message,
-                        type=notification_type,
-                        action=action,
-                        push_tokens_android=u['android'],
-                        push_tokens_ios=u['ios'],
-                        icon_type=icon_type,
-                        sound_enabled=is_sound_enabled,
-                    )
-                )
-        else:
-            # Если нет живах токенов, то просто создаем записи уведомлений, но отпправки пушей уже не будет
-            for u in users_to_send_queryset:
-                notifications_links.append(
-                    Notification(
-                        uuid=common_uuid,
-                        user_id=u.id,
-                        subject_id=subject_id,
-                        title=title,
-                        message=message,
-                        type=notification_type,
-                        action=action,
-                        push_tokens_android=[],
-                        push_tokens_ios=[],
-                        icon_type=icon_type,
-                        sound_enabled=is_sound_enabled,
-                    )
-                )
-
-        Notification.objects.bulk_create(notifications_links)  # Массовое создание уведомлений
-
-        # Все данные должны быть строками
-        push_data = camelize({
-            'uuid': str(common_uuid),
-            'type': str(notification_type),
-            'action': str(action),
-            'icon_type': str(icon_type) if icon_type else '',
-            'subject_id': str(subject_id) if subject_id else '',
-            'title': str(title),
-            'message': str(message),
-            'created_at': str(datetime_to_timestamp(now()))
-        })
-
-        self.send_push(title, message, push_data, sound, devices_ids, **kwargs)
-
-    def process_message(
-            self,
-            users_to_send_queryset,
-            title,
-            message,
-            uuid,
-            action,
-            subject_id,
-            notification_type,
-            icon_type,
-            is_sound_enabled: bool,
-            **kwargs
-    ):
-        """ Отправка пуша как сообщения, без создания записи в бд """
-
-        # Получаем только ид устройств с токенами
-        devices_ids = FCMDevice.objects.filter(
-            active=True,  # Только живые токены
-            user__in=users_to_send_queryset  # Берем токены только отфиьтрованных пользователей
-        ).values_list('id', flat=True)
-
-        # Обрабатываем параметры звука
-        sound, is_sound_enabled = self.process_sound_parameters(is_sound_enabled, notification_type, kwargs)
-
-        # Все данные должны быть строками
-        push_data = camelize({
-            'type': str(notification_type),
-            'action': str(action),
-            'icon_type': str(icon_type) if icon_type else '',
-            'subject_id': str(subject_id) if subject_id else '',
-            'uuid': str(uuid),
-            'title': str(title),
-            'message': str(message),
-            'created_at': str(datetime_to_timestamp(now()))
-        })
-
-        self.send_push(title, message, push_data, sound, devices_ids, **kwargs)
-
     @staticmethod
     def send_push(title, message, push_data, sound, devices_ids=[], **kwargs):
 
         # Разбиваем весь список на группы по FCM_MAX_DEVICES_PER_REQUEST штук
-        devices_ids_chunked = chunks(devices_ids, FCM_MAX_DEVICES_PER_REQUEST)
+        devices_ids_chunked = chunks(devices_ids, settings.FCM_MAX_DEVICES_PER_REQUEST)
         logger.info(
             f'>>>>\n'
             f'  SOUND {"ON" if sound else "OFF"}\n'
@@ -335,6 +353,11 @@ class PushController:
             f'<<<<'
         )
 
+        if settings.PUSH_FAKE_SENDER:
+            for ids_chunk in devices_ids_chunked:
+                FakePushSender.send(title, message, push_data, sound, ids_chunk, **kwargs)
+            return
+
         jobs = group(  # Создаем группы асинхронных задач
             [
                 async_send_push.s(title, message, push_data, sound, ids_chunk, **kwargs) for ids_chunk in
@@ -0,0 +1,320 @@
+from datetime import timedelta
+
+from django.db import transaction
+from loguru import logger
+from redis import RedisError
+
+from backend.utils import get_redis_connection
+
+
+class UnreadCounters:
+    """
+        Счетчики непрочитанного в redis
+        - hash unread:chats:<user_id> -> {<chat_id>: количество непрочитанных сообщений}
+        - строка unread:notifications:<user_id> -> количество непрочитанных уведомлений
+
+        Счетчики инициализируются лениво из бд (loader) при первом чтении и далее меняются инкрементально.
+        Инкремент применяется только к уже инициализированному ключу, иначе значение будет посчитано при чтении.
+        TTL задается при инициализации и чтением не продлевается: ключ истекает не позже чем через TTL
+        и пересчитывается из бд, поэтому расхождения от конкурентных инкрементов не накапливаются.
+    """
+
+    CHATS_KEY = 'unread:chats:{}'
+    NOTIFICATIONS_KEY = 'unread:notifications:{}'
+    INITIALIZED_FIELD = 'init'  # Служебное поле hash, чтобы отличать "нет непрочитанных" от "не инициализирован"
+    TTL = timedelta(hours=1)
+
+    # Инкремент поля hash, если ключ существует, значение не опускается ниже 0
+    _HINCR_IF_EXISTS = '''
+        if redis.call('EXISTS', KEYS[1]) == 1 then
+            local value = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+            if value < 0 then
+                redis.call('HINCRBY', KEYS[1], ARGV[1], -value)
+            end
+        end
+    '''
+
+    # Инкремент строки, если ключ существует, значение не опускается ниже 0
+    _INCR_IF_EXISTS = '''
+        if redis.call('EXISTS', KEYS[1]) == 1 then
+            local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+            if value < 0 then
+                redis.call('INCRBY', KEYS[1], -value)
+            end
+        end
+    '''
+
+    def __init__(self):
+        self.connection = get_redis_connection()
+
+    def incr_chat(self, users_ids, chat_id, amount=1):
+        if not users_ids or not amount:
+            return
+        try:
+            script = self.connection.register_script(self._HINCR_IF_EXISTS)
+            pipe = self.connection.pipeline(transaction=False)
+            for user_id in set(users_ids):
+                script(keys=[self.CHATS_KEY.format(user_id)], args=[chat_id, amount], client=pipe)
+            pipe.execute()
+        except RedisError as e:
+            logger.error(e)
+
+    def decr_chat(self, user_id, chat_id, amount=1):
+        self.incr_chat([user_id], chat_id, -amount)
+
+    def get_chats(self, user_id, loader):
+        """
+        :param user_id:
+        :param loader: функция, возвращающая из бд словарь {chat_id: unread_count}
+        :return: словарь {chat_id: unread_count}
+        """
+        key = self.CHATS_KEY.format(user_id)
+        try:
+            stored = self.connection.hgetall(key)
+            if stored:
+                return {
+                    int(chat_id): int(count)
+                    for chat_id, count in stored.items() if chat_id != self.INITIALIZED_FIELD.encode()
+                }
+
+            counts = loader()
+            pipe = self.connection.pipeline()
+            pipe.hset(key, mapping={**counts, self.INITIALIZED_FIELD: 1})
+            pipe.expire(key, self.TTL)
+            pipe.execute()
+            return counts
+        except RedisError as e:
+            logger.error(e)
+            return loader()
+
+    def get_chats_many(self, users_ids, loader):
+        """
+        Счетчики нескольких пользователей: чтение одним pipeline, неинициализированные грузятся из бд одним вызовом
+        :param users_ids:
+        :param loader: функция, возвращающая из бд словарь {user_id: {chat_id: unread_count}} для списка user_id
+        :return: словарь {user_id: {chat_id: unread_count}}
+        """
+        users_ids = list(set(users_ids))
+        if not users_ids:
+            return {}
+        try:
+            pipe = self.connection.pipeline(transaction=False)
+            for user_id in users_ids:
+                pipe.hgetall(self.CHATS_KEY.format(user_id))
+
+            result = {}
+            missing_ids = []
+            for user_id, stored in zip(users_ids, pipe.execute()):
+                if stored:
+                    result[user_id] = {
+                        int(chat_id): int(count)
+                        for chat_id, count in stored.items() if chat_id != self.INITIALIZED_FIELD.encode()
+                    }
+                else:
+                    missing_ids.append(user_id)
+
+            if missing_ids:
+                loaded = loader(missing_ids)
+                pipe = self.connection.pipeline()
+                for user_id in missing_ids:
+                    counts = loaded.get(user_id, {})
+                    key = self.CHATS_KEY.format(user_id)
+                    pipe.hset(key, mapping={**counts, self.INITIALIZED_FIELD: 1})
+                    pipe.expire(key, self.TTL)
+                    result[user_id] = counts
+                pipe.execute()
+            return result
+        except RedisError as e:
+            logger.error(e)
+            loaded = loader(users_ids)
+            return {user_id: loaded.get(user_id, {}) for user_id in users_ids}
+
+    def reset_chats(self, users_ids):
+        # Сброс счетчиков (например при изменении состава участников), пересчитаются при следующем чтении
+        if not users_ids:
+            return
+        try:
+            self.connection.delete(*[self.CHATS_KEY.format(user_id) for user_id in set(users_ids)])
+        except RedisError as e:
+            logger.error(e)
+
+    def incr_notifications(self, users_ids, amount=1):
+        if not users_ids or not amount:
+            return
+        try:
+            script = self.connection.register_script(self._INCR_IF_EXISTS)
+            pipe = self.connection.pipeline(transaction=False)
+            for user_id in users_ids:
+                script(keys=[self.NOTIFICATIONS_KEY.format(user_id)], args=[amount], client=pipe)
+            pipe.execute()
+        except RedisError as e:
+            logger.error(e)
+
+    def decr_notifications(self, user_id, amount=1):
+        self.incr_notifications([user_id], -amount)
+
+    def get_notifications(self, user_id, loader):
+        """
+        :param user_id:
+        :param loader: функция, возвращающая из бд количество непрочитанных уведомлений
+        :return: количество непрочитанных уведомлений
+        """
+        key = self.NOTIFICATIONS_KEY.format(user_id)
+        try:
+            stored = self.connection.get(key)
+            if stored is not None:
+                return int(stored)
+
+            count = loader()
+            self.connection.set(key, count, ex=self.TTL, nx=True)
+            return count
+        except RedisError as e:
+            logger.error(e)
+            return loader()
+
+
+class BufferedCounter:
+    """
+        Буфер инкрементов счетчика в redis: hash buffer:<name> -> {<id записи>: прирост}.
+        Периодически сбрасывается в бд одним UPDATE (flush). Перед сбросом буфер атомарно переименовывается,
+        поэтому инкременты, пришедшие во время сброса, копятся уже в новом буфере и не теряются.
+        Если сброс упал, переименованный буфер применяется при следующем сбросе: все пачки применяются в одной
+        транзакции, а переименованный буфер удаляется только после ее коммита.
+    """
+
+    BUFFER_KEY = 'buffer:{}'
+    FLUSHING_KEY = 'buffer:{}:flushing'
+    LOCK_KEY = 'buffer:{}:lock'
+    LOCK_TIMEOUT = 60  # Сек
+
+    def __init__(self, name):
+        self.buffer_key = self.BUFFER_KEY.format(name)
+        self.flushing_key = self.FLUSHING_KEY.format(name)
+        self.lock_key = self.LOCK_KEY.format(name)
+
+    def incr(self, record_id, amount=1):
+        """ Возвращает накопленный в буфере прирост для записи или None, если redis недоступен """
+        try:
+            return get_redis_connection().hincrby(self.buffer_key, record_id, amount)
+        except RedisError as e:
+            logger.error(e)
+            return None
+
+    @staticmethod
+    def parse_value(value):
+        return int(value)
+
+    def flush(self, apply):
+        """
+        :param apply: функция, применяющая в бд словарь {id записи: прирост}
+        :return: количество обновленных записей
+        """
+        connection = get_redis_connection()
+        if not connection.set(self.lock_key, 1, nx=True, ex=self.LOCK_TIMEOUT):
+            return 0  # Сброс уже идет в другом воркере
+        try:
+            if not connection.exists(self.flushing_key):
+                if not connection.exists(self.buffer_key):
+                    return 0
+                connection.rename(self.buffer_key, self.flushing_key)
+
+            increments = {
+                int(record_id): self.parse_value(value)
+                for record_id, value in connection.hgetall(self.flushing_key).items()
+            }
+            with transaction.atomic():
+                if increments:
+                    apply(increments)
+                # При откате транзакции буфер остается и применяется целиком при следующем сбросе
+                transaction.on_commit(lambda: connection.delete(self.flushing_key))
+            return len(increments)
+        finally:
+            connection.delete(self.lock_key)
+
+
+class BufferedValues(BufferedCounter):
+    """
+        Буфер последних значений в redis: hash buffer:<name> -> {<id записи>: значение}, новое значение
+        заменяет прежнее. Сбрасывается в бд так же, как BufferedCounter
+    """
+
+    def set(self, record_id, value):
+        """ Возвращает False, если redis недоступен """
+        try:
+            get_redis_connection().hset(self.buffer_key, record_id, value)
+            return True
+        except RedisError as e:
+            logger.error(e)
+            return False
+
+    @staticmethod
+    def parse_value(value):
+        return value.decode()
+
+
+class DirtySet:
+    """
+        Очередь записей, которые нужно перепроверить: set dirty:<name> -> {<id записи>}.
+        Записи отмечаются при событиях, периодическая задача обрабатывает только отмеченные (drain).
+        Как и буфер BufferedCounter, перед разбором set атомарно переименовывается: отметки во время разбора
+        копятся в новом set, а если разбор упал - переименованный set разбирается при следующем запуске.
+        Статистика разборов - hash dirty:<name>:stats {cycles, processed}
+    """
+
+    KEY = 'dirty:{}'
+    PROCESSING_KEY = 'dirty:{}:processing'
+    LOCK_KEY = 'dirty:{}:lock'
+    STATS_KEY = 'dirty:{}:stats'
+    LOCK_TIMEOUT = 60  # Сек
+
+    def __init__(self, name):
+        self.key = self.KEY.format(name)
+        self.processing_key = self.PROCESSING_KEY.format(name)
+        self.lock_key = self.LOCK_KEY.format(name)
+        self.stats_key = self.STATS_KEY.format(name)
+
+    def mark(self, *records_ids):
+        records_ids = [record_id for record_id in records_ids if record_id is not None]
+        if not records_ids:
+            return
+        try:
+            get_redis_connection().sadd(self.key, *records_ids)
+        except RedisError as e:
+            logger.error(e)
+
+    def drain(self, apply):
+        """
+        :param apply: функция, обрабатывающая список id отмеченных записей
+        :return: количество обработанных записей
+        """
+        connection = get_redis_connection()
+        if not connection.set(self.lock_key, 1, nx=True, ex=self.LOCK_TIMEOUT):
+            return 0  # Разбор уже идет в другом воркере
+        try:
+            if not connection.exists(self.processing_key):
+                if not connection.exists(self.key):
+                    return 0
+                connection.rename(self.key, self.processing_key)
+
+            records_ids = sorted(int(record_id) for record_id in connection.smembers(self.processing_key))
+            if records_ids:
+                apply(records_ids)
+            connection.delete(self.processing_key)
+            return len(records_ids)
+        finally:
+            connection.delete(self.lock_key)
+
+    def add_stats(self, processed):
+        try:
+            pipe = get_redis_connection().pipeline(transaction=False)
+            pipe.hincrby(self.stats_key, 'cycles', 1)
+            pipe.hincrby(self.stats_key, 'processed', processed)
+            pipe.execute()
+        except RedisError as e:
+            logger.error(e)
+
+    def get_stats(self):
+        return {k.decode(): int(v) for k, v in get_redis_connection().hgetall(self.stats_key).items()}
+
+    def clear_stats(self):
+        get_redis_connection().delete(self.stats_key)
@@ -1,5 +1,7 @@
 from enum import Enum
 
+from app_media.enums import MediaStatus
+
 
 class BaseEntity:
     def __init__(self, **kwargs) -> None:
@@ -13,10 +15,14 @@ class BaseEntity:
 class Pagination(BaseEntity):
     limit: int
     offset: int
+    cursor: list  # Значения ключа сортировки последней записи предыдущей страницы, None - пагинация по offset
+    order_fields: list  # Поля сортировки страницы, по ним строится следующий курсор
 
     def __init__(self, **kwargs):
         self.limit = 10
         self.offset = 0
+        self.cursor = None
+        self.order_fields = None
         super().__init__(**kwargs)
 
 
@@ -55,6 +61,7 @@ class File(BaseEntity):
         self.height = None
         self.duration = None
         self.size = None
+        self.status = MediaStatus.READY.value
 
         super().__init__(**kwargs)
 
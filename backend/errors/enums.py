@@ -24,6 +24,7 @@ class ErrorsCodes(EnumM):
 
     INVALID_COORDS = 'Некорректные географические координаты'
     INVALID_DATE_RANGE = 'Некорректный диапазон дат'
+    SHIFTS_CALENDAR_OUT_OF_HORIZON = 'Расписание смен доступно только на ближайшие 3 месяца'
 
     USERNAME_WRONG = 'Неверный логин'
     USERNAME_TAKEN = 'Логин занят'
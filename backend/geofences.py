@@ -0,0 +1,93 @@
+from time import monotonic
+
+from django.conf import settings
+from django.db.models import F
+from django.utils.timezone import now, localtime
+from pytz import timezone
+
+from backend.clustering import distance_sphere
+
+
+class ShiftGeofences:
+    """
+        Геозоны смен в памяти процесса для проверки геопозиции работника без запросов к бд на каждый пинг
+        - смена -> вакансия, магазин, координаты магазина, радиус, часовой пояс вакансии
+        - (работник, смена) -> интервалы подтвержденных на сегодня откликов с оповещением об уходе
+        Записи живут GEOFENCE_CACHE_TTL сек, при изменении смен, вакансий, магазинов и откликов сбрасываются сигналами
+    """
+
+    _shifts = {}  # {shift_id: (геозона или None, monotonic истечения)}
+    _appeals = {}  # {(user_id, shift_id): ((дата, [(time_start, time_end)]), monotonic истечения)}
+
+    @classmethod
+    def get_shift(cls, shift_id):
+        entry = cls._shifts.get(shift_id)
+        if entry is not None and entry[1] > monotonic():
+            return entry[0]
+
+        # Локальный импорт: модели приложений импортируют backend
+        from app_market.models import Shift
+        shift = Shift.objects.filter(id=shift_id).select_related('vacancy__shop').first()
+        geofence = {
+            'shift_id': shift.id,
+            'vacancy_id': shift.vacancy_id,
+            'shop_id': shift.vacancy.shop_id,
+            'location': (shift.vacancy.shop.location.x, shift.vacancy.shop.location.y)
+            if shift.vacancy.shop and shift.vacancy.shop.location else None,
+            'radius': shift.vacancy.radius,
+            'timezone': shift.vacancy.timezone or 'Europe/Moscow',
+        } if shift else None
+
+        cls._remember(cls._shifts, shift_id, geofence)
+        return geofence
+
+    @classmethod
+    def has_active_appeal(cls, user_id, geofence):
+        """ Есть подтвержденный отклик на смену, идущий сейчас, с включенным оповещением об уходе """
+        current_time = now()
+        local_now = localtime(current_time, timezone=timezone(geofence['timezone']))
+        key = (user_id, geofence['shift_id'])
+
+        entry = cls._appeals.get(key)
+        if entry is not None and entry[1] > monotonic() and entry[0][0] == local_now.date():
+            intervals = entry[0][1]
+        else:
+            from app_market.enums import ShiftAppealStatus
+            from app_market.models import ShiftAppeal
+            intervals = list(ShiftAppeal.objects.annotate(
+                timezone=F('shift__vacancy__timezone')
+            ).filter(
+                notify_leaving=True,  # Оповещения должны быть включены для этой заявки
+                applier_id=user_id,
+                status=ShiftAppealStatus.CONFIRMED.value,
+                shift_id=geofence['shift_id'],
+                shift_active_date__datetz=local_now,
+            ).values_list('time_start', 'time_end'))
+            cls._remember(cls._appeals, key, (local_now.date(), intervals))
+
+        return any(
+            time_start is not None and time_end is not None and time_start <= current_time < time_end
+            for time_start, time_end in intervals
+        )
+
+    @staticmethod
+    def is_within_radius(geofence, point):
+        if geofence['radius'] is None:
+            return True  # Защита от вакансий без радиуса, чтобы не сигналило постоянно
+        if geofence['location'] is None or point is None:
+            return False
+        return distance_sphere(point.x, point.y, *geofence['location']) <= geofence['radius']
+
+    @staticmethod
+    def _remember(storage, key, value):
+        if len(storage) > 100000:
+            storage.clear()  # Не даем словарю расти бесконечно в долгоживущем процессе
+        storage[key] = (value, monotonic() + settings.GEOFENCE_CACHE_TTL)
+
+    @classmethod
+    def forget_shifts(cls):
+        cls._shifts.clear()
+
+    @classmethod
+    def forget_appeals(cls, user_id, shift_id):
+        cls._appeals.pop((user_id, shift_id), None)
@@ -14,7 +14,8 @@ from app_media.mappers import MediaMapper
 from backend.entity import Pagination, Error
 from backend.errors.enums import RESTErrors, ErrorsCodes
 from backend.errors.http_exceptions import HttpException, CustomException
-from backend.utils import timestamp_to_datetime as t2d, chained_get, timestamp_to_datetime, get_request_body
+from backend.utils import timestamp_to_datetime as t2d, chained_get, timestamp_to_datetime, get_request_body, \
+    decode_cursor
 from giberno import settings
 
 
@@ -53,6 +54,12 @@ class RequestMapper:
             except Exception:
                 pagination.offset = 0
 
+        cursor = request.GET.get('cursor')
+        if cursor is not None:
+            # Пагинация по курсору (keyset): offset не используется, пустой курсор - первая страница
+            pagination.offset = 0
+            pagination.cursor = decode_cursor(cursor) if cursor else []
+
         if request.GET.get('limit') is None:
             pagination.limit = 30
         else:
@@ -1,28 +1,52 @@
-from re import sub
+from time import monotonic
 
-from django.contrib.gis.geoip2 import GeoIP2
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.timezone import now
-from geoip2.errors import AddressNotFoundError
+from loguru import logger
+from redis import RedisError
 
-from app_users.models import JwtToken, UserProfile
-from backend.utils import get_request_headers
+from app_users.models import UserProfile
+from backend.authentication import AuthCache
+from backend.profiling import profile_queries
+from backend.utils import get_request_headers, get_redis_connection, get_geo_by_ip
 
 
 class UpdateUserLastLoginDT(MiddlewareMixin):
-    def process_request(self, request):
-        header_token = request.META.get('HTTP_AUTHORIZATION', None)
-        if header_token is not None:
-            try:
-                jwt = sub('JWT ', '', request.META.get('HTTP_AUTHORIZATION', None))
-                token = sub('Bearer ', '', jwt)
-                token_obj = JwtToken.objects.get(access_token=token)
-                token_obj.user.last_login = now()
-                token_obj.user.save()
-            except JwtToken.DoesNotExist:
-                pass
-            except UserProfile.DoesNotExist:
-                pass
+    """
+        Запись last_login не чаще раза в LAST_LOGIN_UPDATE_INTERVAL сек на пользователя.
+        Пользователь берется из уже выполненной в view аутентификации (DRF проставляет request.user),
+        поэтому токен отдельно не ищется. Интервал отмечается в памяти процесса и в redis (общий для воркеров),
+        запись в бд - UPDATE одного поля без сохранения всей строки
+    """
+
+    LAST_SEEN_KEY = 'last_seen:{}'
+
+    _written = {}  # {user_id: monotonic время последней записи} в пределах процесса
+
+    def process_response(self, request, response):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            self.touch(user.id)
+        return response
+
+    @classmethod
+    def touch(cls, user_id):
+        interval = settings.LAST_LOGIN_UPDATE_INTERVAL
+        if monotonic() - cls._written.get(user_id, -interval) < interval:
+            return
+        if len(cls._written) > 100000:
+            cls._written.clear()  # Не даем словарю расти бесконечно в долгоживущем процессе
+        cls._written[user_id] = monotonic()
+
+        try:
+            if not get_redis_connection().set(cls.LAST_SEEN_KEY.format(user_id), 1, nx=True, ex=interval):
+                return  # Уже записано другим воркером в этом интервале
+        except RedisError as e:
+            logger.error(e)
+
+        UserProfile.objects.filter(pk=user_id).update(last_login=now())
+        AuthCache.invalidate_user(user_id)  # update() не шлет post_save
 
 
 class UpdateRequestGeoByIP(MiddlewareMixin):
@@ -31,17 +55,29 @@ class UpdateRequestGeoByIP(MiddlewareMixin):
         remote_ip = headers.get('X-Real-Ip', None)
         if remote_ip:
             try:
-                g = GeoIP2()
-                country = g.country(remote_ip)
-                city = g.city(remote_ip)
-                point = g.geos(remote_ip)
-                request.geo = {
-                    "country": country['country_name'],
-                    "city": city['city'],
-                    "point": point,
-                    "ip": remote_ip
-                }
-            except AddressNotFoundError:
-                print(f'   Адрес не найден для IP {remote_ip}')
+                geo = get_geo_by_ip(remote_ip)
+                if geo is not None:
+                    request.geo = geo
+                else:
+                    logger.debug(f'Адрес не найден для IP {remote_ip}')
             except Exception as e:
-                print(e)
+                logger.error(e)
+
+
+class QueryProfilerMiddleware:
+    """
+        Профилирование SQL-запросов на каждый http-запрос (включается QUERY_PROFILER).
+        Количество запросов отдается в заголовке X-Query-Count, сводка по эндпоинтам - в redis (query_profile_report)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with profile_queries(request.path) as profile:
+            response = self.get_response(request)
+            # После обработки известен маршрут, по нему запросы группируются в сводке
+            route = getattr(request.resolver_match, 'route', None)
+            profile.label = f'{request.method} {route or request.path}'
+        response['X-Query-Count'] = profile.count
+        return response
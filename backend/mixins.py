@@ -3,7 +3,7 @@ from django.contrib.gis import admin
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.fields import JSONField, HStoreField
-from django.db.models import Count, Sum, FloatField, ExpressionWrapper, Subquery, OuterRef
+from django.db.models import FloatField, ExpressionWrapper, F
 from django.db.models import UUIDField
 from django.forms import TextInput, Textarea
 from django.utils.timezone import now
@@ -24,7 +24,8 @@ from backend.errors.http_exceptions import HttpException
 from backend.mappers import RequestMapper
 from backend.permissions import AbbleToPerform
 from backend.repositories import BaseRepository
-from backend.utils import create_admin_serializer, get_request_body, user_is_admin, chained_get
+from backend.utils import create_admin_serializer, get_request_body, user_is_admin, chained_get, paginate, \
+    pagination_headers
 
 
 class CRUDSerializer(serializers.ModelSerializer):
@@ -164,27 +165,14 @@ class MakeReviewMethodProviderRepository(MasterRepository):
                 shift_id=shift
             )
 
-            # Пересчитываем количество оценок и рейтинг
+            # Пересчитываем количество оценок и рейтинг инкрементально, без агрегации по всем отзывам:
+            # новый рейтинг = (рейтинг * количество + оценка) / (количество + 1)
             self.model.objects.filter(pk=record_id).update(
-                # в update нельзя использовать результаты annotate
-                # используем annotate в Subquery
-                rating=Subquery(
-                    self.model.objects.filter(
-                        id=OuterRef('id')
-                    ).annotate(
-                        calculated_rating=ExpressionWrapper(
-                            Sum('reviews__value') / Count('reviews'),
-                            output_field=FloatField()
-                        )
-                    ).values('calculated_rating')[:1]
-                ),
-                rates_count=Subquery(
-                    self.model.objects.filter(
-                        id=OuterRef('id')
-                    ).annotate(
-                        calculated_rates_count=Count('reviews'),
-                    ).values('calculated_rates_count')[:1]
+                rating=ExpressionWrapper(
+                    (F('rating') * F('rates_count') + (value or 0)) / (F('rates_count') + 1),
+                    output_field=FloatField()
                 ),
+                rates_count=F('rates_count') + 1,
                 updated_at=now()
             )
 
@@ -252,7 +240,7 @@ class CRUDAPIView(APIView):
             serializer_class = self.serializer_class
             dataset = queryset
             dataset = dataset.order_by(*order_params).filter(**filters)
-            dataset = dataset[pagination.offset:pagination.limit]
+            dataset = paginate(dataset, pagination)
 
         else:
             self.many = True
@@ -265,7 +253,8 @@ class CRUDAPIView(APIView):
                 serializer_class = self.serializer_class
 
         serialized = serializer_class(dataset, many=self.many)
-        return Response(camelize(serialized.data), status=status.HTTP_200_OK)
+        headers = pagination_headers(pagination, dataset) if self.many else None
+        return Response(camelize(serialized.data), status=status.HTTP_200_OK, headers=headers)
 
     def post(self, request):
         data = get_request_body(request)
@@ -0,0 +1,205 @@
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from loguru import logger
+from redis import RedisError
+
+from backend.utils import get_redis_connection
+
+_current_profile = ContextVar('query_profile', default=None)
+
+_FINGERPRINT_RULES = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),  # Строковые литералы
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),  # Числа
+    (re.compile(r'\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE), 'IN (...)'),  # Списки IN любой длины
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    """ Нормализованный SQL: запросы, отличающиеся только параметрами, получают одинаковый отпечаток """
+    for pattern, replacement in _FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class QueryProfile:
+    """
+        Запись всех SQL-запросов к бд в пределах блока with, включая запросы из потоков database_sync_to_async
+        (профиль передается через contextvars).
+        Запросы группируются по отпечатку (fingerprint), повторяющиеся отпечатки - подозрение на N+1.
+
+        В тестах:
+            with QueryProfile() as profile:
+                client.get('/api/v1.0/market/vacancies')
+            profile.assert_max_queries(10)
+            profile.assert_no_n_plus_one()
+    """
+
+    def __init__(self, label=None, n_plus_one_threshold=None):
+        self.label = label
+        self.n_plus_one_threshold = n_plus_one_threshold or settings.QUERY_PROFILER_N_PLUS_ONE_THRESHOLD
+        self.queries = []  # [(sql, длительность в сек)]
+        self.started_at = None
+        self.duration = None
+        self._token = None
+
+    def __enter__(self):
+        for connection in connections.all():
+            install_profiler(connection=connection)
+        self._token = _current_profile.set(self)
+        self.started_at = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.duration = perf_counter() - self.started_at
+        _current_profile.reset(self._token)
+
+    def record(self, sql, duration):
+        self.queries.append((sql, duration))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def queries_duration(self):
+        return sum(duration for _, duration in self.queries)
+
+    def fingerprints(self):
+        return Counter(fingerprint(sql) for sql, _ in self.queries)
+
+    def n_plus_one_suspects(self):
+        """ {отпечаток: количество} для SELECT, выполненных не менее n_plus_one_threshold раз """
+        return {
+            sql: count for sql, count in self.fingerprints().most_common()
+            if count >= self.n_plus_one_threshold and sql.upper().startswith('SELECT')
+        }
+
+    def report(self):
+        lines = [
+            f'{self.label or "Запросы"}: {self.count} запросов, {self.queries_duration * 1000:.1f} мс в бд'
+            + (f' из {self.duration * 1000:.1f} мс' if self.duration is not None else '')
+        ]
+        for sql, count in self.n_plus_one_suspects().items():
+            lines.append(f'  N+1? x{count}: {sql[:300]}')
+        return '\n'.join(lines)
+
+    def assert_max_queries(self, max_count):
+        if self.count > max_count:
+            raise AssertionError(f'Ожидалось не более {max_count} запросов\n{self.report()}')
+
+    def assert_no_n_plus_one(self):
+        if self.n_plus_one_suspects():
+            raise AssertionError(f'Повторяющиеся запросы (N+1)\n{self.report()}')
+
+
+def _profiler_wrapper(execute, sql, params, many, context):
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record(sql, perf_counter() - started)
+
+
+def install_profiler(sender=None, connection=None, **kwargs):
+    if _profiler_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_profiler_wrapper)
+
+
+# Соединения, открываемые в новых потоках (database_sync_to_async, потоки celery)
+connection_created.connect(install_profiler)
+
+
+class QueryProfileStats:
+    """
+        Сводка профилирования по эндпоинтам в redis (общая для всех процессов)
+        - set query_profiler:labels - все эндпоинты/события/задачи
+        - hash query_profiler:stats:<label> {calls, queries, duration_ms, db_duration_ms, n_plus_one}
+        - zset query_profiler:suspects:<label> {отпечаток: сколько раз был подозрением на N+1}
+    """
+
+    LABELS_KEY = 'query_profiler:labels'
+    STATS_KEY = 'query_profiler:stats:{}'
+    SUSPECTS_KEY = 'query_profiler:suspects:{}'
+
+    def __init__(self):
+        self.connection = get_redis_connection()
+
+    def add(self, profile):
+        suspects = profile.n_plus_one_suspects()
+        try:
+            pipe = self.connection.pipeline(transaction=False)
+            pipe.sadd(self.LABELS_KEY, profile.label)
+            stats_key = self.STATS_KEY.format(profile.label)
+            pipe.hincrby(stats_key, 'calls', 1)
+            pipe.hincrby(stats_key, 'queries', profile.count)
+            pipe.hincrbyfloat(stats_key, 'duration_ms', profile.duration * 1000)
+            pipe.hincrbyfloat(stats_key, 'db_duration_ms', profile.queries_duration * 1000)
+            if suspects:
+                pipe.hincrby(stats_key, 'n_plus_one', 1)
+                for sql in suspects:
+                    pipe.zincrby(self.SUSPECTS_KEY.format(profile.label), 1, sql)
+            pipe.execute()
+        except RedisError as e:
+            logger.error(e)
+
+    def get_all(self):
+        result = []
+        for label in self.connection.smembers(self.LABELS_KEY):
+            label = label.decode()
+            stats = {k.decode(): float(v) for k, v in self.connection.hgetall(self.STATS_KEY.format(label)).items()}
+            suspects = self.connection.zrevrange(self.SUSPECTS_KEY.format(label), 0, 4, withscores=True)
+            result.append((label, stats, [(sql.decode(), int(count)) for sql, count in suspects]))
+        return result
+
+    def clear(self):
+        labels = [label.decode() for label in self.connection.smembers(self.LABELS_KEY)]
+        keys = [self.STATS_KEY.format(label) for label in labels] + [self.SUSPECTS_KEY.format(label) for label in labels]
+        self.connection.delete(self.LABELS_KEY, *keys)
+
+
+@contextmanager
+def profile_queries(label):
+    """ Профилирование запроса/события/задачи, если включен QUERY_PROFILER. Результат пишется в лог и в redis """
+    if not settings.QUERY_PROFILER:
+        yield None
+        return
+
+    with QueryProfile(label=label) as profile:
+        yield profile
+
+    if profile.n_plus_one_suspects():
+        logger.warning(profile.report())
+    else:
+        logger.debug(profile.report())
+    QueryProfileStats().add(profile)
+
+
+def profile_celery_tasks():
+    """ Подключение профилирования к задачам celery (task_prerun/task_postrun) """
+    from celery.signals import task_prerun, task_postrun
+
+    running = {}  # {task_id: контекстный менеджер profile_queries}
+
+    def start(task_id=None, task=None, **kwargs):
+        manager = profile_queries(f'task {task.name}')
+        manager.__enter__()
+        running[task_id] = manager
+
+    def stop(task_id=None, **kwargs):
+        manager = running.pop(task_id, None)
+        if manager is not None:
+            manager.__exit__(None, None, None)
+
+    task_prerun.connect(start, weak=False)
+    task_postrun.connect(stop, weak=False)
@@ -0,0 +1,125 @@
+from loguru import logger
+from redis import RedisError
+
+from backend.utils import get_redis_connection
+
+
+class RatingRanks:
+    """
+        Места пользователей в общем рейтинге (DenseRank по убыванию рейтинга) в redis
+        - zset rating:users {user_id: рейтинг} - упорядоченный список пользователей
+        - hash rating:users:versions {user_id: 'количество оценок:рейтинг'} - по количеству оценок отбрасываются
+          запоздавшие обновления (оценки только добавляются, количество растет)
+        - zset rating:values {рейтинг: рейтинг} + hash rating:values:counts {рейтинг: число пользователей} -
+          различные значения рейтинга, место = количество различных значений выше + 1
+
+        Изменение рейтинга одного пользователя - O(log n), места остальных не пересчитываются, а вычисляются при чтении.
+        Структура заполняется из бд при первом обращении (rebuild), ключ rating:initialized отличает
+        "нет оценок" от "не заполнено"
+    """
+
+    USERS_KEY = 'rating:users'
+    VERSIONS_KEY = 'rating:users:versions'
+    VALUES_KEY = 'rating:values'
+    VALUES_COUNTS_KEY = 'rating:values:counts'
+    INITIALIZED_KEY = 'rating:initialized'
+    PRECISION = 6  # Рейтинги сравниваются с округлением - инкрементальный пересчет дает погрешность float
+
+    # Установка рейтинга пользователя, KEYS: USERS, VERSIONS, VALUES, VALUES_COUNTS; ARGV: user_id, count, value
+    _SET_RATING = '''
+        local stored = redis.call('HGET', KEYS[2], ARGV[1])
+        local old_value = nil
+        if stored then
+            local separator = string.find(stored, ':')
+            if tonumber(string.sub(stored, 1, separator - 1)) > tonumber(ARGV[2]) then
+                return 0
+            end
+            old_value = string.sub(stored, separator + 1)
+        end
+        if old_value then
+            if redis.call('HINCRBY', KEYS[4], old_value, -1) <= 0 then
+                redis.call('HDEL', KEYS[4], old_value)
+                redis.call('ZREM', KEYS[3], old_value)
+            end
+        end
+        redis.call('HSET', KEYS[2], ARGV[1], ARGV[2] .. ':' .. ARGV[3])
+        redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+        redis.call('HINCRBY', KEYS[4], ARGV[3], 1)
+        redis.call('ZADD', KEYS[3], ARGV[3], ARGV[3])
+        return 1
+    '''
+
+    def __init__(self):
+        self.connection = get_redis_connection()
+
+    @classmethod
+    def normalize(cls, value):
+        return repr(round(float(value), cls.PRECISION))
+
+    def keys(self):
+        return [self.USERS_KEY, self.VERSIONS_KEY, self.VALUES_KEY, self.VALUES_COUNTS_KEY]
+
+    def set_rating(self, user_id, rates_count, value):
+        try:
+            self.ensure_initialized()
+            self.connection.register_script(self._SET_RATING)(
+                keys=self.keys(), args=[user_id, rates_count, self.normalize(value)]
+            )
+        except RedisError as e:
+            logger.error(e)
+
+    def get_place(self, user_id):
+        """ Место пользователя или None, если у него нет оценок """
+        return self.get_places([user_id]).get(user_id)
+
+    def get_places(self, users_ids):
+        """ Места пользователей {user_id: место} за постоянное число запросов в redis, без оценок - не попадают """
+        if not users_ids:
+            return {}
+        try:
+            self.ensure_initialized()
+            pipe = self.connection.pipeline(transaction=False)
+            for user_id in users_ids:
+                pipe.zscore(self.USERS_KEY, user_id)
+            scores = {user_id: score for user_id, score in zip(users_ids, pipe.execute()) if score is not None}
+
+            pipe = self.connection.pipeline(transaction=False)
+            for score in scores.values():
+                pipe.zcount(self.VALUES_KEY, f'({self.normalize(score)}', '+inf')
+            return {user_id: higher + 1 for user_id, higher in zip(scores, pipe.execute())}
+        except RedisError as e:
+            logger.error(e)
+            return {}
+
+    def ensure_initialized(self):
+        if not self.connection.exists(self.INITIALIZED_KEY):
+            self.rebuild()
+
+    def rebuild(self, ratings=None):
+        """
+        :param ratings: список (user_id, количество оценок, рейтинг), по умолчанию - из бд
+        """
+        if ratings is None:
+            # Локальный импорт: модели приложений импортируют backend
+            from app_users.enums import AccountType
+            from app_users.models import UserProfile
+            ratings = UserProfile.objects.filter(
+                account_type=AccountType.SELF_EMPLOYED, rating_value__isnull=False
+            ).values_list('id', 'rates_count', 'rating_value')
+
+        users, versions, values_counts = {}, {}, {}
+        for user_id, rates_count, value in ratings:
+            value = self.normalize(value)
+            users[user_id] = value
+            versions[user_id] = f'{rates_count}:{value}'
+            values_counts[value] = values_counts.get(value, 0) + 1
+
+        pipe = self.connection.pipeline()  # Замена всей структуры одной транзакцией
+        pipe.delete(*self.keys())
+        if users:
+            pipe.zadd(self.USERS_KEY, users)
+            pipe.hset(self.VERSIONS_KEY, mapping=versions)
+            pipe.zadd(self.VALUES_KEY, {value: value for value in values_counts})
+            pipe.hset(self.VALUES_COUNTS_KEY, mapping=values_counts)
+        pipe.set(self.INITIALIZED_KEY, 1)
+        pipe.execute()
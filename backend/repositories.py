@@ -1,6 +1,7 @@
 from backend.errors.enums import RESTErrors
 from backend.errors.http_exceptions import HttpException
 from backend.models import BaseModel
+from backend.utils import paginate
 
 
 class BaseRepository:
@@ -37,7 +38,7 @@ class BaseRepository:
                 records = self.model.objects.order_by(*order_by).filter(**kwargs)
             else:
                 records = self.model.objects.filter(**kwargs)
-        return records[paginator.offset:paginator.limit] if paginator else records  # [:100]
+        return paginate(records, paginator)  # [:100]
 
     def filter(self, args: list = None, kwargs={}, paginator=None, order_by: list = None):
         try:
@@ -50,7 +51,7 @@ class BaseRepository:
                 records = self.model.objects.order_by(*order_by).filter(args, **kwargs)
             else:
                 records = self.model.objects.filter(args, **kwargs)
-        return records[paginator.offset:paginator.limit] if paginator else records  # [:100]
+        return paginate(records, paginator)  # [:100]
 
     def create(self, **kwargs):
         return self.model.objects.create(**kwargs)
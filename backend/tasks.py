@@ -133,6 +133,13 @@ def async_send_push(title, message, push_data=None, sound=None, devices_ids=[],
         return None
 
 
+@app.task
+def flush_push_queue():
+    # Локальный импорт: backend.controllers сам импортирует задачи из этого модуля
+    from backend.controllers import PushController
+    PushController.flush_queue()
+
+
 @app.task
 def shops_update_static_map(shops_ids: list = None):
     mapped_entities = []
@@ -0,0 +1,87 @@
+import datetime
+from functools import lru_cache
+from time import time, monotonic
+
+import pytz
+from django.conf import settings
+from timezonefinder import TimezoneFinder
+
+from giberno.settings import TIMEZONE_GEO_CACHE_SIZE
+
+OFFSETS_PERIOD = 15 * 60  # Сек, на сколько запоминаются смещения (переходы на летнее время - на границах 15 минут)
+
+_timezone_finder = None
+_shops_timezones = {}  # {shop_id: (часовой пояс, monotonic истечения)}
+
+
+def get_timezone_finder():
+    """ Один TimezoneFinder на процесс, полигоны часовых поясов загружаются один раз """
+    global _timezone_finder
+    if _timezone_finder is None:
+        _timezone_finder = TimezoneFinder()
+    return _timezone_finder
+
+
+@lru_cache(maxsize=TIMEZONE_GEO_CACHE_SIZE)
+def timezone_name_at(lon, lat):
+    return get_timezone_finder().timezone_at(lng=lon, lat=lat)  # возвращает tz вида 'Europe/Moscow'
+
+
+def get_timezone_name_by_geo(lon, lat):
+    # Точность ~10 м, соседние точки попадают в один ключ кэша
+    return timezone_name_at(round(lon, 4), round(lat, 4))
+
+
+def offsets_period():
+    return int(time() // OFFSETS_PERIOD)
+
+
+@lru_cache(maxsize=2)
+def get_utcoffset_index(period):
+    """ {смещение от UTC в сек: первый по алфавиту часовой пояс с таким смещением} на период period """
+    utc_now = datetime.datetime.now(pytz.utc)
+    index = {}
+    for tz_name in sorted(pytz.common_timezones_set):
+        index.setdefault(utc_now.astimezone(pytz.timezone(tz_name)).utcoffset().total_seconds(), tz_name)
+    return index
+
+
+def get_timezone_name_from_utcoffset(seconds):
+    """ seconds - смещение с обратным знаком, как getTimezoneOffset в js """
+    return get_utcoffset_index(offsets_period()).get(-seconds, 'UTC')
+
+
+@lru_cache(maxsize=1024)
+def get_period_utc_offset(timezone_name, period):
+    return pytz.timezone(timezone_name).utcoffset(datetime.datetime.utcnow()).total_seconds()
+
+
+def get_utc_offset(timezone_name):
+    """ Текущее смещение часового пояса от UTC в сек, None - если пояс не указан """
+    if not timezone_name:
+        return None
+    return get_period_utc_offset(timezone_name, offsets_period())
+
+
+def get_shop_timezone_name(shop_id, default='Europe/Moscow'):
+    """ Часовой пояс города магазина, запоминается на TIMEZONE_CACHE_TTL сек """
+    entry = _shops_timezones.get(shop_id)
+    if entry is not None and entry[1] > monotonic():
+        return entry[0] or default
+
+    # Локальный импорт: модели приложений импортируют backend
+    from app_market.models import Shop
+    timezone_name = Shop.objects.filter(pk=shop_id).values_list('city__timezone', flat=True).first()
+    if len(_shops_timezones) > 100000:
+        _shops_timezones.clear()  # Не даем словарю расти бесконечно в долгоживущем процессе
+    _shops_timezones[shop_id] = (timezone_name, monotonic() + settings.TIMEZONE_CACHE_TTL)
+    return timezone_name or default
+
+
+def forget_shops_timezones(shops_ids=None):
+    """ Сброс запомненных часовых поясов магазинов (изменился магазин или город), None - всех """
+    if shops_ids is None:
+        _shops_timezones.clear()
+        return
+    for shop_id in shops_ids:
+        _shops_timezones.pop(shop_id, None)
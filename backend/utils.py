@@ -1,3 +1,4 @@
+import base64
 import csv
 import datetime
 import hashlib
@@ -5,32 +6,37 @@ import json
 import os
 import re
 import uuid
-from functools import reduce
-from io import BytesIO
+from functools import reduce, lru_cache
 from json import JSONDecodeError
 from urllib.request import urlopen, HTTPError, Request
 from uuid import UUID
 
 import exiftool
 import pytz
+import redis
 from PIL import Image, ExifTags
 from django.conf import settings
+from django.contrib.gis.geoip2 import GeoIP2
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import MeasureBase
 from django.core.files.uploadedfile import TemporaryUploadedFile
-from django.db.models import Lookup, Field
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Lookup, Field, DateTimeField, Model, Q
 from django.db.models.expressions import Func, Expression, F, Value as V
 from django.db.models.functions.datetime import TruncBase
 from django.utils.timezone import make_aware, get_current_timezone, localtime
 from djangorestframework_camel_case.util import underscoreize
 from ffmpy import FFmpeg
+from geoip2.errors import AddressNotFoundError
 from loguru import logger
-from timezonefinder import TimezoneFinder
 
 from app_media.enums import MediaFormat, FileDownloadStatus, MimeTypes
+from backend import timezones
 from backend.entity import File as FileEntity
 from backend.errors.enums import RESTErrors
 from backend.errors.http_exceptions import HttpException
 from giberno.settings import DOCUMENT_MIME_TYPES, IMAGE_MIME_TYPES, IMAGE_SIDE_MAX, IMAGE_PREVIEW_SIDE_MAX, \
-    VIDEO_MIME_TYPES, VIDEO_PREVIEW_SIDE_MAX, VIDEO_SIDE_MAX
+    VIDEO_MIME_TYPES, VIDEO_PREVIEW_SIDE_MAX, VIDEO_SIDE_MAX, GEOIP_CACHE_SIZE
 
 
 def get_request_headers(request):
@@ -109,6 +115,55 @@ def chunks(list_data, n):
     return list(chunks_func(list_data, n))
 
 
+_redis_connection = None
+
+
+def get_redis_connection():
+    """ Общее подключение к redis, пул соединений создается один раз на процесс """
+    global _redis_connection
+    if _redis_connection is None:
+        _redis_connection = redis.Redis(**settings.REDIS_CONNECTION)
+    return _redis_connection
+
+
+_geoip = None
+
+
+def get_geoip():
+    """ Один GeoIP2 на процесс, базы открываются через mmap и не перечитываются на каждый запрос """
+    global _geoip
+    if _geoip is None:
+        _geoip = GeoIP2(cache=GeoIP2.MODE_MMAP)
+    return _geoip
+
+
+@lru_cache(maxsize=GEOIP_CACHE_SIZE)
+def resolve_geo_by_ip(ip):
+    """ Страна, город и точка по IP одним запросом к базе (город и точка - только при наличии базы городов) """
+    try:
+        g = get_geoip()
+        if g._city:
+            data = g.city(ip)
+            point = Point(data['longitude'], data['latitude'], srid=settings.SRID) \
+                if data['longitude'] is not None and data['latitude'] is not None else None
+            return {'country': data['country_name'], 'city': data['city'], 'point': point}
+        return {'country': g.country(ip)['country_name'], 'city': None, 'point': None}
+    except AddressNotFoundError:
+        return None
+
+
+def get_geo_by_ip(ip):
+    """ Копия закэшированного результата, чтобы изменения в запросе не попадали в кэш """
+    geo = resolve_geo_by_ip(ip)
+    if geo is None:
+        return None
+    return {
+        **geo,
+        'point': geo['point'].clone() if geo['point'] else None,
+        'ip': ip
+    }
+
+
 def get_media_format(mime_type=None):
     if mime_type in DOCUMENT_MIME_TYPES:
         return MediaFormat.DOCUMENT.value
@@ -157,14 +212,9 @@ def rotate_image(img):
 
 def resize_image(file_entity: FileEntity):
     try:
-        # копируем объект загруженного в память файла
-
         img = Image.open(file_entity.file)
-        blob = BytesIO()
 
         img_format = str(img.format).lower()
-        img_width = img.width or None
-        img_height = img.height or None
 
         img = rotate_image(img)
 
@@ -177,18 +227,18 @@ def resize_image(file_entity: FileEntity):
         """ Изменяем размер, если выходит за установленные пределы """
         if img.width > IMAGE_SIDE_MAX or img.height > IMAGE_SIDE_MAX:
             img.thumbnail(size=(IMAGE_SIDE_MAX, IMAGE_SIDE_MAX))
-            img_width = img.width
-            img_height = img.height
-
-        img.save(blob, img_format)
+        img_width = img.width
+        img_height = img.height
 
+        # Каждый вариант кодируется один раз, сразу во временный файл на диске
         result = TemporaryUploadedFile(
-            size=blob.__sizeof__(),
+            size=0,
             content_type=file_entity.file.content_type,
             name=file_entity.file.name,
             charset=file_entity.file.charset
         )
         img.save(result, img_format)
+        result.size = result.tell()
 
         """Создаем превью для изображения"""
 
@@ -196,16 +246,14 @@ def resize_image(file_entity: FileEntity):
         if img.width > IMAGE_PREVIEW_SIDE_MAX or img.height > IMAGE_PREVIEW_SIDE_MAX:
             img.thumbnail(size=(IMAGE_PREVIEW_SIDE_MAX, IMAGE_PREVIEW_SIDE_MAX))
 
-        img.save(blob, img_format)
-
         preview = TemporaryUploadedFile(
-            size=blob.__sizeof__(),
+            size=0,
             content_type=file_entity.file.content_type,
             name=file_entity.file.name,
             charset=file_entity.file.charset
         )
-
         img.save(preview, img_format)
+        preview.size = preview.tell()
 
         file_entity.file = result
         file_entity.preview = preview
@@ -322,25 +370,34 @@ def convert_video(file_entity: FileEntity):
         file_entity.file = None
 
 
-def get_media_metadata(file_url):
-    """ https://github.com/smarnach/pyexiftool/issues/26 """
-    with exiftool.ExifTool() as et:
-        # print(et.get_metadata(file_url))
+_exiftool = None
 
-        _ROTATION = 'Composite:Rotation'
-        _IMAGE_SIZE = 'Composite:ImageSize'
-        _FILE_SIZE = 'File:FileSize'
-        _DURATION = 'QuickTime:Duration'
 
-        tags = et.get_tags([_ROTATION, _IMAGE_SIZE, _FILE_SIZE, _DURATION], file_url)
-        image_size = tags[_IMAGE_SIZE].split(' ') if _IMAGE_SIZE in tags else (0, 0)
-        return {
-            'width': int(image_size[0]),
-            'height': int(image_size[1]),
-            'rotation': tags[_ROTATION] if _ROTATION in tags else 0,
-            'duration': tags[_DURATION] if _DURATION in tags else 0,
-            'size': tags[_FILE_SIZE] if _FILE_SIZE in tags else 0,
-        }
+def get_exiftool():
+    """ Один процесс exiftool на воркер вместо запуска нового на каждый файл """
+    global _exiftool
+    if _exiftool is None or not _exiftool.running:
+        _exiftool = exiftool.ExifTool()
+        _exiftool.start()
+    return _exiftool
+
+
+def get_media_metadata(file_url):
+    """ https://github.com/smarnach/pyexiftool/issues/26 """
+    _ROTATION = 'Composite:Rotation'
+    _IMAGE_SIZE = 'Composite:ImageSize'
+    _FILE_SIZE = 'File:FileSize'
+    _DURATION = 'QuickTime:Duration'
+
+    tags = get_exiftool().get_tags([_ROTATION, _IMAGE_SIZE, _FILE_SIZE, _DURATION], file_url)
+    image_size = tags[_IMAGE_SIZE].split(' ') if _IMAGE_SIZE in tags else (0, 0)
+    return {
+        'width': int(image_size[0]),
+        'height': int(image_size[1]),
+        'rotation': tags[_ROTATION] if _ROTATION in tags else 0,
+        'duration': tags[_DURATION] if _DURATION in tags else 0,
+        'size': tags[_FILE_SIZE] if _FILE_SIZE in tags else 0,
+    }
 
 
 def has_latin(text: str = None):
@@ -423,6 +480,125 @@ def filter_valid_uuids(uuids_list):
     return list(filter(lambda x: is_valid_uuid(x), uuids_list)) if uuids_list and isinstance(uuids_list, list) else []
 
 
+class CursorJSONEncoder(DjangoJSONEncoder):
+    """ DjangoJSONEncoder обрезает datetime до миллисекунд - в курсоре нужна полная точность ключа сортировки """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return {'dt': o.isoformat()}
+        return super().default(o)
+
+
+def cursor_object_hook(obj):
+    if obj.keys() == {'dt'}:
+        return datetime.datetime.fromisoformat(obj['dt'])
+    return obj
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, cls=CursorJSONEncoder).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()), object_hook=cursor_object_hook)
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list):
+        raise HttpException(status_code=RESTErrors.BAD_REQUEST.value, detail='Невалидный курсор')
+    return values
+
+
+def get_order_fields(records):
+    """ Поля сортировки queryset для пагинации по курсору, с pk в конце для однозначности """
+    query = records.query
+    if query.order_by:
+        ordering = list(query.order_by)
+    elif query.default_ordering:
+        ordering = list(query.get_meta().ordering)
+    else:
+        ordering = []
+
+    if any(not isinstance(field, str) or field == '?' for field in ordering):
+        raise HttpException(
+            status_code=RESTErrors.BAD_REQUEST.value, detail='Пагинация по курсору не поддерживается для этого списка'
+        )
+
+    # Сгруппированные values() не содержат pk, ключом сортировки служат поля группировки
+    if query.group_by is None and not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+        ordering.append('-pk' if ordering and ordering[-1].startswith('-') else 'pk')
+    return ordering
+
+
+def keyset_filter(order_fields, values):
+    """
+        Условие "строго после записи с values" для сортировки order_fields.
+        NULL в PostgreSQL больше любых значений: при ASC идут последними, при DESC - первыми
+    """
+    condition = None
+    equal = Q()
+    for field, value in zip(order_fields, values):
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        if value is None:
+            after = Q(**{f'{name}__isnull': False}) if descending else None
+            same = Q(**{f'{name}__isnull': True})
+        else:
+            after = Q(**{f'{name}__lt' if descending else f'{name}__gt': value})
+            if not descending:
+                after |= Q(**{f'{name}__isnull': True})
+            same = Q(**{name: value})
+        if after is not None:
+            condition = equal & after if condition is None else condition | (equal & after)
+        equal &= same
+    return condition if condition is not None else Q(pk__in=[])
+
+
+def paginate(records, paginator):
+    """ Страница queryset по offset/limit или, если передан cursor, по ключу сортировки (keyset) """
+    if not paginator:
+        return records
+    if paginator.cursor is None:
+        return records[paginator.offset:paginator.limit]
+
+    order_fields = get_order_fields(records)
+    records = records.order_by(*order_fields)
+    if paginator.cursor:
+        if len(paginator.cursor) != len(order_fields):
+            raise HttpException(status_code=RESTErrors.BAD_REQUEST.value, detail='Курсор не соответствует сортировке')
+        records = records.filter(keyset_filter(order_fields, paginator.cursor))
+    paginator.order_fields = order_fields
+    return records[:paginator.limit - paginator.offset]
+
+
+def get_next_cursor(paginator, rows):
+    """ Курсор следующей страницы по последней записи, None - если страница неполная или пагинация по offset """
+    if not paginator or paginator.cursor is None or not paginator.order_fields:
+        return None
+    rows = list(rows)
+    if not rows or len(rows) < paginator.limit - paginator.offset:
+        return None
+
+    last = rows[-1]
+    values = []
+    for field in paginator.order_fields:
+        value = last
+        for attr in field.lstrip('-').split('__'):
+            value = chained_get(value, attr)
+        if isinstance(value, Model):
+            value = value.pk
+        elif isinstance(value, MeasureBase):  # Аннотация Distance - сравнивается в метрах
+            value = value.standard
+        values.append(value)
+    return encode_cursor(values)
+
+
+def pagination_headers(paginator, rows):
+    """ Заголовки ответа списка: Next-Cursor при пагинации по курсору """
+    next_cursor = get_next_cursor(paginator, rows)
+    return {'Next-Cursor': next_cursor} if next_cursor else None
+
+
 class SimpleFunc(Func):
     def __init__(self, field, *values, **extra):
         if not isinstance(field, Expression):
@@ -451,6 +627,26 @@ class RruleListOccurences(Func):
     template = "%(function)s(%(expressions)s, 'Zeus')"
 
 
+class DateAtTimeTZ(Func):
+    """
+        Дата + время, интерпретированные в указанном часовом поясе -> TIMESTAMPTZ
+        (date + time) AT TIME ZONE tz
+    """
+    template = "((%(date)s + %(time)s::TIME) AT TIME ZONE %(tz)s)"
+
+    def __init__(self, date, time_value, tz_name, **extra):
+        super().__init__(date, V(time_value), V(tz_name), output_field=DateTimeField(), **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        date, time_value, tz_name = self.get_source_expressions()
+        date_sql, date_params = compiler.compile(date)
+        time_sql, time_params = compiler.compile(time_value)
+        tz_sql, tz_params = compiler.compile(tz_name)
+        return self.template % {
+            'date': date_sql, 'time': time_sql, 'tz': tz_sql
+        }, (*date_params, *time_params, *tz_params)
+
+
 # ####
 
 
@@ -577,6 +773,13 @@ class DateTZLte(CustomLookupBase):
     parametric_string = "(%s AT TIME ZONE timezone)::DATE <= %s :: DATE"
 
 
+@Field.register_lookup
+class DateTodayTZ(CustomLookupBase):
+    # Кастомный lookup для сравнения DATE c датой переданного момента во временной зоне из поля timezone
+    lookup_name = 'date_todaytz'
+    parametric_string = "%s = (%s AT TIME ZONE timezone)::DATE"
+
+
 @Field.register_lookup
 class MSLteContains(CustomLookupBase):
     # Кастомный lookup для фильтрации DateTime по миллисекундам (в бд записи с точностью до МИКРОсекунд)
@@ -601,21 +804,12 @@ class NowPlusMinutesTZ(CustomLookupBase):
 
 
 def get_timezone_name_from_utcoffset(seconds):
-    utc_offset = datetime.timedelta(seconds=seconds)
-    utc_now = datetime.datetime.now(pytz.utc)  # current time UTC
-    tz_list = [tz for tz in map(pytz.timezone, pytz.common_timezones_set) if
-               utc_now.astimezone(tz).utcoffset() == -utc_offset]
-    if tz_list:
-        return tz_list[0]
-
-    return 'UTC'
+    return timezones.get_timezone_name_from_utcoffset(seconds)
 
 
 def get_timezone_name_by_geo(lon, lat):
     try:
-        tf = TimezoneFinder()
-        timezone_name = tf.timezone_at(lng=lon, lat=lat)  # возвращает tz вида 'Europe/Moscow'
-        return timezone_name
+        return timezones.get_timezone_name_by_geo(lon, lat)
     except Exception as e:
         logger.error(e)
         return 'UTC'
@@ -108,7 +108,7 @@ class TermsView(APIView):
     @staticmethod
     def post(request):
         request.user.terms_accepted = True
-        request.user.save()
+        request.user.save(update_fields=['terms_accepted', 'updated_at'])
         return Response(None, status=status.HTTP_204_NO_CONTENT)
 
 
@@ -125,5 +125,5 @@ class DocumentsView(APIView):
         request.user.terms_accepted = True
         request.user.policy_accepted = True
         request.user.agreement_accepted = True
-        request.user.save()
+        request.user.save(update_fields=['terms_accepted', 'policy_accepted', 'agreement_accepted', 'updated_at'])
         return Response(None, status=status.HTTP_204_NO_CONTENT)
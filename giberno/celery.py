@@ -2,10 +2,19 @@ from __future__ import absolute_import, unicode_literals
 
 import os
 
-from celery import Celery
+from celery import Celery, signals
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'giberno.settings')
 
 app = Celery('giberno')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+
+@signals.worker_init.connect
+def setup_query_profiler(**kwargs):
+    # Локальные импорты: модуль загружается до настройки django
+    from django.conf import settings
+    if settings.QUERY_PROFILER:
+        from backend.profiling import profile_celery_tasks
+        profile_celery_tasks()
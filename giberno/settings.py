@@ -75,12 +75,17 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_EXPOSE_HEADERS = [
-    'Total-Count'
+    'Total-Count',
+    'Next-Cursor'
 ]
 
 INTERNAL_IPS = ("127.0.0.1",)  # DebugToolbar
 
 GEOIP_PATH = os.path.join('backend')
+GEOIP_CACHE_SIZE = 10000  # Количество IP в LRU-кэше результатов геолокации на процесс
+TIMEZONE_GEO_CACHE_SIZE = 10000  # Количество точек в LRU-кэше часовых поясов по координатам на процесс
+TIMEZONE_CACHE_TTL = 60 * 10  # Сек, сколько процесс помнит часовой пояс магазина
+GEOFENCE_CACHE_TTL = 60  # Сек, сколько процесс помнит геозоны смен и сегодняшние отклики работников
 ROOT_URLCONF = 'giberno.urls'
 
 TEMPLATES = [
@@ -122,7 +127,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'backend.authentication.CachedJWTAuthentication',
     ),
     'UNAUTHENTICATED_USER': None,
     'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.NamespaceVersioning',
@@ -259,6 +264,11 @@ TELEGRAM_BOT_PASSWORD = os.getenv('TELEGRAM_BOT_PASSWORD', '')
 TELEGRAM_URL = 'https://api.telegram.org/bot'
 
 FCM_MAX_DEVICES_PER_REQUEST = 500  # Количество пушей за один запрос в Firebase
+PUSH_BATCH_WINDOW = 1  # Сек, за которые накапливаются пуши в очереди перед пакетной обработкой
+PUSH_BATCH_SIZE = 1000  # Максимальное количество заданий из очереди пушей за одну обработку
+# Вместо Firebase пуши принимает локальная заглушка (для бенчмарков и локальной разработки),
+# счетчики непрочитанных уведомлений в redis при этом не увеличиваются
+PUSH_FAKE_SENDER = True if os.getenv('PUSH_FAKE_SENDER', False) in ['True', 'true', 'TRUE', True] else False
 
 LOGGING = {
     'version': 1,
@@ -325,6 +335,27 @@ CONSTANCE_REDIS_CONNECTION = {
     'db': 0,
 }
 
+LAST_LOGIN_UPDATE_INTERVAL = 60  # Сек, last_login пишется в бд не чаще этого интервала на пользователя
+
+# Кэш JWT-аутентификации в памяти процесса (backend.authentication)
+JWT_AUTH_CACHE_TTL = 60  # Сек, сколько пользователь по токену берется из кэша без обращения к бд
+JWT_AUTH_CACHE_SIZE = 50000  # Максимум токенов в кэше на процесс
+JWT_AUTH_SYNC_INTERVAL = 2  # Сек, как часто процесс дочитывает из redis отозванные токены и измененных пользователей
+
+# Профилирование SQL-запросов (backend.profiling) на каждый http-запрос, событие сокета и задачу celery
+QUERY_PROFILER = True if os.getenv('QUERY_PROFILER', False) in ['True', 'true', 'TRUE', True] else False
+QUERY_PROFILER_N_PLUS_ONE_THRESHOLD = 5  # Сколько одинаковых SELECT за запрос считать подозрением на N+1
+
+if QUERY_PROFILER:
+    MIDDLEWARE.insert(0, 'backend.middlewares.QueryProfilerMiddleware')
+
+# Общее подключение к redis для счетчиков и кэшей приложения (отдельная база, не пересекается с constance)
+REDIS_CONNECTION = {
+    'host': os.getenv('REDIS_HOST', '127.0.0.1'),
+    'port': 6379,
+    'db': int(os.getenv('REDIS_APP_DB', 1)),
+}
+
 CONSTANCE_CONFIG = {
     'TELEGRAM_BOT_PASSWORD': (
         TELEGRAM_BOT_PASSWORD, 'Пароль для активации телеграм бота', str
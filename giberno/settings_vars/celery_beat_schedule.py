@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from celery.schedules import crontab
 
 celery_beat_schedule = {
@@ -11,14 +13,41 @@ celery_beat_schedule = {
     },
     'update_appeals': {
         'task': 'app_market.tasks.update_appeals',
-        'schedule': crontab(minute='*')
+        # Выборка по индексу next_transition_at дешевая, поэтому опрашиваем чаще раза в минуту
+        'schedule': timedelta(seconds=10)
     },
     'auto_switch_to_bot': {
         'task': 'app_chats.tasks.check_abandoned_chats',
         'schedule': crontab(minute='*')
     },
-    'check_users_daily_tasks_on_completed_shifts': {
-        'task': 'app_games.tasks.check_users_daily_tasks_on_completed_shifts',
+    'extend_shift_occurrences': {
+        'task': 'app_market.tasks.extend_shift_occurrences',
+        'schedule': crontab(minute=5, hour=0)  # раз в сутки
+    },
+    'check_marked_users_daily_tasks': {
+        'task': 'app_games.tasks.check_marked_users_daily_tasks',
+        # Только смз, отмеченные событиями (см. app_games.signals)
         'schedule': crontab(minute='*/3')
+    },
+    'flush_vacancies_views': {
+        'task': 'app_market.tasks.flush_vacancies_views',
+        'schedule': crontab(minute='*')
+    },
+    'requeue_stuck_media': {
+        'task': 'app_media.tasks.requeue_stuck_media',
+        'schedule': crontab(minute='*/5')
+    },
+    'flush_users_locations': {
+        'task': 'app_users.tasks.flush_users_locations',
+        'schedule': timedelta(seconds=10)
+    },
+    'refresh_users_rating': {
+        'task': 'app_users.tasks.refresh_users_rating',
+        'schedule': crontab(minute='*/10')
+    },
+    'flush_push_queue': {
+        'task': 'backend.tasks.flush_push_queue',
+        # Страховка: обычно очередь пушей разбирается отложенной задачей, запланированной при постановке
+        'schedule': crontab(minute='*')
     }
 }